@@ -7,6 +7,9 @@ from callbacks.main_callbacks import *
 from callbacks.tab_callbacks import *
 from callbacks.modal_callbacks import *
 from data.queries import refresh_data
+from callbacks.scopes import set_client_cookie
+from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.migrations import apply_migrations
 
 # Инициализация приложения Dash
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
@@ -14,6 +17,9 @@ app = dash.Dash(__name__, suppress_callback_exceptions=True)
 # Установка layout
 app.layout = create_layout()
 
+# Идентификатор клиента для отмены устаревших запросов его callback
+app.server.after_request(set_client_cookie)
+
 # Настройка HTML шаблона
 try:
     with open("Рисунок1.png", "rb") as image_file:
@@ -418,6 +424,13 @@ if __name__ == '__main__':
     default_start = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
     default_end = datetime.now().strftime('%Y-%m-%d')
     
+    # Схема витрин rollup.* (иначе: python -m data.migrations)
+    if CLICKHOUSE_CONFIG.get('apply_migrations', False):
+        try:
+            apply_migrations()
+        except Exception as e:
+            print(f"Ошибка применения миграций: {e}")
+    
     refresh_data(default_start, default_end)
     
     app.run(host='0.0.0.0', port=8056, debug=False)
\ No newline at end of file
@@ -9,10 +9,11 @@ from data.queries import (
     get_problematic_hours, get_orders_table, get_arrival_timeliness,
     get_order_timeliness, get_fines_data, get_employee_analytics,
     get_employee_operations_detail, get_employee_fines_details,
-    get_employees_on_shift, refresh_data, get_error_hours_top_data,
-    get_storage_cells_stats, get_all_storage_data, filter_storage_data,
-    get_revision_stats, get_placement_errors  # НОВЫЕ ИМПОРТЫ
+    get_employees_on_shift, get_range_snapshot, get_error_hours_top_data,
+    get_all_storage_data, filter_storage_data,
+    get_general_kpi_bundle
 )
+from callbacks.scopes import scoped_callback
 from components.charts import (
     create_order_accuracy_chart, create_problematic_hours_chart,
     create_timeliness_chart, create_operations_type_chart,
@@ -41,24 +42,26 @@ def update_last_update_time(start_date):
     [Input('global-date-range-picker', 'start_date'),
      Input('global-date-range-picker', 'end_date')]
 )
+@scoped_callback()
 def update_global_date_range_and_data(start_date, end_date):
     """Обновление глобального фильтра дат и загрузка данных"""
     if start_date and end_date:
         start_str = start_date[:10] if isinstance(start_date, str) else start_date
         end_str = end_date[:10] if isinstance(end_date, str) else end_date
         
-        refresh_data(start_str, end_str)
+        # Один снимок на диапазон, общий для всех пользователей
+        snapshot = get_range_snapshot(start_str, end_str)
         
-        # Получаем актуальные данные
-        performance_data_cache = get_performance_data(start_str, end_str)
-        shift_comparison_cache = get_shift_comparison(start_str, end_str)
-        problematic_hours_cache = get_problematic_hours(start_str, end_str)
-        error_hours_cache = get_error_hours_top_data(start_str, end_str)
-        
-        return {
-            'start_date': start_str,
-            'end_date': end_str
-        }, performance_data_cache, shift_comparison_cache, problematic_hours_cache, error_hours_cache
+        return (
+            {
+                'start_date': start_str,
+                'end_date': end_str
+            },
+            snapshot['performance_data'],
+            snapshot['shift_comparison'],
+            snapshot['problematic_hours'],
+            snapshot['error_hours']
+        )
     
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
@@ -77,6 +80,7 @@ def update_global_date_range_and_data(start_date, end_date):
      Output('order-accuracy-detail', 'children')],
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_main_kpi_cards(date_range):
     """Обновление KPI карточек на главной вкладке"""
     if not date_range:
@@ -87,15 +91,13 @@ def update_main_kpi_cards(date_range):
     end_date = date_range['end_date']
     
     try:
-        # 1. Получаем данные по ревизиям
-        revision_stats = get_revision_stats()
-        
-        # 2. Получаем данные по ошибкам размещения
-        placement_stats = get_placement_errors()
-        
-        # 3. Получаем остальные данные
-        accuracy, orders_without_errors, total_orders_accuracy, error_orders = get_order_accuracy(start_date, end_date)
-        storage_stats = get_storage_cells_stats()
+        # 1-3. Все карточки вкладки одним запросом
+        kpi = get_general_kpi_bundle(start_date, end_date)
+        revision_stats = kpi.revisions
+        placement_stats = kpi.placement
+        storage_stats = kpi.storage
+        accuracy = kpi.accuracy['accuracy']
+        orders_without_errors = kpi.accuracy['orders_without_errors']
         
         # 4. Форматируем KPI значения
         
@@ -273,6 +275,7 @@ def update_shift_employees_table(position_filter, brigade_filter):
     Output('shift-stats-info', 'children'),
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_shift_stats_info(date_range):
     """Обновление информации о смене в общей сводке"""
     
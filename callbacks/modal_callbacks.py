@@ -6,6 +6,7 @@ from data.queries import (
     get_employee_analytics, get_employee_operations_detail,
     get_employee_fines_details
 )
+from callbacks.scopes import scoped_callback
 from components.charts import (
     create_operations_type_chart, create_time_distribution_pie_echarts,
     create_idle_intervals_bar_echarts, create_employee_fines_chart,
@@ -33,6 +34,7 @@ from components.charts import (
      State("performance-data-cache", "data")],
     prevent_initial_call=True
 )
+@scoped_callback()
 def handle_analytics_modal(close_clicks, employee_clicks, selected_analytics_employee, date_range, performance_data):
     ctx = dash.callback_context
     if not ctx.triggered:
@@ -270,6 +272,7 @@ def update_timeline_chart(selected_date, selected_interval, employee_name, curre
      State("global-date-range", "data")],
     prevent_initial_call=True
 )
+@scoped_callback()
 def handle_fines_modal(close_clicks, fines_clicks, selected_fines_employee, fines_data, date_range):
     ctx = dash.callback_context
     if not ctx.triggered:
@@ -0,0 +1,53 @@
+import functools
+import uuid
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.clickhouse_client import QueryCancelledError, query_scope
+
+# Cookie с идентификатором браузера: вытеснение действует в пределах клиента
+CLIENT_COOKIE = 'dashboard_client_id'
+
+# Крайний срок для всех запросов одного callback (секунды)
+CALLBACK_TIMEOUT = CLICKHOUSE_CONFIG.get('callback_timeout', 60)
+
+
+def set_client_cookie(response):
+    """after_request: выдача идентификатора клиента, если его еще нет"""
+    if CLIENT_COOKIE not in flask.request.cookies:
+        response.set_cookie(CLIENT_COOKIE, uuid.uuid4().hex, httponly=True, samesite='Lax')
+    return response
+
+
+def _scope_key(name):
+    """Ключ области: callback и клиент; без cookie вытеснения нет"""
+    if not flask.has_request_context():
+        return None
+    client_id = flask.request.cookies.get(CLIENT_COOKIE)
+    return f"{name}:{client_id}" if client_id else None
+
+
+def scoped_callback(timeout=CALLBACK_TIMEOUT):
+    """
+    Запросы callback в общей области query_scope.
+
+    Все запросы callback укладываются в timeout секунд, а новый вызов
+    того же callback тем же клиентом снимает на сервере запросы
+    предыдущего. Вытесненный вызов не обновляет выходы (PreventUpdate).
+    Декоратор ставится под @callback.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with query_scope(_scope_key(fn.__name__), timeout=timeout) as scope:
+                try:
+                    result = fn(*args, **kwargs)
+                except QueryCancelledError:
+                    raise PreventUpdate
+                if scope.cancelled:
+                    raise PreventUpdate
+                return result
+        return wrapper
+    return decorator
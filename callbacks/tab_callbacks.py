@@ -5,6 +5,8 @@ from data.queries import (
     get_orders_table, get_arrival_timeliness, get_order_timeliness,
     get_fines_data, get_shift_comparison, get_timeliness_chart_data
 )
+from data.clickhouse_client import run_batch
+from callbacks.scopes import scoped_callback
 from components.charts import (
     create_order_accuracy_chart, create_problematic_hours_chart,
     create_timeliness_chart, create_fines_pie_chart, create_fines_amount_bar_chart
@@ -15,6 +17,7 @@ from components.charts import (
     Output('orders-table-body', 'children'),
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_orders_table(date_range):
     """Обновление таблицы заказов"""
     if not date_range:
@@ -93,6 +96,7 @@ def update_orders_table(date_range):
      Output('delayed-orders-kpi', 'children')],
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_timeliness_kpi(date_range):
     """Обновление KPI своевременности"""
     if not date_range:
@@ -102,8 +106,10 @@ def update_timeliness_kpi(date_range):
     end_date = date_range['end_date']
     
     try:
-        timely_arrivals, delayed_arrivals = get_arrival_timeliness(start_date, end_date)
-        timely_orders, delayed_orders = get_order_timeliness(start_date, end_date)
+        (timely_arrivals, delayed_arrivals), (timely_orders, delayed_orders) = run_batch([
+            lambda: get_arrival_timeliness(start_date, end_date),
+            lambda: get_order_timeliness(start_date, end_date)
+        ])
         
         return (
             str(timely_arrivals),
@@ -121,6 +127,7 @@ def update_timeliness_kpi(date_range):
      Output('delayed-client-chart', 'option')],
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_timeliness_charts(date_range):
     """Обновление диаграмм своевременности"""
     if not date_range:
@@ -153,6 +160,7 @@ def update_timeliness_charts(date_range):
      Output('avg-fine-amount-kpi', 'children')],
     [Input('global-date-range', 'data')]
 )
+@scoped_callback()
 def update_fines_data(date_range):
     """Обновление данных штрафов"""
     if not date_range:
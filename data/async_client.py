@@ -0,0 +1,315 @@
+import asyncio
+import json
+import os
+
+try:
+    import aiohttp
+except ImportError:  # нужен только асинхронному воркеру
+    aiohttp = None
+
+from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.cache import AsyncSingleFlight
+from data.clickhouse_client import (
+    BaseClickHouseClient, ClickHouseError, QueryCancelledError, QueryTimeoutError,
+    batch_max_workers, cache_result, decode_block, decode_json_compact, kill_query_async,
+    profile_settings, query_cache, query_cache_key, raise_if_cancelled, report_error, watermarks
+)
+from data.result import QueryResult
+from data.watermarks import cache_meta
+
+
+class AsyncClickHouseHTTPClient(BaseClickHouseClient):
+    """
+    Асинхронный HTTP клиент для ClickHouse на aiohttp.
+
+    Запросы собираются так же, как в синхронном клиенте. Соединения
+    держит TCPConnector aiohttp: не больше max_per_host одновременных
+    запросов к хосту, простаивающие keep-alive соединения закрываются
+    через idle_timeout. Сессия создается лениво в работающем цикле
+    событий и пересоздается после fork или смены цикла.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.max_per_host = config.get('async_max_per_host', 32)
+        self.idle_timeout = config.get('pool_idle_timeout', 8.0)
+        self._session = None
+        self._loop = None
+        self._pid = None
+        self._stats = {'requests': 0, 'in_flight': 0, 'timeouts': 0, 'cancelled': 0, 'errors': 0}
+
+    def _get_session(self):
+        if aiohttp is None:
+            raise RuntimeError("Для асинхронного клиента ClickHouse нужен пакет aiohttp")
+        loop = asyncio.get_running_loop()
+        if (self._session is None or self._session.closed
+                or self._loop is not loop or self._pid != os.getpid()):
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=self.max_per_host,
+                keepalive_timeout=self.idle_timeout
+            )
+            # Сессию другого цикла закрыть из этого нельзя, она просто отбрасывается
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._loop = loop
+            self._pid = os.getpid()
+        return self._session
+
+    def _request(self, query, params, settings, read_timeout=None, external_tables=None):
+        """Контекстный менеджер ответа aiohttp для запроса"""
+        method, url_params, body, headers = self._build_request(query, params, settings,
+                                                                external_tables)
+        return self._get_session().request(
+            method,
+            self.base_url,
+            params={key: str(value) for key, value in url_params.items()},
+            data=body,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=read_timeout)
+        )
+
+    @staticmethod
+    def _response_error(body, scope):
+        if scope is not None and scope.cancelled:
+            return QueryCancelledError("Запрос вытеснен более новым")
+        return ClickHouseError(body[:500].decode('utf-8', 'replace'))
+
+    async def _execute(self, query, params, scope, settings, external_tables=None):
+        self._stats['requests'] += 1
+        self._stats['in_flight'] += 1
+        try:
+            async with self._request(query, params, settings,
+                                     external_tables=external_tables) as response:
+                # aiohttp сам распаковывает gzip по Content-Encoding
+                body = await response.read()
+                if response.status != 200:
+                    raise self._response_error(body, scope)
+            names, types, rows = decode_json_compact(body)
+            return QueryResult.from_rows(names, types, rows, nbytes=len(body))
+        finally:
+            self._stats['in_flight'] -= 1
+
+    async def execute(self, query, params=None, raise_errors=False, timeout=None, settings=None,
+                      external_tables=None):
+        """
+        Асинхронное выполнение SQL запроса.
+
+        Через timeout секунд (по умолчанию timeout из конфигурации, не
+        дольше крайнего срока области query_scope) запрос отменяется:
+        соединение закрывается, запрос снимается на сервере, а вызывающий
+        получает QueryTimeoutError. По умолчанию при ошибке возвращается
+        пустой результат, как в синхронном клиенте.
+        """
+        try:
+            scope, query_id, timeout, settings = self._query_limits(timeout, settings)
+            if scope is not None:
+                scope.register(query_id)
+            try:
+                return await asyncio.wait_for(
+                    self._execute(query, params, scope, settings, external_tables), timeout
+                )
+            except asyncio.TimeoutError:
+                self._stats['timeouts'] += 1
+                kill_query_async(query_id)
+                raise QueryTimeoutError(f"Запрос ClickHouse отменен по таймауту {timeout:g} с")
+            finally:
+                if scope is not None:
+                    scope.unregister(query_id)
+        except asyncio.CancelledError:
+            self._stats['cancelled'] += 1
+            raise
+        except Exception:
+            self._stats['errors'] += 1
+            if raise_errors:
+                raise
+            return QueryResult.empty()
+
+    async def execute_stream(self, query, params=None, block_rows=10000, timeout=None,
+                             settings=None):
+        """
+        Асинхронное потоковое выполнение запроса блоками QueryResult.
+
+        timeout ограничивает ожидание каждой порции ответа, а не весь
+        поток. Прерванный цикл async for закрывает соединение, и сервер
+        отменяет запрос.
+        """
+        scope, query_id, timeout, settings = self._query_limits(timeout, settings)
+        # Поток может читаться долго, общий срок выполнения на сервере не ставим
+        del settings['max_execution_time']
+        if scope is not None:
+            scope.register(query_id)
+        try:
+            async for block in self._stream_blocks(query, params, scope, settings, timeout, block_rows):
+                yield block
+        finally:
+            if scope is not None:
+                scope.unregister(query_id)
+
+    async def _stream_blocks(self, query, params, scope, settings, timeout, block_rows):
+        async with self._request(query, params, settings, read_timeout=timeout) as response:
+            if response.status != 200:
+                body = await response.read()
+                raise self._response_error(body, scope)
+
+            lines = _iter_lines(response.content)
+            try:
+                names = json.loads(await lines.__anext__())
+                types = json.loads(await lines.__anext__())
+            except StopAsyncIteration:
+                return
+
+            batch = []
+            batch_bytes = 0
+            async for line in lines:
+                if not line:
+                    continue
+                batch.append(line)
+                batch_bytes += len(line)
+                if len(batch) >= block_rows:
+                    yield decode_block(names, types, batch, batch_bytes)
+                    batch = []
+                    batch_bytes = 0
+            if batch:
+                yield decode_block(names, types, batch, batch_bytes)
+
+    def stats(self):
+        """Статистика асинхронных запросов"""
+        return dict(self._stats)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+async def _iter_lines(content, chunk_size=65536):
+    """Строки ответа по порциям без ограничения на длину строки"""
+    pending = b''
+    async for chunk in content.iter_chunked(chunk_size):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+# Асинхронный клиент с теми же настройками подключения
+async_clickhouse_client = AsyncClickHouseHTTPClient(CLICKHOUSE_CONFIG)
+
+# Одинаковые запросы из разных корутин идут в ClickHouse один раз
+async_single_flight = AsyncSingleFlight()
+
+# Фоновые обновления устаревших записей (ссылки держим до завершения)
+_refresh_tasks = {}
+
+
+async def _cache_call(fn, *args):
+    """
+    Вызов кэша. С общим хранилищем (диск, SQLite) вызов выполняется в пуле
+    потоков цикла событий: чтение и запись файлов не блокируют корутины.
+    """
+    if query_cache.backend is None:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def _fetch_into_cache_async(cache_key, query, params, ttl, policy, timeout, profile,
+                                  external_tables=None):
+    async def fetch():
+        cached, stale = query_cache.peek(cache_key)
+        if cached is not None and not stale:
+            return cached
+        meta = watermarks.stamp(cache_meta(query, params))
+        fetched = await async_clickhouse_client.execute(query, params, raise_errors=True,
+                                                        timeout=timeout,
+                                                        settings=profile_settings(profile),
+                                                        external_tables=external_tables)
+        return await _cache_call(cache_result, cache_key, fetched, meta, ttl, policy)
+
+    try:
+        return await async_single_flight.do(cache_key, fetch)
+    except QueryCancelledError:
+        # Общий запрос вела вытесненная область другого вызова
+        raise_if_cancelled()
+        return await async_single_flight.do(cache_key, fetch)
+
+
+def _refresh_in_background_async(cache_key, query, params, policy, timeout, profile,
+                                 external_tables=None):
+    if cache_key in _refresh_tasks:
+        return
+
+    async def refresh():
+        try:
+            await _fetch_into_cache_async(cache_key, query, params, None, policy, timeout, profile,
+                                          external_tables)
+        except Exception as e:
+            # Старое значение остается в кэше до жесткого срока
+            report_error("Ошибка фонового обновления запроса ClickHouse", e)
+        finally:
+            _refresh_tasks.pop(cache_key, None)
+
+    _refresh_tasks[cache_key] = asyncio.ensure_future(refresh())
+
+
+async def execute_query_cached_async(query, params=None, ttl=300, policy=None, timeout=None,
+                                     profile=None, external_tables=None):
+    """
+    Асинхронный аналог execute_query_cached с тем же кэшем.
+
+    Записи общие с синхронным API: результат, полученный одним из них,
+    отдается другому без повторного запроса.
+    """
+    watermarks.ensure_started()
+    cache_key = query_cache_key(query, params, external_tables)
+    result, stale = query_cache.lookup(cache_key, local_only=True)
+    if result is None:
+        result, stale = await _cache_call(query_cache.lookup_backend, cache_key)
+    if result is not None:
+        if stale and policy is not None:
+            _refresh_in_background_async(cache_key, query, params, policy, timeout, profile,
+                                         external_tables)
+        return result
+
+    try:
+        return await _fetch_into_cache_async(cache_key, query, params, ttl, policy, timeout, profile,
+                                             external_tables)
+    except QueryCancelledError:
+        # Результат вытесненного вызова никому не нужен
+        return QueryResult.empty()
+    except Exception as e:
+        # Ошибки не кэшируем, чтобы следующий вызов повторил запрос
+        report_error("Ошибка запроса к ClickHouse", e)
+        return QueryResult.empty()
+
+
+async def run_batch_async(awaitables, max_concurrency=None):
+    """
+    Одновременное выполнение корутин с ограничением параллельности.
+
+    Результаты возвращаются в порядке awaitables, исключение первой
+    упавшей корутины пробрасывается, остальные при этом отменяются.
+    """
+    gate = asyncio.Semaphore(max(1, max_concurrency or batch_max_workers))
+
+    async def limited(awaitable):
+        async with gate:
+            return await awaitable
+
+    tasks = [asyncio.ensure_future(limited(awaitable)) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def get_async_query_stats():
+    """Статистика асинхронного клиента"""
+    return {
+        'client': async_clickhouse_client.stats(),
+        'single_flight': async_single_flight.stats(),
+        'refreshing': len(_refresh_tasks)
+    }
@@ -0,0 +1,48 @@
+from data.async_client import execute_query_cached_async, run_batch_async
+from data.queries import (
+    CACHE_POLICIES, GENERAL_STATIC_KPI_QUERY, QUERY_PROFILES,
+    employee_analytics_request, employee_analytics_row_from_result,
+    fines_cube_from_result, fines_cube_request,
+    general_accuracy_request, general_kpi_bundle_from_results,
+    hourly_order_profile_from_result, hourly_order_profile_request,
+    timeliness_aggregate_from_result, timeliness_aggregate_request
+)
+
+# Асинхронные версии самых тяжелых запросов дашборда. Текст запросов и
+# разбор результата общие с data.queries, кэш общий с синхронным API.
+
+
+async def get_general_kpi_bundle_async(start_date, end_date):
+    """KPI общей вкладки (см. get_general_kpi_bundle)"""
+    query, params = general_accuracy_request(start_date, end_date)
+    static_result, accuracy_result = await run_batch_async([
+        execute_query_cached_async(GENERAL_STATIC_KPI_QUERY,
+                                   policy=CACHE_POLICIES['get_general_static_kpi'],
+                                   profile=QUERY_PROFILES['get_general_static_kpi']),
+        execute_query_cached_async(query, params, policy=CACHE_POLICIES['get_general_kpi_bundle'])
+    ])
+    return general_kpi_bundle_from_results(static_result, accuracy_result)
+
+
+async def get_hourly_order_profile_async(start_date, end_date):
+    """Профиль час суток x день (см. get_hourly_order_profile)"""
+    query, params = hourly_order_profile_request(start_date, end_date)
+    return hourly_order_profile_from_result(await execute_query_cached_async(query, params))
+
+
+async def get_timeliness_aggregate_async(start_date, end_date):
+    """Агрегат своевременности (см. get_timeliness_aggregate)"""
+    query, params = timeliness_aggregate_request(start_date, end_date)
+    return timeliness_aggregate_from_result(await execute_query_cached_async(query, params))
+
+
+async def get_fines_cube_async(start_date, end_date):
+    """Куб штрафов (см. get_fines_cube)"""
+    query, params = fines_cube_request(start_date, end_date)
+    return fines_cube_from_result(await execute_query_cached_async(query, params))
+
+
+async def get_employee_analytics_row_async(employee_name, start_date, end_date):
+    """Строка аналитики сотрудника (см. get_employee_analytics_row)"""
+    query, params = employee_analytics_request(employee_name, start_date, end_date)
+    return employee_analytics_row_from_result(await execute_query_cached_async(query, params))
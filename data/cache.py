@@ -0,0 +1,679 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # не POSIX: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Последовательности пробельных символов в тексте SQL
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(query):
+    """Текст запроса без различий в отступах и переводах строк"""
+    return WHITESPACE_RE.sub(' ', query).strip()
+
+
+def _key_value(value):
+    # Порядок элементов множества зависит от хэширования строк в процессе
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return value
+
+
+def make_cache_key(query, params=None):
+    """Ключ кэша: нормализованный SQL плюс значения параметров"""
+    key_source = normalize_sql(query)
+    if params:
+        key_source += '\x00' + repr(sorted(
+            ((name, _key_value(value)) for name, value in params.items()),
+            key=lambda item: item[0]
+        ))
+    return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+
+def estimate_size(value, _depth=0):
+    """Приблизительный размер значения в байтах"""
+    if hasattr(value, 'estimated_size'):
+        return value.estimated_size()
+    size = sys.getsizeof(value)
+    if _depth > 3:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _depth + 1) for item in value)
+    return size
+
+
+class CachePolicy:
+    """
+    Политика кэширования stale-while-revalidate.
+
+    До soft_ttl значение считается свежим. После soft_ttl и до hard_ttl
+    оно еще отдается сразу, но запускается фоновое обновление.
+    После hard_ttl запись удаляется и запрос выполняется синхронно.
+    """
+
+    __slots__ = ('soft_ttl', 'hard_ttl')
+
+    def __init__(self, soft_ttl, hard_ttl):
+        if hard_ttl < soft_ttl:
+            raise ValueError("hard_ttl не может быть меньше soft_ttl")
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+
+    def __repr__(self):
+        return f"CachePolicy(soft_ttl={self.soft_ttl}, hard_ttl={self.hard_ttl})"
+
+
+class CacheEntry:
+    """Запись кэша со временем истечения и оценкой размера"""
+
+    __slots__ = ('value', 'size', 'expires_at', 'fresh_until', 'meta')
+
+    def __init__(self, value, size, expires_at, fresh_until=None, meta=None):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.fresh_until = expires_at if fresh_until is None else fresh_until
+        # Произвольные метаданные (например, таблицы запроса для инвалидации)
+        self.meta = meta
+
+
+class QueryCache:
+    """
+    Потокобезопасный LRU-кэш результатов запросов.
+
+    У каждой записи свой TTL, общий объем ограничен бюджетом в байтах:
+    при превышении вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, default_ttl=300, backend=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # Общее хранилище второго уровня (например, SharedDiskCache)
+        self.backend = backend
+        # Проверка метаданных записи из backend: validator(meta) -> True,
+        # False (данные изменились) или None (пока неизвестно)
+        self.validator = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'rejected': 0,
+            'stale_hits': 0,
+            'backend_hits': 0,
+            'invalidations': 0
+        }
+
+    def get(self, key, default=None):
+        """Значение по ключу или default, если записи нет или она устарела"""
+        value, _ = self.lookup(key, default)
+        return value
+
+    def lookup(self, key, default=None, local_only=False):
+        """
+        Значение и признак устаревания: (value, stale).
+
+        stale=True означает, что мягкий срок записи прошел, но жесткий
+        еще нет, и значение можно отдать, обновив его в фоне. С
+        local_only=True общее хранилище не читается (см. lookup_backend).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                stale = entry.fresh_until <= now
+                if stale:
+                    self._stats['stale_hits'] += 1
+                return entry.value, stale
+            self._stats['misses'] += 1
+        if local_only:
+            return default, False
+        return self.lookup_backend(key, default)
+
+    def peek(self, key, default=None):
+        """
+        (value, stale) из памяти процесса без учета в статистике и LRU.
+
+        Для повторной проверки перед запросом, когда промах уже учтен lookup.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                return default, False
+            return entry.value, entry.fresh_until <= now
+
+    def lookup_backend(self, key, default=None):
+        """
+        Чтение из общего хранилища с переносом записи в память процесса.
+
+        Для промаха lookup(local_only=True), когда чтение диска нужно
+        выполнить отдельно (например, не в цикле событий).
+        """
+        if self.backend is None:
+            return default, False
+        found = self.backend.get(key)
+        if found is None:
+            return default, False
+        value, ttl, soft_ttl, meta = found
+        valid = True if self.validator is None else self.validator(meta)
+        if valid is None:
+            # Проверить запись пока нечем: промах, но запись остается в хранилище
+            return default, False
+        if not valid:
+            # Данные изменились после записи другим процессом
+            self.backend.delete(key)
+            with self._lock:
+                self._stats['invalidations'] += 1
+            return default, False
+        self.set(key, value, ttl=ttl, soft_ttl=soft_ttl, local_only=True, meta=meta)
+        with self._lock:
+            self._stats['backend_hits'] += 1
+        return value, soft_ttl <= 0
+
+    def set(self, key, value, ttl=None, size=None, soft_ttl=None, local_only=False, meta=None):
+        """Сохранение значения с TTL в секундах (soft_ttl - срок свежести)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = estimate_size(value) if size is None else size
+        if self.backend is not None and not local_only:
+            self.backend.set(key, value, ttl, soft_ttl, meta)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                # Запись больше всего бюджета только вытеснила бы весь кэш
+                self._stats['rejected'] += 1
+                return False
+            now = time.monotonic()
+            fresh_until = None if soft_ttl is None else now + soft_ttl
+            self._entries[key] = CacheEntry(value, size, now + ttl, fresh_until, meta)
+            self._bytes += size
+            self._stats['sets'] += 1
+            self._evict()
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def invalidate(self, predicate):
+        """Удаление записей, для метаданных которых predicate(meta) истинно"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if predicate(entry.meta)]
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+        if self.backend is not None:
+            for key in keys:
+                self.backend.delete(key)
+        return len(keys)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        """Вытеснение записей до укладывания в бюджет (под self._lock)"""
+        now = time.monotonic()
+        if self._bytes > self.max_bytes:
+            # Сначала освобождаем место от уже устаревших записей
+            for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+                self._remove(key)
+                self._stats['expirations'] += 1
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._stats['evictions'] += 1
+
+    def stats(self):
+        """Счетчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        if self.backend is not None:
+            stats['backend'] = self.backend.stats()
+        return stats
+
+
+class SharedDiskCache:
+    """
+    Общий для процессов кэш результатов в каталоге на диске.
+
+    Каждая запись - отдельный файл <ключ>.cache с pickle-словарем
+    (значение и сроки по часам time.time()). Запись идет во временный
+    файл с атомарным os.replace, поэтому читатели не видят частично
+    записанных данных. Время последнего чтения хранится в mtime файла,
+    по нему при превышении бюджета вытесняются давно не читанные записи;
+    вытеснение выполняет один процесс за раз под блокировкой fcntl.
+
+    Каталог должен быть доступен только процессам дашборда: значения
+    десериализуются через pickle.
+    """
+
+    SUFFIX = '.cache'
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, evict_interval=5.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Не чаще одного обхода каталога за evict_interval секунд на процесс
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'errors': 0}
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """(value, ttl, soft_ttl, meta) с оставшимися сроками в секундах или None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                record = pickle.load(f)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except Exception as e:
+            print(f"Ошибка чтения общего кэша {path}: {e}")
+            self._count('errors')
+            self._unlink(path)
+            return None
+
+        now = time.time()
+        ttl = record['expires_at'] - now
+        if ttl <= 0:
+            self._unlink(path)
+            self._count('misses')
+            return None
+        try:
+            # Отметка использования для LRU-вытеснения
+            os.utime(path, None)
+        except OSError:
+            pass
+        self._count('hits')
+        return record['value'], ttl, record['fresh_until'] - now, record.get('meta')
+
+    def set(self, key, value, ttl, soft_ttl=None, meta=None):
+        now = time.time()
+        record = {
+            'value': value,
+            'expires_at': now + ttl,
+            'fresh_until': now + (ttl if soft_ttl is None else soft_ttl),
+            'meta': meta
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Ошибка записи общего кэша {path}: {e}")
+            self._count('errors')
+            self._unlink(tmp_path)
+            return False
+        self._count('sets')
+        self._maybe_evict()
+        return True
+
+    def delete(self, key):
+        self._unlink(self._path(key))
+
+    def clear(self):
+        for name in self._list():
+            self._unlink(os.path.join(self.directory, name))
+
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _list(self):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith(self.SUFFIX)]
+        except OSError:
+            return []
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_evict < self.evict_interval:
+                return
+            self._last_evict = now
+        if fcntl is None:
+            self._evict()
+            return
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Вытеснение уже выполняет другой процесс
+                return
+            try:
+                self._evict()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        """Удаление записей, начиная с давно не читанных, до укладывания в бюджет"""
+        files = []
+        total = 0
+        for name in self._list():
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+            self._count('evictions')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['directory'] = self.directory
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вызовов.
+
+    Пока вызов по ключу выполняется, остальные потоки с тем же ключом
+    не запускают его повторно, а ждут и получают тот же результат
+    (или то же исключение).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._stats['calls'] += 1
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class _LeaderCancelled(Exception):
+    """Ведущая корутина общего вызова отменена, ожидающие повторяют вызов"""
+
+
+class AsyncSingleFlight:
+    """
+    Объединение одновременных одинаковых корутин.
+
+    Аналог SingleFlight для цикла событий: ожидающие получают результат
+    первого вызова. Отмена ожидающего не отменяет общий вызов, а при
+    отмене ведущей корутины вызов повторяет один из ожидающих.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        # Future привязан к циклу событий, у каждого цикла свои вызовы
+        call_key = (id(loop), key)
+        while call_key in self._calls:
+            self._stats['shared'] += 1
+            try:
+                return await asyncio.shield(self._calls[call_key])
+            except _LeaderCancelled:
+                continue
+
+        future = loop.create_future()
+        self._calls[call_key] = future
+        self._stats['calls'] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Ожидающие не должны получить CancelledError чужой отмены
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже получено вызывающим, без предупреждения о непрочитанном
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[call_key]
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class SQLiteCache:
+    """
+    Постоянный кэш результатов в файле SQLite.
+
+    Переживает перезапуск процесса и контейнера: записи хранят исходные
+    сроки по часам time.time() и подгружаются лениво при первом промахе
+    в памяти. При превышении бюджета удаляются сначала устаревшие, затем
+    давно не читанные записи. Значения сериализуются через pickle, файл
+    должен быть доступен только дашборду.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'errors': 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _connect(self):
+        """Соединение текущего процесса (под self._lock)"""
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+        # После fork соединение родителя не используем
+        connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                fresh_until REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                meta BLOB
+            )
+        """)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(cache)")]
+        if 'meta' not in columns:
+            # Файл, созданный до появления метаданных
+            connection.execute("ALTER TABLE cache ADD COLUMN meta BLOB")
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        # Записи, истекшие пока приложение было остановлено
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        connection.commit()
+        self._connection = connection
+        self._pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        """(value, ttl, soft_ttl, meta) с оставшимися сроками в секундах или None"""
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT value, expires_at, fresh_until, meta FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] <= now:
+                    connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    connection.commit()
+                    row = None
+                if row is None:
+                    self._stats['misses'] += 1
+                    return None
+                connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+                connection.commit()
+                self._stats['hits'] += 1
+            value = pickle.loads(row[0])
+            meta = pickle.loads(row[3]) if row[3] is not None else None
+        except Exception as e:
+            print(f"Ошибка чтения кэша {self.path}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return None
+        return value, row[1] - now, row[2] - now, meta
+
+    def set(self, key, value, ttl, soft_ttl=None, meta=None):
+        now = time.time()
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            meta_blob = None if meta is None else sqlite3.Binary(pickle.dumps(meta))
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache "
+                    "(key, value, size, expires_at, fresh_until, accessed_at, meta) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, sqlite3.Binary(blob), len(blob), now + ttl,
+                     now + (ttl if soft_ttl is None else soft_ttl), now, meta_blob)
+                )
+                self._evict(connection, now)
+                connection.commit()
+                self._stats['sets'] += 1
+        except Exception as e:
+            print(f"Ошибка записи кэша {self.path}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return False
+        return True
+
+    def _evict(self, connection, now):
+        """Укладывание в бюджет (под self._lock, внутри транзакции)"""
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = connection.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        for key, size in connection.execute(
+            "SELECT key, size FROM cache ORDER BY accessed_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._stats['evictions'] += evicted
+
+    def delete(self, key):
+        self._execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._execute("DELETE FROM cache")
+
+    def _execute(self, statement, args=()):
+        """Изменение без результата; ошибки SQLite (например, занятый файл) не пробрасываются"""
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(statement, args)
+                connection.commit()
+        except sqlite3.Error as e:
+            print(f"Ошибка записи кэша {self.path}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['path'] = self.path
+        stats['max_bytes'] = self.max_bytes
+        return stats
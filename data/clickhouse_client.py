@@ -1,14 +1,480 @@
-import urllib.parse
+import json
+import math
+import os
+import re
+import time
+import uuid
 import requests
-from functools import lru_cache
+from datetime import date, datetime
+from collections import deque, namedtuple
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 import threading
+import contextvars
+
+from requests.adapters import HTTPAdapter
 
 from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.cache import QueryCache, SQLiteCache, SharedDiskCache, SingleFlight, make_cache_key
+from data.result import QueryResult, base_type
+from data.watermarks import WatermarkTracker, cache_meta
+
+
+class ClickHouseError(Exception):
+    """Ошибка выполнения запроса на сервере ClickHouse"""
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class QueryTimeoutError(ClickHouseError):
+    """Запрос не завершился за отведенное время и был отменен"""
+
+
+class QueryCancelledError(ClickHouseError):
+    """Запрос отменен: область запросов вытеснена более новой"""
+
+
+class QueryScope:
+    """
+    Область запросов одного вызова (например, callback дашборда).
+
+    Задает общий крайний срок для всех запросов внутри и хранит query_id
+    выполняющихся запросов, чтобы отменить их на сервере, когда область
+    вытесняет более новая с тем же ключом.
+    """
+
+    def __init__(self, key=None, timeout=None):
+        self.key = key
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = False
+        self._query_ids = set()
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Секунд до крайнего срока или None, если срока нет"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def register(self, query_id):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCancelledError("Запрос вытеснен более новым")
+            self._query_ids.add(query_id)
+
+    def unregister(self, query_id):
+        with self._lock:
+            self._query_ids.discard(query_id)
+
+    def cancel(self):
+        """Отметка области отмененной; возвращает query_id выполняющихся запросов"""
+        with self._lock:
+            self.cancelled = True
+            query_ids = list(self._query_ids)
+            self._query_ids.clear()
+        return query_ids
+
+
+# Текущая область запросов; переносится в потоки run_batch вместе с контекстом
+_current_scope = contextvars.ContextVar('clickhouse_query_scope', default=None)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+def raise_if_cancelled():
+    """QueryCancelledError, если текущая область вытеснена"""
+    scope = _current_scope.get()
+    if scope is not None and scope.cancelled:
+        raise QueryCancelledError("Запрос вытеснен более новым")
+
+
+def run_shared(flight, key, fn):
+    """
+    Вызов через single-flight с повтором после чужой отмены.
+
+    Если общий вызов вела вытесненная область другого вызова, а текущая
+    еще актуальна, вызов выполняется заново.
+    """
+    try:
+        return flight.do(key, fn)
+    except QueryCancelledError:
+        raise_if_cancelled()
+        return flight.do(key, fn)
+
+
+class HTTPSessionPool:
+    """
+    Ограниченный потокобезопасный пул keep-alive сессий requests.
+
+    Каждая сессия держит одно постоянное соединение, число одновременно
+    выданных сессий ограничено на каждый хост, простаивающие сессии
+    закрываются по таймауту.
+    """
+
+    def __init__(self, max_per_host=8, idle_timeout=8.0, acquire_timeout=30.0):
+        self.max_per_host = max_per_host
+        # Должен быть меньше keep_alive_timeout сервера ClickHouse
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._reset_state()
+        if hasattr(os, 'register_at_fork'):
+            # Сокеты родителя не должны использоваться воркерами gunicorn
+            os.register_at_fork(after_in_child=self._reset_state)
+
+    def _reset_state(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._stats = {
+            'acquired': 0,
+            'reused': 0,
+            'created': 0,
+            'evicted': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0
+        }
+
+    def _host_slot(self, host):
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = {
+                    'semaphore': threading.BoundedSemaphore(self.max_per_host),
+                    'idle': deque(),
+                    'in_use': 0
+                }
+                self._hosts[host] = slot
+            return slot
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _evict_idle(self, slot, now):
+        """Закрытие сессий, простаивающих дольше idle_timeout (под self._lock)"""
+        # Самые старые сессии лежат в начале очереди
+        while slot['idle'] and now - slot['idle'][0][1] > self.idle_timeout:
+            session, _ = slot['idle'].popleft()
+            session.close()
+            self._stats['evicted'] += 1
+
+    @contextmanager
+    def session(self, host):
+        """Выдача сессии для хоста с возвратом в пул после использования"""
+        slot = self._host_slot(host)
+        started = time.monotonic()
+        if not slot['semaphore'].acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeoutError(f"Нет свободных соединений к {host} за {self.acquire_timeout} с")
+
+        now = time.monotonic()
+        waited = now - started
+        session = None
+        with self._lock:
+            self._evict_idle(slot, now)
+            if slot['idle']:
+                # LIFO: берем самую "теплую" сессию
+                session, _ = slot['idle'].pop()
+                self._stats['reused'] += 1
+            slot['in_use'] += 1
+            self._stats['acquired'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+        if session is None:
+            session = self._create_session()
+            with self._lock:
+                self._stats['created'] += 1
+
+        healthy = False
+        try:
+            yield session
+            healthy = True
+        finally:
+            with self._lock:
+                slot['in_use'] -= 1
+                if healthy:
+                    slot['idle'].append((session, time.monotonic()))
+                else:
+                    self._stats['discarded'] += 1
+            if not healthy:
+                # Соединение могло остаться в неопределенном состоянии
+                session.close()
+            slot['semaphore'].release()
+
+    def stats(self):
+        """Статистика пула для подбора размера под несколько воркеров"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hosts'] = {
+                host: {'in_use': slot['in_use'], 'idle': len(slot['idle'])}
+                for host, slot in self._hosts.items()
+            }
+        acquired = stats['acquired']
+        stats['reuse_rate'] = round(stats['reused'] / acquired, 3) if acquired else 0.0
+        stats['avg_wait_ms'] = round(stats['wait_time_total'] / acquired * 1000, 2) if acquired else 0.0
+        stats['max_wait_ms'] = round(stats['wait_time_max'] * 1000, 2)
+        return stats
+
+    def close(self):
+        """Закрытие всех простаивающих сессий"""
+        with self._lock:
+            for slot in self._hosts.values():
+                while slot['idle']:
+                    session, _ = slot['idle'].popleft()
+                    session.close()
+
+
+# Плейсхолдеры старого формата %(name)s
+LEGACY_PLACEHOLDER_RE = re.compile(r'%\((\w+)\)s')
+
+
+def clickhouse_type(value):
+    """Определение типа ClickHouse для параметра по значению Python"""
+    if isinstance(value, bool):
+        return 'Bool'
+    if isinstance(value, int):
+        return 'Int64'
+    if isinstance(value, float):
+        return 'Float64'
+    if isinstance(value, datetime):
+        return 'DateTime'
+    if isinstance(value, date):
+        return 'Date'
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+        return f"Array({clickhouse_type(items[0]) if items else 'String'})"
+    if value is None:
+        return 'Nullable(String)'
+    return 'String'
+
+
+def _format_literal(value):
+    """Значение внутри массива: строки в кавычках, как в SQL"""
+    if isinstance(value, (str, date)) and not isinstance(value, bool):
+        text = _format_param(value)
+        return "'" + text.replace("'", "\\'") + "'"
+    return _format_param(value)
+
+
+def _format_param(value):
+    """Сериализация значения параметра для передачи в param_<name>"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '[' + ','.join(_format_literal(item) for item in value) + ']'
+    if isinstance(value, str):
+        # Значения параметров разбираются в формате Escaped
+        return (value.replace('\\', '\\\\')
+                     .replace('\t', '\\t')
+                     .replace('\n', '\\n'))
+    return str(value)
+
+
+def bind_params(query, params):
+    """
+    Подготовка серверной подстановки параметров ClickHouse.
+
+    Плейсхолдеры %(name)s переписываются в {name:Type} с выводом типа
+    по значению, поэтому текст запроса не зависит от значений.
+    Возвращает текст запроса и словарь URL-параметров param_<name>.
+    """
+    if not params:
+        return query, {}
+
+    def replace_legacy(match):
+        name = match.group(1)
+        if name not in params:
+            return match.group(0)
+        return '{%s:%s}' % (name, clickhouse_type(params[name]))
+
+    query = LEGACY_PLACEHOLDER_RE.sub(replace_legacy, query)
+    url_params = {f'param_{key}': _format_param(value) for key, value in params.items()}
+    return query, url_params
+
+
+# Внешняя таблица запроса: колонки [(имя, тип ClickHouse)] и строки.
+# В SQL доступна по имени из словаря external_tables: fio IN employees
+ExternalTable = namedtuple('ExternalTable', ['columns', 'rows'])
+
+
+def value_table(values, column='value', type_name='String'):
+    """Внешняя таблица из одной колонки (большие списки для IN)"""
+    return ExternalTable([(column, type_name)], [(value,) for value in values])
+
+
+def encode_external_tables(external_tables):
+    """
+    Тело multipart/form-data с внешними таблицами в формате TabSeparated.
+
+    Возвращает URL-параметры со структурой таблиц, тело и Content-Type.
+    """
+    boundary = uuid.uuid4().hex
+    url_params = {}
+    parts = []
+    for name, table in external_tables.items():
+        url_params[f'{name}_structure'] = ', '.join(
+            f'{column} {type_name}' for column, type_name in table.columns
+        )
+        # Экранирование TabSeparated совпадает с форматом параметров
+        data = ''.join('\t'.join(_format_param(value) for value in row) + '\n' for row in table.rows)
+        parts.append(
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+            + data.encode('utf-8') + b'\r\n'
+        )
+    body = b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8')
+    return url_params, body, f'multipart/form-data; boundary={boundary}'
+
+
+# Типизированный построчный формат: имена и типы колонок, затем строки
+RESULT_FORMAT = 'JSONCompactEachRowWithNamesAndTypes'
+
+RESULT_SETTINGS = {
+    'default_format': RESULT_FORMAT,
+    # 64-битные целые и Decimal приходят числами, а не строками
+    'output_format_json_quote_64bit_integers': 0,
+    'output_format_json_quote_decimals': 0
+}
+
+# Запрос только на чтение отменяется сервером, когда клиент закрывает
+# соединение. Настройка действует лишь на GET-запросы (transport='get'):
+# для POST и внешних таблиц сервер досчитывает запрос после разрыва,
+# и снять его можно только через KILL QUERY (см. kill_query_async)
+CANCEL_SETTINGS = {
+    'cancel_http_readonly_queries_on_client_close': 1
+}
+
+# Запас клиентского таймаута сверх max_execution_time: сервер должен
+# прервать запрос сам и вернуть ошибку раньше, чем сработает клиент
+CLIENT_TIMEOUT_GRACE = 2.0
+
+# Именованные профили настроек запросов. priority: меньше - важнее
+# (0 - без приоритета), поэтому интерактивные запросы обгоняют тяжелые
+# при нехватке ресурсов. В профилях только настройки, отличные от
+# значений сервера по умолчанию: каждая из них уходит с каждым запросом.
+# Значения переопределяются в конфигурации ключом settings_profiles,
+# None убирает настройку из профиля
+SETTINGS_PROFILES = {
+    # KPI и графики: быстрые ответы
+    'interactive': {
+        'max_threads': 8,
+        'max_memory_usage': 4 * 1024 ** 3,
+        'priority': 1
+    },
+    # Выгрузки справочного характера: меньше потоков, больше памяти и
+    # серверный кэш запросов для повторных открытий. use_query_cache
+    # есть в ClickHouse с 23.1, для более старого сервера его нужно
+    # убрать: settings_profiles = {'heavy': {'use_query_cache': None}}
+    'heavy': {
+        'max_threads': 4,
+        'max_memory_usage': 10 * 1024 ** 3,
+        'priority': 10,
+        'use_query_cache': 1
+    },
+    # Служебные фоновые запросы (водяные знаки, сборка витрин)
+    'background': {
+        'max_threads': 1,
+        'max_memory_usage': 1024 ** 3,
+        'priority': 20
+    }
+}
+
+for _name, _overrides in CLICKHOUSE_CONFIG.get('settings_profiles', {}).items():
+    _profile = dict(SETTINGS_PROFILES.get(_name, {}), **_overrides)
+    SETTINGS_PROFILES[_name] = {key: value for key, value in _profile.items() if value is not None}
+
+DEFAULT_PROFILE = CLICKHOUSE_CONFIG.get('default_settings_profile', 'interactive')
+
+
+def profile_settings(profile=None):
+    """Настройки именованного профиля (по умолчанию DEFAULT_PROFILE)"""
+    name = profile or DEFAULT_PROFILE
+    if name not in SETTINGS_PROFILES:
+        raise ValueError(f"Неизвестный профиль настроек ClickHouse: {name}")
+    return SETTINGS_PROFILES[name]
+
+COMPRESSION_SETTINGS = {
+    'enable_http_compression': 1,
+    'http_zlib_compression_level': 3
+}
+
+INTEGER_TYPES = ('Int', 'UInt')
+FLOAT_TYPES = ('Float', 'Decimal')
+
+
+def _column_converter(type_name):
+    """Приведение значений, которые сервер мог вернуть строкой"""
+    base = base_type(type_name)
+    if base.startswith(INTEGER_TYPES):
+        return int
+    if base.startswith(FLOAT_TYPES):
+        return float
+    return None
+
+
+def decode_rows(names, types, rows):
+    """Приведение строк JSONCompact к типам колонок"""
+    converters = [(index, converter) for index, converter in
+                  enumerate(_column_converter(type_name) for type_name in types)
+                  if converter is not None]
+    if converters:
+        for row in rows:
+            for index, converter in converters:
+                value = row[index]
+                if isinstance(value, str):
+                    row[index] = converter(value)
+    return rows
+
+
+def decode_json_compact(body):
+    """
+    Разбор ответа в формате JSONCompactEachRowWithNamesAndTypes.
+
+    Возвращает имена колонок, их типы ClickHouse и строки с типизированными
+    значениями. Все строки разбираются одним вызовом json.loads.
+    """
+    text = body.decode('utf-8').strip() if isinstance(body, bytes) else body.strip()
+    if not text:
+        return [], [], []
+    # Внутри JSON-строк перевод строки экранирован, поэтому '\n' разделяет только строки
+    lines = json.loads('[' + text.replace('\n', ',') + ']')
+    names, types, rows = lines[0], lines[1], lines[2:]
+    return names, types, decode_rows(names, types, rows)
+
+
+def decode_block(names, types, lines, nbytes):
+    """Блок строк потокового ответа (байтовые строки JSONCompact) в QueryResult"""
+    try:
+        rows = json.loads(b'[' + b','.join(lines) + b']')
+    except ValueError:
+        # Ошибка сервера посреди потока приходит текстом вместо строки данных
+        raise ClickHouseError(b'\n'.join(lines)[-500:].decode('utf-8', 'replace'))
+    return QueryResult.from_rows(names, types, decode_rows(names, types, rows), nbytes=nbytes)
+
+
+class BaseClickHouseClient:
+    """
+    Общая часть синхронного и асинхронного клиентов: настройки
+    подключения и сборка HTTP-запроса. Транспорт реализуют наследники.
+    """
 
-class ClickHouseHTTPClient:
-    """HTTP клиент для ClickHouse"""
-    
     def __init__(self, config):
         self.host = config['host']
         self.port = config['port']
@@ -16,52 +482,505 @@ class ClickHouseHTTPClient:
         self.user = config.get('user', 'default')
         self.password = config.get('password', '')
         self.base_url = f"http://{self.host}:{self.port}/"
-        
-    def execute(self, query, params=None):
-        """Выполнение SQL запроса через HTTP интерфейс"""
+        # 'post' - запрос в теле, 'get' - запрос в строке URL (только чтение)
+        self.transport = config.get('transport', 'post')
+        self.timeout = config.get('timeout', 30)
+        # Сжатие ответа gzip на стороне сервера
+        self.compression = config.get('compression', True)
+
+    def _build_request(self, query, params, settings=None, external_tables=None):
+        """
+        HTTP-запрос с серверной подстановкой параметров.
+
+        Возвращает метод, URL-параметры, тело (None для GET) и заголовки.
+        С внешними таблицами тело занимают их данные (multipart/form-data),
+        а текст запроса передается в URL.
+        """
+        query, url_params = bind_params(query, params)
+        url_params['database'] = self.database
+        url_params.update(RESULT_SETTINGS)
+        if settings:
+            url_params.update(settings)
+        headers = {}
+        if self.compression:
+            url_params.update(COMPRESSION_SETTINGS)
+            headers['Accept-Encoding'] = 'gzip'
+
+        if external_tables:
+            table_params, body, content_type = encode_external_tables(external_tables)
+            url_params.update(table_params)
+            url_params['query'] = query
+            headers['Content-Type'] = content_type
+            return 'POST', url_params, body, headers
+
+        if self.transport == 'get':
+            url_params['query'] = query
+            url_params.update(CANCEL_SETTINGS)
+            return 'GET', url_params, None, headers
+        return 'POST', url_params, query.encode('utf-8'), headers
+
+    def _query_limits(self, timeout=None, settings=None):
+        """
+        Таймаут запроса с учетом крайнего срока текущей области и
+        серверные параметры: settings (профиль), query_id для KILL QUERY
+        и max_execution_time.
+        """
+        scope = _current_scope.get()
+        timeout = timeout or self.timeout
+        if scope is not None:
+            if scope.cancelled:
+                raise QueryCancelledError("Запрос вытеснен более новым")
+            remaining = scope.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise QueryTimeoutError("Истек крайний срок области запросов")
+                timeout = min(timeout, remaining)
+        query_id = uuid.uuid4().hex
+        settings = dict(settings or {})
+        settings['query_id'] = query_id
+        settings['max_execution_time'] = max(1, math.ceil(timeout))
+        return scope, query_id, timeout, settings
+
+
+class ClickHouseHTTPClient(BaseClickHouseClient):
+    """HTTP клиент для ClickHouse"""
+
+    def __init__(self, config, pool=None):
+        super().__init__(config)
+        self.pool = pool or session_pool
+
+    def _send(self, session, query, params, stream=False, timeout=None, settings=None,
+              external_tables=None):
+        """Отправка запроса с серверной подстановкой параметров"""
+        method, url_params, body, headers = self._build_request(query, params, settings,
+                                                                external_tables)
+        return session.request(
+            method,
+            self.base_url,
+            params=url_params,
+            data=body,
+            headers=headers,
+            timeout=timeout or self.timeout,
+            stream=stream
+        )
+
+    def _response_error(self, response, scope):
+        """Ошибка сервера; запрос, убитый при вытеснении области, - отмена"""
+        if scope is not None and scope.cancelled:
+            return QueryCancelledError("Запрос вытеснен более новым")
+        return ClickHouseError(response.text[:500])
+
+    def execute(self, query, params=None, raise_errors=False, timeout=None, settings=None,
+                external_tables=None):
+        """
+        Выполнение SQL запроса через HTTP интерфейс.
+
+        Запрос получает query_id и max_execution_time по timeout (по
+        умолчанию из конфигурации, не дольше крайнего срока области
+        query_scope). Если клиент не дождался ответа, запрос снимается
+        на сервере через KILL QUERY. settings - настройки ClickHouse для
+        запроса (см. profile_settings), external_tables - словарь внешних
+        таблиц ExternalTable по имени. По умолчанию при ошибке возвращается
+        пустой результат, с raise_errors=True ошибка пробрасывается.
+        """
         try:
-            if params:
-                for key, value in params.items():
-                    if isinstance(value, str):
-                        query = query.replace(f'%({key})s', f"'{value}'")
-                    else:
-                        query = query.replace(f'%({key})s', str(value))
-            
-            encoded_query = urllib.parse.quote(query)
-            url = f"{self.base_url}?database={self.database}&query={encoded_query}"
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code == 200:
-                result = []
-                lines = response.text.strip().split('\n')
-                for line in lines:
-                    if line.strip():
-                        columns = line.split('\t')
-                        result.append(columns)
-                return result
-            else:
-                return []
-                
+            scope, query_id, timeout, settings = self._query_limits(timeout, settings)
+            if scope is not None:
+                scope.register(query_id)
+            try:
+                with self.pool.session(self.base_url) as session:
+                    response = self._send(session, query, params, timeout=timeout + CLIENT_TIMEOUT_GRACE,
+                                          settings=settings, external_tables=external_tables)
+            except requests.Timeout:
+                kill_query_async(query_id)
+                raise QueryTimeoutError(f"Запрос ClickHouse отменен по таймауту {timeout:g} с")
+            finally:
+                if scope is not None:
+                    scope.unregister(query_id)
+
+            if response.status_code != 200:
+                raise self._response_error(response, scope)
+
+            # requests сам распаковывает gzip по Content-Encoding
+            body = response.content
+            names, types, rows = decode_json_compact(body)
+            return QueryResult.from_rows(names, types, rows, nbytes=len(body))
+
         except Exception:
-            return []
+            if raise_errors:
+                raise
+            return QueryResult.empty()
+
+    def execute_stream(self, query, params=None, block_rows=10000, timeout=None, settings=None):
+        """
+        Потоковое выполнение запроса.
+
+        Ответ читается по частям, строки разбираются блоками по block_rows
+        и отдаются как QueryResult по мере поступления, поэтому весь ответ
+        целиком в памяти не хранится. Сессия остается занятой до конца чтения.
+        timeout ограничивает ожидание каждой порции ответа.
+        """
+        scope, query_id, timeout, settings = self._query_limits(timeout, settings)
+        # Поток может читаться долго, общий срок выполнения на сервере не ставим
+        del settings['max_execution_time']
+        if scope is not None:
+            scope.register(query_id)
+        with self.pool.session(self.base_url) as session:
+            try:
+                response = self._send(session, query, params, stream=True, timeout=timeout,
+                                      settings=settings)
+            except BaseException:
+                if scope is not None:
+                    scope.unregister(query_id)
+                raise
+            try:
+                if response.status_code != 200:
+                    raise self._response_error(response, scope)
+
+                lines = response.iter_lines(chunk_size=65536)
+                try:
+                    names = json.loads(next(lines))
+                    types = json.loads(next(lines))
+                except StopIteration:
+                    return
+
+                batch = []
+                batch_bytes = 0
+                for line in lines:
+                    if not line:
+                        continue
+                    batch.append(line)
+                    batch_bytes += len(line)
+                    if len(batch) >= block_rows:
+                        yield decode_block(names, types, batch, batch_bytes)
+                        batch = []
+                        batch_bytes = 0
+                if batch:
+                    yield decode_block(names, types, batch, batch_bytes)
+            finally:
+                if scope is not None:
+                    scope.unregister(query_id)
+                response.close()
+
+    def kill_query(self, query_id):
+        """Снятие запроса на сервере по query_id (KILL QUERY ... ASYNC)"""
+        try:
+            with self.pool.session(self.base_url) as session:
+                response = self._send(session, "KILL QUERY WHERE query_id = {query_id:String} ASYNC",
+                                      {'query_id': query_id}, timeout=5)
+            if response.status_code != 200:
+                raise ClickHouseError(response.text[:500])
+        except Exception as e:
+            report_error(f"Ошибка отмены запроса ClickHouse {query_id}", e)
+
+    def pool_stats(self):
+        """Статистика пула соединений"""
+        return self.pool.stats()
+
+# Общий пул соединений процесса (лимиты действуют на каждый хост)
+session_pool = HTTPSessionPool(
+    max_per_host=CLICKHOUSE_CONFIG.get('pool_max_per_host', 8),
+    idle_timeout=CLICKHOUSE_CONFIG.get('pool_idle_timeout', 8.0),
+    acquire_timeout=CLICKHOUSE_CONFIG.get('pool_acquire_timeout', 30.0)
+)
 
 # Создание клиента ClickHouse
 clickhouse_client = ClickHouseHTTPClient(CLICKHOUSE_CONFIG)
 
-# Кэширование для оптимизации запросов
-cache_lock = threading.Lock()
+# Кэш результатов запросов
+# Кэш второго уровня на диске: общий каталог для воркеров (shared_cache_dir)
+# или файл SQLite, переживающий перезапуски (persistent_cache_path)
+shared_cache = None
+if CLICKHOUSE_CONFIG.get('shared_cache_dir'):
+    shared_cache = SharedDiskCache(
+        CLICKHOUSE_CONFIG['shared_cache_dir'],
+        max_bytes=CLICKHOUSE_CONFIG.get('shared_cache_max_bytes', 1024 * 1024 * 1024)
+    )
+elif CLICKHOUSE_CONFIG.get('persistent_cache_path'):
+    shared_cache = SQLiteCache(
+        CLICKHOUSE_CONFIG['persistent_cache_path'],
+        max_bytes=CLICKHOUSE_CONFIG.get('shared_cache_max_bytes', 1024 * 1024 * 1024)
+    )
+
+query_cache = QueryCache(
+    max_bytes=CLICKHOUSE_CONFIG.get('cache_max_bytes', 256 * 1024 * 1024),
+    default_ttl=CLICKHOUSE_CONFIG.get('cache_default_ttl', 300),
+    backend=shared_cache
+)
 executor = ThreadPoolExecutor(max_workers=5)
 
-def execute_query_cached(query, params=None, ttl=300):
-    """Выполнение запроса с кэшированием"""
-    cache_key = f"{query}_{str(params)}"
-    
-    @lru_cache(maxsize=128)
-    def cached_execution(cache_key):
+# Ошибки запросов по типу исключения (см. report_error)
+_errors = {}
+_errors_lock = threading.Lock()
+
+def report_error(message, error):
+    """Вывод ошибки запроса ClickHouse с подсчетом в get_query_stats"""
+    name = type(error).__name__
+    with _errors_lock:
+        _errors[name] = _errors.get(name, 0) + 1
+    print(f"{message}: {error}")
+
+def kill_query_async(query_id):
+    """KILL QUERY в фоне на executor, не задерживая вызывающего"""
+    try:
+        executor.submit(clickhouse_client.kill_query, query_id)
+    except RuntimeError:
+        # executor уже остановлен (завершение процесса)
+        pass
+
+# Активные области запросов по ключу (см. query_scope)
+_scopes = {}
+_scopes_lock = threading.Lock()
+
+@contextmanager
+def query_scope(key=None, timeout=None):
+    """
+    Область запросов с общим крайним сроком и вытеснением по ключу.
+
+    Все запросы внутри, в том числе в потоках run_batch, получают таймаут
+    не дольше оставшегося до крайнего срока. Новая область с тем же key
+    (например, повторный вызов callback тем же клиентом) вытесняет старую:
+    ее выполняющиеся запросы снимаются через KILL QUERY, а новые запросы
+    старой области завершаются QueryCancelledError.
+    """
+    scope = QueryScope(key, timeout)
+    previous = None
+    if key is not None:
+        with _scopes_lock:
+            previous = _scopes.get(key)
+            _scopes[key] = scope
+    if previous is not None:
+        for query_id in previous.cancel():
+            kill_query_async(query_id)
+
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        if key is not None:
+            with _scopes_lock:
+                if _scopes.get(key) is scope:
+                    del _scopes[key]
+
+# Пул для параллельного выполнения независимых запросов (run_batch),
+# отдельный от executor, чтобы фоновые обновления не ждали пакеты
+batch_max_workers = CLICKHOUSE_CONFIG.get('batch_max_workers', 8)
+batch_executor = ThreadPoolExecutor(max_workers=batch_max_workers,
+                                    thread_name_prefix='clickhouse-batch')
+# Признак потока пакета: вложенные пакеты выполняются в нем последовательно
+_batch_local = threading.local()
+
+# Таблицы, изменение которых сбрасывает зависящие от них записи кэша
+WATERMARK_TABLES = [
+    'dwh.operations_enriched',
+    'dwh.orders_enriched',
+    'dm.fact_fines',
+    'dm.fact_transaction_events',
+    'dm.dim_employees',
+    'olap.raw_location',
+    'olap.raw_shtraf_edit',
+    'olap.raw_user_cadr_edit',
+    'olap.raw_work_instruction_view2',
+    'rollup.employee_daily',
+    'rollup.orders_hourly',
+    'rollup.fines_daily'
+]
+
+# watermark_interval = 0 отключает проверку, остаются только TTL
+watermarks = WatermarkTracker(
+    clickhouse_client, query_cache,
+    CLICKHOUSE_CONFIG.get('watermark_tables', WATERMARK_TABLES),
+    interval=CLICKHOUSE_CONFIG.get('watermark_interval', 60),
+    history_ttl=CLICKHOUSE_CONFIG.get('watermark_history_ttl', 7 * 24 * 60 * 60),
+    settings=profile_settings('background'),
+    first_probe_wait=CLICKHOUSE_CONFIG.get('watermark_first_probe_wait', 5)
+)
+
+# Одинаковые запросы, выполняющиеся одновременно, идут в ClickHouse один раз
+single_flight = SingleFlight()
+
+# Ключи, для которых уже запущено фоновое обновление
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def cache_result(cache_key, result, meta, ttl, policy=None):
+    """
+    Сохранение результата запроса в кэш с TTL по политике или водяным знакам.
+
+    meta (cache_meta с водяными знаками watermarks.stamp) создается до
+    отправки запроса, чтобы изменения данных во время его выполнения
+    сбрасывали запись.
+    """
+    if policy is None:
+        query_cache.set(cache_key, result, ttl=watermarks.ttl_for(meta, ttl), meta=meta)
+    else:
+        query_cache.set(cache_key, result, ttl=policy.hard_ttl,
+                        soft_ttl=policy.soft_ttl, meta=meta)
+    return result
+
+def _fetch_into_cache(cache_key, query, params, ttl, policy, timeout=None, profile=None,
+                      external_tables=None):
+    """Запрос в ClickHouse с сохранением результата в кэш (через single-flight)"""
+    def fetch():
+        # Пока ждали очереди, свежий результат мог положить другой поток
+        cached, stale = query_cache.peek(cache_key)
+        if cached is not None and not stale:
+            return cached
+        meta = watermarks.stamp(cache_meta(query, params))
+        fetched = clickhouse_client.execute(query, params, raise_errors=True, timeout=timeout,
+                                            settings=profile_settings(profile),
+                                            external_tables=external_tables)
+        return cache_result(cache_key, fetched, meta, ttl, policy)
+
+    return run_shared(single_flight, cache_key, fetch)
+
+def _refresh_in_background(cache_key, query, params, policy, profile=None, external_tables=None):
+    """Фоновое обновление устаревшей записи на executor"""
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    def refresh():
         try:
-            result = clickhouse_client.execute(query, params)
-            return result
-        except Exception:
-            return []
-    
-    return cached_execution(cache_key)
\ No newline at end of file
+            _fetch_into_cache(cache_key, query, params, None, policy, profile=profile,
+                              external_tables=external_tables)
+        except Exception as e:
+            # Старое значение остается в кэше до жесткого срока
+            report_error("Ошибка фонового обновления запроса ClickHouse", e)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    try:
+        executor.submit(refresh)
+    except RuntimeError:
+        # executor уже остановлен (завершение процесса)
+        with _refreshing_lock:
+            _refreshing.discard(cache_key)
+
+def query_cache_key(query, params=None, external_tables=None):
+    """Ключ кэша запроса; данные внешних таблиц входят в ключ"""
+    if external_tables:
+        return make_cache_key(query, dict(params or {}, __external__=external_tables))
+    return make_cache_key(query, params)
+
+def execute_query_cached(query, params=None, ttl=300, policy=None, timeout=None, profile=None,
+                         external_tables=None):
+    """
+    Выполнение запроса с кэшированием на ttl секунд.
+
+    С policy (CachePolicy) устаревшее после soft_ttl значение отдается
+    сразу, а обновление выполняется в фоне на executor. timeout - срок
+    выполнения запроса в секундах (см. ClickHouseHTTPClient.execute),
+    profile - имя профиля настроек из SETTINGS_PROFILES, external_tables -
+    внешние таблицы запроса (их данные входят в ключ кэша).
+    """
+    watermarks.ensure_started()
+    cache_key = query_cache_key(query, params, external_tables)
+    result, stale = query_cache.lookup(cache_key)
+    if result is not None:
+        if stale and policy is not None:
+            _refresh_in_background(cache_key, query, params, policy, profile, external_tables)
+        return result
+
+    try:
+        return _fetch_into_cache(cache_key, query, params, ttl, policy, timeout, profile,
+                                 external_tables)
+    except QueryCancelledError:
+        # Результат вытесненного вызова никому не нужен
+        return QueryResult.empty()
+    except Exception as e:
+        # Ошибки не кэшируем, чтобы следующий вызов повторил запрос
+        report_error("Ошибка запроса к ClickHouse", e)
+        return QueryResult.empty()
+
+def _run_batch_task(task):
+    _batch_local.active = True
+    try:
+        return task()
+    finally:
+        _batch_local.active = False
+
+def run_batch(tasks, max_concurrency=None):
+    """
+    Параллельное выполнение независимых вызовов (функций без аргументов).
+
+    Одновременно выполняется не больше max_concurrency вызовов (по умолчанию
+    batch_max_workers). Результаты возвращаются в порядке tasks, исключение
+    любого вызова пробрасывается после завершения остальных. Вызов из потока
+    пакета выполняется последовательно, иначе вложенные пакеты могут занять
+    весь пул и ждать друг друга.
+    """
+    tasks = list(tasks)
+    if len(tasks) <= 1 or getattr(_batch_local, 'active', False):
+        return [task() for task in tasks]
+
+    gate = threading.BoundedSemaphore(max(1, max_concurrency or batch_max_workers))
+    futures = []
+    for task in tasks:
+        gate.acquire()
+        try:
+            # Контекст вызывающего потока (contextvars) переносится в задачу
+            future = batch_executor.submit(contextvars.copy_context().run, _run_batch_task, task)
+        except RuntimeError:
+            # Пул уже остановлен (завершение процесса)
+            gate.release()
+            futures.append(None)
+            continue
+        future.add_done_callback(lambda _: gate.release())
+        futures.append(future)
+
+    results = []
+    error = None
+    for task, future in zip(tasks, futures):
+        try:
+            results.append(task() if future is None else future.result())
+        except Exception as e:
+            error = error or e
+            results.append(None)
+    if error is not None:
+        raise error
+    return results
+
+def execute_query_batch(queries, ttl=300, policy=None, max_concurrency=None, timeout=None,
+                        profile=None, external_tables=None):
+    """
+    Параллельное выполнение списка запросов (query, params) с кэшированием.
+
+    timeout, profile и external_tables действуют на все запросы пакета;
+    третий элемент кортежа (query, params, options) переопределяет их
+    и ttl/policy для отдельного запроса, например {'profile': 'heavy'}.
+    Возвращает список QueryResult в порядке запросов.
+    """
+    defaults = {
+        'ttl': ttl,
+        'policy': policy,
+        'timeout': timeout,
+        'profile': profile,
+        'external_tables': external_tables
+    }
+    calls = []
+    for item in queries:
+        query, params = item[0], item[1]
+        options = dict(defaults, **(item[2] if len(item) > 2 else {}))
+        calls.append(lambda query=query, params=params, options=options:
+                     execute_query_cached(query, params, **options))
+    return run_batch(calls, max_concurrency=max_concurrency)
+
+def get_query_stats():
+    """Статистика кэша запросов и пула соединений"""
+    return {
+        'cache': query_cache.stats(),
+        'single_flight': single_flight.stats(),
+        'refreshing': len(_refreshing),
+        'watermarks': watermarks.stats(),
+        'errors': dict(_errors),
+        'pool': clickhouse_client.pool_stats()
+    }
+
+def execute_query_stream(query, params=None, block_rows=10000, timeout=None, profile=None):
+    """Потоковое выполнение запроса блоками QueryResult (без кэширования)"""
+    return clickhouse_client.execute_stream(query, params, block_rows=block_rows, timeout=timeout,
+                                            settings=profile_settings(profile))
@@ -0,0 +1,159 @@
+from datetime import date, datetime, timedelta
+
+from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.cache import make_cache_key
+from data.clickhouse_client import (
+    QueryCancelledError, clickhouse_client, profile_settings, query_cache, report_error,
+    run_shared, single_flight, watermarks
+)
+from data.result import QueryResult
+from data.watermarks import cache_meta
+
+# Сколько хранить частичные агрегаты за прошедшие дни (секунды);
+# текущий день меняется и живет обычный ttl. При изменении данных
+# дни сбрасываются проверкой водяных знаков раньше срока
+HISTORY_TTL = CLICKHOUSE_CONFIG.get('daily_cache_ttl', 6 * 60 * 60)
+
+# Функции слияния частичных агрегатов
+MERGE_FUNCTIONS = {
+    'sum': lambda a, b: a + b,
+    'min': min,
+    'max': max
+}
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _day_runs(days):
+    """Разбиение отсортированных дней на непрерывные отрезки"""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _day_key(query, params, day):
+    return make_cache_key(query, dict(params, __day__=day.isoformat()))
+
+
+def _load_days(query, params, start, end, ttl, profile):
+    """
+    Запрос дней [start, end] одним обращением и раскладка строк по дням.
+
+    Первая колонка запроса - день. Дни без строк тоже кэшируются,
+    чтобы не запрашивать их повторно.
+    """
+    run_params = dict(params, start_date=start, end_date=end)
+    meta_template = cache_meta(query)
+    # Водяные знаки снимаются до запроса, у каждого дня - свои
+    metas = {}
+    day = start
+    while day <= end:
+        metas[day] = watermarks.stamp(dict(meta_template, date_to=day))
+        day += timedelta(days=1)
+    result = clickhouse_client.execute(query, run_params, raise_errors=True,
+                                       settings=profile_settings(profile))
+    names, types = result.names, result.types
+
+    rows_by_day = {}
+    for row in result:
+        rows_by_day.setdefault(str(row[0])[:10], []).append(row)
+
+    today = date.today()
+    partials = {}
+    for day, meta in metas.items():
+        partial = QueryResult.from_rows(names, types, rows_by_day.get(day.isoformat(), []))
+        day_ttl = ttl if day >= today else watermarks.ttl_for(meta, HISTORY_TTL)
+        query_cache.set(_day_key(query, params, day), partial, ttl=day_ttl, meta=meta)
+        partials[day] = partial
+    return partials
+
+
+def _merge(partials, keys, aggregates):
+    """Слияние частичных агрегатов по ключевым колонкам"""
+    names, types = [], []
+    for partial in partials:
+        if partial.names:
+            names, types = partial.names[1:], partial.types[1:]
+            break
+    if not names:
+        return QueryResult.empty()
+
+    key_indexes = [names.index(key) for key in keys]
+    merges = [(names.index(column), MERGE_FUNCTIONS[function])
+              for column, function in aggregates.items()]
+
+    merged = {}
+    for partial in partials:
+        for row in partial:
+            row = list(row[1:])
+            group = tuple(row[index] for index in key_indexes)
+            current = merged.get(group)
+            if current is None:
+                merged[group] = row
+                continue
+            for index, merge in merges:
+                value = row[index]
+                if value is None:
+                    continue
+                if current[index] is None:
+                    current[index] = value
+                else:
+                    current[index] = merge(current[index], value)
+
+    return QueryResult.from_rows(names, types, list(merged.values()))
+
+
+def execute_daily_aggregate(query, start_date, end_date, keys=(), aggregates=None,
+                            params=None, ttl=300, profile=None):
+    """
+    Аддитивный агрегат за период из кэша частичных агрегатов по дням.
+
+    Запрос должен первой колонкой возвращать день (GROUP BY день и keys)
+    и фильтровать период параметрами {start_date:Date} и {end_date:Date}.
+    aggregates задает слияние колонок: 'sum', 'min' или 'max'.
+    В ClickHouse запрашиваются только отсутствующие в кэше дни, соседние
+    дни объединяются в один запрос. profile - профиль настроек ClickHouse.
+    Возвращает QueryResult без колонки дня.
+    """
+    watermarks.ensure_started()
+    params = dict(params or {})
+    aggregates = aggregates or {}
+    start, end = _to_date(start_date), _to_date(end_date)
+    if end < start:
+        return QueryResult.empty()
+
+    partials = {}
+    missing = []
+    day = start
+    while day <= end:
+        partial = query_cache.get(_day_key(query, params, day))
+        if partial is None:
+            missing.append(day)
+        else:
+            partials[day] = partial
+        day += timedelta(days=1)
+
+    try:
+        for run_start, run_end in _day_runs(missing):
+            run_key = make_cache_key(query, dict(params, __days__=f"{run_start}:{run_end}"))
+            partials.update(run_shared(
+                single_flight, run_key, lambda: _load_days(query, params, run_start, run_end, ttl, profile)
+            ))
+    except QueryCancelledError:
+        # Результат вытесненного вызова никому не нужен
+        return QueryResult.empty()
+    except Exception as e:
+        report_error("Ошибка запроса к ClickHouse", e)
+        return QueryResult.empty()
+
+    return _merge([partials[day] for day in sorted(partials)], keys, aggregates)
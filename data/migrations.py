@@ -0,0 +1,105 @@
+import hashlib
+import os
+import re
+import sys
+from collections import namedtuple
+
+from data.clickhouse_client import clickhouse_client
+
+# Каталог миграций схемы витрин: файлы NNNN_имя.sql применяются по порядку
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_[\w-]+\.sql$')
+
+# База витрин и журнал примененных миграций создаются до первой миграции
+BOOTSTRAP = (
+    "CREATE DATABASE IF NOT EXISTS rollup",
+    """
+    CREATE TABLE IF NOT EXISTS rollup.schema_migrations
+    (
+        version UInt32,
+        name String,
+        checksum String,
+        applied_at DateTime DEFAULT now()
+    )
+    ENGINE = MergeTree
+    ORDER BY version
+    """
+)
+
+Migration = namedtuple('Migration', ['version', 'name', 'path'])
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """Файлы миграций каталога в порядке номеров"""
+    migrations = []
+    for name in os.listdir(directory):
+        match = MIGRATION_FILE_RE.match(name)
+        if match:
+            migrations.append(Migration(int(match.group(1)), name, os.path.join(directory, name)))
+    return sorted(migrations)
+
+
+def split_statements(sql):
+    """Инструкции файла миграции, разделенные ';' в конце строки"""
+    statements = []
+    for chunk in re.split(r';\s*$', sql, flags=re.MULTILINE):
+        code = [line for line in chunk.splitlines() if not line.strip().startswith('--')]
+        if ''.join(code).strip():
+            statements.append(chunk.strip())
+    return statements
+
+
+def applied_migrations(client=clickhouse_client):
+    """Примененные миграции: номер -> контрольная сумма"""
+    result = client.execute("SELECT version, checksum FROM rollup.schema_migrations",
+                            raise_errors=True)
+    return {int(version): checksum for version, checksum in result}
+
+
+def apply_migrations(client=clickhouse_client, directory=MIGRATIONS_DIR):
+    """
+    Применение недостающих миграций по порядку.
+
+    Инструкции миграций идемпотентны (IF NOT EXISTS), поэтому миграцию,
+    прерванную ошибкой, можно применить повторно. Измененный после
+    применения файл не применяется заново, о нем выводится предупреждение.
+    Возвращает имена примененных миграций.
+    """
+    for statement in BOOTSTRAP:
+        client.execute(statement, raise_errors=True)
+    applied = applied_migrations(client)
+
+    done = []
+    for migration in list_migrations(directory):
+        with open(migration.path, encoding='utf-8') as migration_file:
+            sql = migration_file.read()
+        checksum = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+        if migration.version in applied:
+            if applied[migration.version] != checksum:
+                print(f"Миграция {migration.name} изменена после применения")
+            continue
+
+        for statement in split_statements(sql):
+            client.execute(statement, raise_errors=True)
+        client.execute("""
+        INSERT INTO rollup.schema_migrations (version, name, checksum)
+        SELECT {version:UInt32}, {name:String}, {checksum:String}
+        """, {
+            'version': migration.version,
+            'name': migration.name,
+            'checksum': checksum
+        }, raise_errors=True)
+        print(f"Применена миграция {migration.name}")
+        done.append(migration.name)
+    return done
+
+
+if __name__ == '__main__':
+    # python -m data.migrations
+    try:
+        applied = apply_migrations()
+    except Exception as e:
+        print(f"Ошибка применения миграций: {e}")
+        sys.exit(1)
+    if not applied:
+        print("Схема витрин актуальна")
@@ -1,6 +1,29 @@
 import json
+import pandas as pd
+from collections import namedtuple
 from datetime import datetime, timedelta
-from data.clickhouse_client import execute_query_cached
+from data.cache import CachePolicy, QueryCache, SingleFlight
+from data.clickhouse_client import (
+    execute_query_cached, execute_query_stream, raise_if_cancelled, report_error, run_batch,
+    run_shared
+)
+from data.daily_aggregates import execute_daily_aggregate
+from data.rollups import rollup_source
+
+# Политики кэша по функциям: после soft_ttl секунд значение отдается
+# сразу и обновляется в фоне, после hard_ttl запрос выполняется заново
+CACHE_POLICIES = {
+    'get_general_static_kpi': CachePolicy(soft_ttl=120, hard_ttl=1800),
+    'get_general_kpi_bundle': CachePolicy(soft_ttl=60, hard_ttl=900),
+}
+
+# Профили настроек ClickHouse по функциям (см. SETTINGS_PROFILES): тяжелые
+# выгрузки уступают ресурсы интерактивным запросам, остальные функции
+# выполняются с профилем по умолчанию 'interactive'
+QUERY_PROFILES = {
+    'get_all_storage_data': 'heavy',
+    'get_general_static_kpi': 'heavy',
+}
 
 # Получение списка сотрудников из БД
 def get_employees():
@@ -37,49 +60,36 @@ def get_fine_categories():
 
 # Получение данных для карточки "Собрано заказов вовремя"
 def get_orders_timely(start_date, end_date):
-    query = """
-    SELECT 
-        COUNT(DISTINCT CASE WHEN timeliness_status IN ('вовремя', 'Вовремя') THEN SHIPMENT_ID END) as timely_count,
-        COUNT(DISTINCT CASE WHEN timeliness_status IN ('просрочено', 'Просрочено') THEN SHIPMENT_ID END) as delayed_count,
-        COUNT(DISTINCT SHIPMENT_ID) as total_count
-    FROM dwh.orders_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
-        AND ORDER_TYPE = 'Клиент'
-    """
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    if result and len(result[0]) >= 3:
-        timely = int(float(result[0][0])) if result[0][0] else 0
-        delayed = int(float(result[0][1])) if result[0][1] else 0
-        total = int(float(result[0][2])) if result[0][2] else 0
-        if total > 0:
-            percentage = (timely / total) * 100
-        else:
-            percentage = 0
-        return timely, delayed, total, round(percentage, 1)
+    timeliness = get_timeliness_aggregate(start_date, end_date)
+    timely = timeliness['timely']
+    delayed = timeliness['delayed']
+    total = timeliness['total']
+    if total > 0:
+        percentage = (timely / total) * 100
     else:
-        return 0, 0, 0, 0
+        percentage = 0
+    return timely, delayed, total, round(percentage, 1)
 
 # Получение данных для карточки "Среднее время операции"
 def get_avg_operation_time(start_date, end_date):
+    # Суммы по дням кэшируются, среднее считается по объединенным суммам
     query = """
     SELECT 
-        CASE 
-            WHEN COUNT(*) > 0 THEN SUM(duration_sec) / COUNT(*) / 60.0
-            ELSE 0 
-        END as avg_time_minutes
+        date as day,
+        COUNT(*) as ops_count,
+        SUM(duration_sec) as total_duration_sec
     FROM dwh.operations_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
+    WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
         AND duration_sec > 0
+    GROUP BY day
     """
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
+    result = execute_daily_aggregate(query, start_date, end_date, aggregates={
+        'ops_count': 'sum',
+        'total_duration_sec': 'sum'
     })
-    return float(result[0][0]) if result and result[0][0] else 0.0
+    if result and result[0][0]:
+        return float(result[0][1]) / result[0][0] / 60.0
+    return 0.0
 
 # Получение данных для карточки "Общий заработок"
 def get_total_earnings(start_date, end_date):
@@ -88,35 +98,39 @@ def get_total_earnings(start_date, end_date):
     # 1. Заработок от обычных операций
     query_regular = """
     SELECT 
+        date as day,
         COALESCE(SUM(price_per_op), 0) as total_regular_earnings
     FROM dwh.operations_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
+    WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
         AND price_per_op > 0
+    GROUP BY day
     """
     
-    regular_result = execute_query_cached(query_regular, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    regular_earnings = 0.0
-    if regular_result and regular_result[0]:
-        regular_earnings = float(regular_result[0][0]) if regular_result[0][0] else 0.0
-    
     # 2. Заработок от операций приемки
     query_reception = """
     SELECT 
+        DATE(event_time) as day,
         COUNT(*) as total_reception_count
     FROM dm.fact_transaction_events 
-    WHERE DATE(event_time) BETWEEN %(start_date)s AND %(end_date)s
+    WHERE DATE(event_time) BETWEEN {start_date:Date} AND {end_date:Date}
         AND event_time IS NOT NULL
         AND smena IN ('1', '2')
+    GROUP BY day
     """
     
-    reception_result = execute_query_cached(query_reception, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    # Обе части независимы и запрашиваются параллельно
+    regular_result, reception_result = run_batch([
+        lambda: execute_daily_aggregate(query_regular, start_date, end_date, aggregates={
+            'total_regular_earnings': 'sum'
+        }),
+        lambda: execute_daily_aggregate(query_reception, start_date, end_date, aggregates={
+            'total_reception_count': 'sum'
+        })
+    ])
+    
+    regular_earnings = 0.0
+    if regular_result and regular_result[0]:
+        regular_earnings = float(regular_result[0][0]) if regular_result[0][0] else 0.0
     
     reception_earnings = 0.0
     if reception_result and reception_result[0]:
@@ -133,52 +147,9 @@ def get_total_earnings(start_date, end_date):
 def get_storage_cells_stats():
     """
     Получение статистики по ячейкам хранения с учетом LOCATION_STS
-    и всех фильтров из Power Query
+    и всех фильтров из Power Query (см. get_general_static_kpi)
     """
-    query = """
-    SELECT 
-        COUNT(DISTINCT LOCATION) as total_cells,
-        SUM(CASE WHEN LOCATION_STS IN ('Storage', 'Picking') THEN 1 ELSE 0 END) as occupied_cells,
-        SUM(CASE WHEN LOCATION_STS = 'Empty' THEN 1 ELSE 0 END) as free_cells
-    FROM olap.raw_location 
-    WHERE LOCATION IS NOT NULL 
-        AND LOCATION != ''
-        AND LOCATION_STS IS NOT NULL
-        AND LOCATION_STS != 'Frozen'  -- Исключаем замороженные
-        AND LOCATION_TYPE IS NOT NULL
-        AND LOCATION_TYPE NOT IN ('Брак/бой DMG', 'Напольная', 'Улица KC', 'Ячейки KSP')  -- Исключаем типы
-        AND (LOCATION_CLASS = 'Inventory' OR LOCATION_CLASS IS NULL)  -- Фильтр по классу или NULL
-    """
-    
-    result = execute_query_cached(query)
-    
-    if result and result[0]:
-        total_cells = int(float(result[0][0])) if result[0][0] else 0
-        occupied_cells = int(float(result[0][1])) if result[0][1] else 0
-        free_cells = int(float(result[0][2])) if result[0][2] else 0
-        
-        # Рассчитываем проценты
-        occupied_percent = 0
-        free_percent = 0
-        if total_cells > 0:
-            occupied_percent = round((occupied_cells / total_cells) * 100, 1)
-            free_percent = round((free_cells / total_cells) * 100, 1)
-        
-        return {
-            'total_cells': total_cells,
-            'occupied_cells': occupied_cells,
-            'free_cells': free_cells,
-            'occupied_percent': occupied_percent,
-            'free_percent': free_percent
-        }
-    else:
-        return {
-            'total_cells': 0,
-            'occupied_cells': 0,
-            'free_cells': 0,
-            'occupied_percent': 0,
-            'free_percent': 0
-        }
+    return dict(get_general_static_kpi().storage)
 
 # Получение данных для карточки "Точность заказов"
 def get_order_accuracy(start_date, end_date):
@@ -187,17 +158,17 @@ def get_order_accuracy(start_date, end_date):
     all_orders AS (
         SELECT DISTINCT SHIPMENT_ID
         FROM dwh.orders_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
             AND ORDER_TYPE = 'Клиент'
     ),
     error_orders AS (
         SELECT DISTINCT o.SHIPMENT_ID
         FROM dwh.orders_enriched o
         INNER JOIN olap.raw_shtraf_edit s ON o.SHIPMENT_ID = s.reference_id
-        WHERE o.date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE o.date BETWEEN {start_date:Date} AND {end_date:Date}
             AND o.ORDER_TYPE = 'Клиент'
             AND s.name = 'Штраф по претензии'
-            AND DATE(s.date_time_stamp) BETWEEN %(start_date)s AND %(end_date)s
+            AND DATE(s.date_time_stamp) BETWEEN {start_date:Date} AND {end_date:Date}
     )
     SELECT 
         COUNT(DISTINCT a.SHIPMENT_ID) as total_orders,
@@ -228,25 +199,24 @@ def get_order_accuracy(start_date, end_date):
 
 # Получение средней производительности сотрудников
 def get_avg_productivity(start_date, end_date):
-    query = """
+    # Сотрудник x день из витрины rollup.employee_daily (см. data/rollups.py)
+    source, source_params = rollup_source('employee_daily')
+    query = f"""
     WITH employee_stats AS (
         SELECT 
-            fio,
-            COUNT(*) as total_ops,
-            MIN(START_DATE_TIME) as first_op,
-            MAX(END_DATE_TIME) as last_op,
+            employee as fio,
+            SUM(regular_ops) as total_ops,
+            MIN(first_op_start) as first_op,
+            MAX(last_op_end) as last_op,
             CASE 
-                WHEN TIMESTAMPDIFF(MINUTE, MIN(START_DATE_TIME), MAX(END_DATE_TIME)) > 0 
-                THEN COUNT(*) * 60.0 / TIMESTAMPDIFF(MINUTE, MIN(START_DATE_TIME), MAX(END_DATE_TIME))
+                WHEN TIMESTAMPDIFF(MINUTE, MIN(first_op_start), MAX(last_op_end)) > 0 
+                THEN SUM(regular_ops) * 60.0 / TIMESTAMPDIFF(MINUTE, MIN(first_op_start), MAX(last_op_end))
                 ELSE 0 
             END as ops_per_hour
-        FROM dwh.operations_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
-            AND fio IS NOT NULL
-            AND START_DATE_TIME IS NOT NULL
-            AND END_DATE_TIME IS NOT NULL
-        GROUP BY fio
-        HAVING COUNT(*) > 5
+        FROM ({source})
+        WHERE day BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+        GROUP BY employee
+        HAVING SUM(regular_ops) > 5
     )
     SELECT 
         CASE 
@@ -260,7 +230,8 @@ def get_avg_productivity(start_date, end_date):
     
     result = execute_query_cached(query, {
         'start_date': start_date,
-        'end_date': end_date
+        'end_date': end_date,
+        **source_params
     })
     
     if result and result[0]:
@@ -274,190 +245,120 @@ def get_avg_productivity(start_date, end_date):
 def get_performance_data(start_date, end_date):
     """Получение данных производительности сотрудников с учетом операций приемки"""
     
-    # 1. Получаем обычные операции
-    query_regular = """
+    # 1. Получаем обычные операции (частичные агрегаты по дням из витрины
+    # сотрудник x день rollup.employee_daily, см. data/rollups.py)
+    source, source_params = rollup_source('employee_daily')
+    query_regular = f"""
     SELECT 
-        fio as employee,
-        COUNT(*) as total_regular_ops,
-        CASE 
-            WHEN COUNT(*) > 0 THEN SUM(duration_sec) / COUNT(*) / 60.0
-            ELSE 0 
-        END as avg_time_per_op,
-        COALESCE(SUM(price_per_op), 0) as regular_earnings,
-        MIN(START_DATE_TIME) as first_op_time,
-        MAX(END_DATE_TIME) as last_op_time
-    FROM dwh.operations_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
-        AND fio IS NOT NULL
-        AND START_DATE_TIME IS NOT NULL
-        AND END_DATE_TIME IS NOT NULL
-    GROUP BY fio
-    HAVING COUNT(*) > 0
+        day,
+        employee,
+        SUM(regular_ops) as total_regular_ops,
+        SUM(work_sec) as total_duration_sec,
+        SUM(earnings) as regular_earnings,
+        MIN(first_op_start) as first_op_time,
+        MAX(last_op_end) as last_op_time
+    FROM ({source})
+    WHERE day BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+    GROUP BY day, employee
     """
     
-    regular_result = execute_query_cached(query_regular, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    # 2. Получаем операции приемки
-    reception_operations = get_reception_operations_period(start_date, end_date)
-    
-    # 3. Объединяем данные
-    performance_data = []
-    employees_processed = set()
+    # 2. Операции приемки запрашиваются параллельно с обычными
+    regular_result, reception_operations = run_batch([
+        lambda: execute_daily_aggregate(
+            query_regular, start_date, end_date,
+            keys=['employee'],
+            params=source_params,
+            aggregates={
+                'total_regular_ops': 'sum',
+                'total_duration_sec': 'sum',
+                'regular_earnings': 'sum',
+                'first_op_time': 'min',
+                'last_op_time': 'max'
+            }
+        ),
+        lambda: get_reception_operations_period(start_date, end_date)
+    ])
     
-    # Обрабатываем обычные операции
+    # 3. Объединяем данные по колонкам
+    regular_columns = ['employee', 'total_regular_ops', 'avg_time_per_op',
+                       'regular_earnings', 'first_op_time', 'last_op_time']
     if regular_result:
-        for row in regular_result:
-            try:
-                employee = row[0] if row[0] else ''
-                if not employee:
-                    continue
-                    
-                employees_processed.add(employee)
-                
-                total_regular_ops = int(float(row[1])) if row[1] else 0
-                avg_time = float(row[2]) if row[2] else 0.0
-                regular_earnings = float(row[3]) if row[3] else 0.0
-                first_op = str(row[4]) if row[4] else ''
-                last_op = str(row[5]) if row[5] else ''
-                
-                # Получаем данные по приемке для этого сотрудника
-                reception_data = reception_operations.get(employee, {
-                    'reception_count': 0,
-                    'earnings': 0.0,
-                    'first_reception_time': '',
-                    'last_reception_time': ''
-                })
-                
-                total_ops = total_regular_ops + reception_data['reception_count']
-                total_earnings = regular_earnings + reception_data['earnings']
-                
-                # Определяем общее время работы (из обычных операций или приемки)
-                work_start_time = first_op
-                work_end_time = last_op
-                
-                # Если есть приемка и у нее более раннее/позднее время
-                if reception_data['first_reception_time']:
-                    if not work_start_time or reception_data['first_reception_time'] < work_start_time:
-                        work_start_time = reception_data['first_reception_time']
-                if reception_data['last_reception_time']:
-                    if not work_end_time or reception_data['last_reception_time'] > work_end_time:
-                        work_end_time = reception_data['last_reception_time']
-                
-                # Рассчитываем время работы и операции в час
-                work_duration = '--:--'
-                ops_per_hour = 0
-                
-                if work_start_time and work_end_time:
-                    try:
-                        first_dt = datetime.strptime(work_start_time[:19], '%Y-%m-%d %H:%M:%S') if ' ' in work_start_time else datetime.strptime(work_start_time[:19], '%Y-%m-%dT%H:%M:%S')
-                        last_dt = datetime.strptime(work_end_time[:19], '%Y-%m-%d %H:%M:%S') if ' ' in work_end_time else datetime.strptime(work_end_time[:19], '%Y-%m-%dT%H:%M:%S')
-                        
-                        work_minutes = (last_dt - first_dt).total_seconds() / 60
-                        if work_minutes > 0:
-                            hours = int(work_minutes // 60)
-                            minutes = int(work_minutes % 60)
-                            work_duration = f"{hours}ч {minutes}м"
-                            
-                            # Операций в час (все операции)
-                            ops_per_hour = round(total_ops * 60 / work_minutes, 1)
-                    except Exception as e:
-                        print(f"Ошибка расчета времени для {employee}: {e}")
-                
-                # Время первой операции
-                first_op_time = '--:--'
-                if work_start_time:
-                    try:
-                        if ' ' in work_start_time:
-                            time_part = work_start_time.split(' ')[1]
-                            first_op_time = time_part[:5]
-                        elif 'T' in work_start_time:
-                            time_part = work_start_time.split('T')[1]
-                            first_op_time = time_part[:5]
-                        else:
-                            first_op_time = work_start_time[:5]
-                    except:
-                        first_op_time = '--:--'
-                
-                performance_data.append({
-                    'Сотрудник': employee,
-                    'Общее_кол_операций': total_ops,
-                    'Ср_время_на_операцию': round(avg_time, 1) if avg_time else 0.0,
-                    'Заработок': round(total_earnings, 2),
-                    'Операций_в_час': ops_per_hour,
-                    'Время_работы': work_duration,
-                    'Время_первой_операции': first_op_time,
-                    'Обычные_операции': total_regular_ops,
-                    'Приемка': reception_data['reception_count']
-                })
-            except Exception as e:
-                print(f"Error processing regular operation row: {e}")
-                continue
-    
-    # 4. Добавляем сотрудников, у которых есть только приемка (нет обычных операций)
-    for employee, reception_data in reception_operations.items():
-        if employee not in employees_processed:
-            try:
-                total_ops = reception_data['reception_count']
-                total_earnings = reception_data['earnings']
-                work_start_time = reception_data['first_reception_time']
-                work_end_time = reception_data['last_reception_time']
-                
-                # Рассчитываем время работы
-                work_duration = '--:--'
-                ops_per_hour = 0
-                
-                if work_start_time and work_end_time:
-                    try:
-                        first_dt = datetime.strptime(work_start_time[:19], '%Y-%m-%d %H:%M:%S') if ' ' in work_start_time else datetime.strptime(work_start_time[:19], '%Y-%m-%dT%H:%M:%S')
-                        last_dt = datetime.strptime(work_end_time[:19], '%Y-%m-%d %H:%M:%S') if ' ' in work_end_time else datetime.strptime(work_end_time[:19], '%Y-%m-%dT%H:%M:%S')
-                        
-                        work_minutes = (last_dt - first_dt).total_seconds() / 60
-                        if work_minutes > 0:
-                            hours = int(work_minutes // 60)
-                            minutes = int(work_minutes % 60)
-                            work_duration = f"{hours}ч {minutes}м"
-                            
-                            # Операций в час
-                            ops_per_hour = round(total_ops * 60 / work_minutes, 1)
-                    except Exception as e:
-                        print(f"Ошибка расчета времени для {employee} (только приемка): {e}")
-                
-                # Время первой операции
-                first_op_time = '--:--'
-                if work_start_time:
-                    try:
-                        if ' ' in work_start_time:
-                            time_part = work_start_time.split(' ')[1]
-                            first_op_time = time_part[:5]
-                        elif 'T' in work_start_time:
-                            time_part = work_start_time.split('T')[1]
-                            first_op_time = time_part[:5]
-                        else:
-                            first_op_time = work_start_time[:5]
-                    except:
-                        first_op_time = '--:--'
-                
-                performance_data.append({
-                    'Сотрудник': employee,
-                    'Общее_кол_операций': total_ops,
-                    'Ср_время_на_операцию': 0.0,  # Нет данных для приемки
-                    'Заработок': round(total_earnings, 2),
-                    'Операций_в_час': ops_per_hour,
-                    'Время_работы': work_duration,
-                    'Время_первой_операции': first_op_time,
-                    'Обычные_операции': 0,
-                    'Приемка': reception_data['reception_count']
-                })
-            except Exception as e:
-                print(f"Error processing reception-only row for {employee}: {e}")
-                continue
-    
-    # 5. Сортируем по заработку (основной критерий теперь)
+        regular = regular_result.to_dataframe()
+        regular = regular[regular['employee'].fillna('') != '']
+        regular = regular.assign(
+            avg_time_per_op=regular['total_duration_sec'] / regular['total_regular_ops'] / 60.0
+        )
+    else:
+        regular = pd.DataFrame(columns=regular_columns)
+
+    reception = pd.DataFrame(
+        [(employee, data['reception_count'], data['earnings'],
+          data['first_reception_time'], data['last_reception_time'])
+         for employee, data in reception_operations.items()],
+        columns=['employee', 'reception_count', 'reception_earnings',
+                 'first_reception_time', 'last_reception_time']
+    )
+
+    # Сначала сотрудники с обычными операциями, затем только с приемкой
+    reception_only = reception[~reception['employee'].isin(regular['employee'])]
+    merged = pd.concat(
+        [regular.merge(reception, on='employee', how='left'), reception_only],
+        ignore_index=True
+    )
+
+    if merged.empty:
+        return []
+
+    try:
+        regular_ops = merged['total_regular_ops'].fillna(0).astype(int)
+        reception_count = merged['reception_count'].fillna(0).astype(int)
+        avg_time = merged['avg_time_per_op'].astype(float).fillna(0.0)
+        total_ops = regular_ops + reception_count
+        total_earnings = (merged['regular_earnings'].astype(float).fillna(0.0)
+                          + merged['reception_earnings'].astype(float).fillna(0.0))
+
+        # Общее время работы: самое раннее и самое позднее из обычных операций и приемки
+        times = pd.DataFrame({
+            column: pd.to_datetime(merged[column].replace('', None), errors='coerce')
+            for column in ('first_op_time', 'last_op_time',
+                           'first_reception_time', 'last_reception_time')
+        })
+        work_start = times[['first_op_time', 'first_reception_time']].min(axis=1)
+        work_end = times[['last_op_time', 'last_reception_time']].max(axis=1)
+
+        # Рассчитываем время работы и операции в час (все операции)
+        work_minutes = ((work_end - work_start).dt.total_seconds() / 60).fillna(0.0)
+        has_work = work_minutes > 0
+        safe_minutes = work_minutes.where(has_work, 1.0)
+        work_duration = (
+            (safe_minutes // 60).astype(int).astype(str) + 'ч '
+            + (safe_minutes % 60).astype(int).astype(str) + 'м'
+        ).where(has_work, '--:--')
+        ops_per_hour = (total_ops * 60 / safe_minutes).round(1).where(has_work, 0)
+
+        # Время первой операции
+        first_op_time = work_start.dt.strftime('%H:%M').fillna('--:--')
+
+        performance_data = pd.DataFrame({
+            'Сотрудник': merged['employee'],
+            'Общее_кол_операций': total_ops,
+            'Ср_время_на_операцию': avg_time.round(1),
+            'Заработок': total_earnings.round(2),
+            'Операций_в_час': ops_per_hour,
+            'Время_работы': work_duration,
+            'Время_первой_операции': first_op_time,
+            'Обычные_операции': regular_ops,
+            'Приемка': reception_count
+        }).to_dict('records')
+    except Exception as e:
+        # Ошибки запросов уже обработаны выше, здесь - ошибки в данных или коде:
+        # пустая таблица их бы скрыла
+        report_error("Ошибка обработки данных производительности", e)
+        raise
+
+    # 4. Сортируем по заработку (основной критерий теперь)
     performance_data.sort(key=lambda x: x['Заработок'], reverse=True)
-    
+
     return performance_data
 
 # Получение данных о простоях сотрудника
@@ -471,8 +372,8 @@ def get_employee_idle_data(employee_name, start_date, end_date):
         SUM(idle_count_30_60) as idle_30_60_count,
         SUM(idle_count_60plus) as idle_60plus_count
     FROM dm.fact_employee_activity 
-    WHERE fio = %(employee_name)s
-        AND date_key BETWEEN %(start_date)s AND %(end_date)s
+    WHERE fio = {employee_name:String}
+        AND date_key BETWEEN {start_date:Date} AND {end_date:Date}
     """
     
     result = execute_query_cached(query, {
@@ -505,50 +406,150 @@ def get_employee_idle_data(employee_name, start_date, end_date):
             }
         }
 
-# Получение данных для топ-5 проблемных часов
-def get_problematic_hours(start_date, end_date):
-    query = """
+# Счетчики почасового профиля
+HOUR_COUNTERS = ('total_rows', 'delayed_rows', 'total_orders', 'error_orders', 'claim_orders')
+
+
+def _hour_metrics(counters):
+    """Проценты просрочек и ошибок для счетчиков часа"""
+    counters['delay_percentage'] = (
+        round(counters['delayed_rows'] * 100.0 / counters['total_rows'], 1)
+        if counters['total_rows'] > 0 else 0
+    )
+    counters['error_percentage'] = (
+        round(counters['error_orders'] * 100.0 / counters['total_orders'], 1)
+        if counters['total_orders'] > 0 else 0
+    )
+    return counters
+
+
+# Почасовой профиль заказов и ошибок за период (все 24 часа, с разбивкой по дням)
+def hourly_order_profile_request(start_date, end_date):
+    """Запрос профиля час x день и его параметры"""
+    # Заказы по дням и часам из витрины rollup.orders_hourly (см. data/rollups.py)
+    source, source_params = rollup_source('orders_hourly')
+    query = f"""
     SELECT 
-        EXTRACT(HOUR FROM START_DATE_TIME) as hour,
-        COUNT(*) as total_orders,
-        SUM(CASE WHEN timeliness_status IN ('просрочено', 'Просрочено') THEN 1 ELSE 0 END) as delayed_orders,
-        CASE 
-            WHEN COUNT(*) > 0 
-            THEN ROUND(SUM(CASE WHEN timeliness_status IN ('просрочено', 'Просрочено') THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 1)
-            ELSE 0 
-        END as delay_percentage
-    FROM dwh.orders_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
-        AND ORDER_TYPE = 'Клиент'
-        AND START_DATE_TIME IS NOT NULL
-    GROUP BY EXTRACT(HOUR FROM START_DATE_TIME)
-    HAVING COUNT(*) >= 5
-    ORDER BY delay_percentage DESC
-    LIMIT 5
+        hour,
+        day,
+        is_total,
+        o.total_rows as total_rows,
+        o.delayed_rows as delayed_rows,
+        o.total_orders as total_orders,
+        e.error_orders as error_orders,
+        e.claim_orders as claim_orders,
+        e.error_types as error_types
+    FROM (
+        SELECT 
+            hour,
+            day,
+            grouping(day) as is_total,
+            SUM(row_count) as total_rows,
+            SUM(delayed_count) as delayed_rows,
+            uniqExactMerge(orders_state) as total_orders
+        FROM ({source})
+        WHERE day BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+        GROUP BY GROUPING SETS ((hour, day), (hour))
+    ) o
+    FULL OUTER JOIN (
+        SELECT 
+            toHour(assumeNotNull(error_time)) as hour,
+            toDate(assumeNotNull(error_time)) as day,
+            grouping(day) as is_total,
+            uniqExactIf(reference_id, reference_id != '') as error_orders,
+            arrayStringConcat(arrayDistinct(groupArrayIf(name, reference_id != '')), ', ') as error_types,
+            uniqExactIf(reference_id, name = 'Штраф по претензии' AND reference_id IN (
+                SELECT SHIPMENT_ID
+                FROM dwh.orders_enriched 
+                WHERE date BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+                    AND ORDER_TYPE = 'Клиент'
+            )) as claim_orders
+        FROM (
+            SELECT 
+                parseDateTimeBestEffortOrNull(date_time_stamp) as error_time,
+                reference_id,
+                name
+            FROM olap.raw_shtraf_edit 
+            WHERE date_time_stamp IS NOT NULL
+                AND date_time_stamp != ''
+                AND reference_id IS NOT NULL
+        )
+        WHERE error_time IS NOT NULL
+            AND DATE(error_time) BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+        GROUP BY GROUPING SETS ((hour, day), (hour))
+    ) e USING (hour, day, is_total)
+    ORDER BY hour, day
+    SETTINGS force_grouping_standard_compatibility = 1
     """
-    
-    result = execute_query_cached(query, {
+    return query, {
         'start_date': start_date,
-        'end_date': end_date
-    })
+        'end_date': end_date,
+        **source_params
+    }
+
+def hourly_order_profile_from_result(result):
+    """24 словаря часов с разбивкой by_day из результата запроса профиля"""
+    profile = [
+        dict({counter: 0 for counter in HOUR_COUNTERS}, hour=hour, error_types='', by_day={})
+        for hour in range(24)
+    ]
+    for row in result:
+        row = dict(zip(result.names, row))
+        counters = {counter: int(row[counter] or 0) for counter in HOUR_COUNTERS}
+        hour = profile[int(row['hour'])]
+        if row['is_total']:
+            hour.update(counters)
+            hour['error_types'] = row['error_types'] or ''
+        else:
+            hour['by_day'][str(row['day'])] = _hour_metrics(counters)
+    
+    for hour in profile:
+        _hour_metrics(hour)
+    return profile
+
+def get_hourly_order_profile(start_date, end_date):
+    """
+    Профиль час суток x день одним запросом.
+
+    GROUPING SETS ((hour, day), (hour)) дают точные итоги по часу за весь
+    период (уникальные заказы не суммируются по дням) и разбивку по дням.
+    По часу начала клиентского заказа: строки, просроченные строки и
+    уникальные заказы. По часу штрафа из olap.raw_shtraf_edit: заказы
+    с ошибками, типы ошибок и заказы со штрафом по претензии среди
+    клиентских заказов периода. Результат кэшируется на диапазон;
+    графики часов строятся из него через rank_hours без новых запросов.
+    """
+    query, params = hourly_order_profile_request(start_date, end_date)
+    return hourly_order_profile_from_result(execute_query_cached(query, params))
+
+def rank_hours(profile, metric, top_n=5, min_counts=None):
+    """
+    Топ часов профиля по метрике без обращения к ClickHouse.
+
+    metric - ключ часа ('delay_percentage', 'error_percentage',
+    'claim_orders', ...). min_counts отбрасывает часы, где счетчик
+    меньше заданного порога, например {'total_rows': 5}.
+    """
+    min_counts = min_counts or {}
+    hours = [
+        hour for hour in profile
+        if all(hour[counter] >= threshold for counter, threshold in min_counts.items())
+    ]
+    hours.sort(key=lambda hour: hour[metric], reverse=True)
+    return hours[:top_n]
+
+# Получение данных для топ-5 проблемных часов
+def get_problematic_hours(start_date, end_date):
+    profile = get_hourly_order_profile(start_date, end_date)
     
     hours_data = []
-    if result:
-        for row in result:
-            try:
-                hour = int(float(row[0])) if row[0] else 0
-                total = int(float(row[1])) if row[1] else 0
-                delayed = int(float(row[2])) if row[2] else 0
-                percentage = float(row[3]) if row[3] else 0
-                
-                hours_data.append({
-                    'hour': hour,
-                    'total_orders': total,
-                    'delayed_orders': delayed,
-                    'delay_percentage': percentage
-                })
-            except:
-                continue
+    for hour in rank_hours(profile, 'delay_percentage', min_counts={'total_rows': 5}):
+        hours_data.append({
+            'hour': hour['hour'],
+            'total_orders': hour['total_rows'],
+            'delayed_orders': hour['delayed_rows'],
+            'delay_percentage': hour['delay_percentage']
+        })
     
     return hours_data
 
@@ -558,116 +559,20 @@ def get_error_hours_top_data(start_date, end_date):
     
     print(f"DEBUG [get_error_hours_top_data]: Начало обработки периода {start_date} - {end_date}")
     
-    # 1. Проверяем, есть ли вообще заказы с ошибками
-    check_errors_query = """
-    SELECT 
-        COUNT(*) as total_errors,
-        MIN(DATE(parseDateTimeBestEffortOrNull(date_time_stamp))) as first_date,
-        MAX(DATE(parseDateTimeBestEffortOrNull(date_time_stamp))) as last_date
-    FROM olap.raw_shtraf_edit 
-    WHERE DATE(parseDateTimeBestEffortOrNull(date_time_stamp)) BETWEEN %(start_date)s AND %(end_date)s
-        AND date_time_stamp IS NOT NULL
-        AND date_time_stamp != ''
-        AND reference_id IS NOT NULL
-    """
-    
-    check_result = execute_query_cached(check_errors_query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    print(f"DEBUG: Всего ошибок в raw_shtraf_edit: {check_result[0][0] if check_result else 0}")
-    
-    # Основной запрос с простой и понятной логикой
-    query = """
-    WITH error_hours_base AS (
-        -- Шаг 1: Получаем часы с ошибками и считаем ошибки
-        SELECT 
-            toHour(parseDateTimeBestEffortOrNull(s.date_time_stamp)) as hour_with_error,
-            s.reference_id,
-            s.name as error_type
-        FROM olap.raw_shtraf_edit s
-        WHERE DATE(parseDateTimeBestEffortOrNull(s.date_time_stamp)) BETWEEN %(start_date)s AND %(end_date)s
-            AND s.date_time_stamp IS NOT NULL
-            AND s.date_time_stamp != ''
-            AND s.reference_id IS NOT NULL
-            AND s.reference_id != ''
-    ),
-    aggregated_errors AS (
-        -- Шаг 2: Агрегируем ошибки по часам
-        SELECT 
-            hour_with_error,
-            COUNT(DISTINCT reference_id) as error_orders_count,
-            arrayStringConcat(arrayDistinct(groupArray(error_type)), ', ') as error_types
-        FROM error_hours_base
-        WHERE hour_with_error IS NOT NULL
-        GROUP BY hour_with_error
-    ),
-    total_orders_by_hour AS (
-        -- Шаг 3: Получаем общее количество заказов по часам
-        SELECT 
-            toHour(START_DATE_TIME) as hour,
-            COUNT(DISTINCT SHIPMENT_ID) as total_orders_in_hour
-        FROM dwh.orders_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
-            AND ORDER_TYPE = 'Клиент'
-            AND START_DATE_TIME IS NOT NULL
-        GROUP BY toHour(START_DATE_TIME)
-    )
-    -- Шаг 4: Объединяем ошибки с общими заказами
-    SELECT 
-        t.hour,
-        COALESCE(e.error_orders_count, 0) as error_orders_count,
-        COALESCE(t.total_orders_in_hour, 0) as total_orders_in_hour,
-        CASE 
-            WHEN COALESCE(t.total_orders_in_hour, 0) > 0 
-            THEN ROUND(COALESCE(e.error_orders_count, 0) * 100.0 / t.total_orders_in_hour, 1)
-            ELSE 0 
-        END as error_percentage,
-        COALESCE(e.error_types, '') as error_types
-    FROM total_orders_by_hour t
-    LEFT JOIN aggregated_errors e ON t.hour = e.hour_with_error
-    WHERE COALESCE(e.error_orders_count, 0) > 0
-        AND COALESCE(t.total_orders_in_hour, 0) > 0
-    ORDER BY error_percentage DESC
-    LIMIT 5
-    """
-    
-    print(f"DEBUG: Выполняем основной запрос для периода {start_date} - {end_date}")
-    
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    profile = get_hourly_order_profile(start_date, end_date)
     
     error_hours_data = []
-    if result:
-        print(f"DEBUG: Основной запрос вернул {len(result)} записей")
-        for i, row in enumerate(result):
-            try:
-                hour = int(float(row[0])) if row[0] else 0
-                error_count = int(float(row[1])) if row[1] else 0
-                total_orders = int(float(row[2])) if row[2] else 0
-                error_percentage = float(row[3]) if row[3] else 0
-                error_types = row[4] if row[4] else ''
-                
-                error_hours_data.append({
-                    'hour': hour,
-                    'error_orders_count': error_count,
-                    'total_orders_in_hour': total_orders,
-                    'error_percentage': error_percentage,
-                    'error_types': error_types
-                })
-                print(f"DEBUG: Запись {i+1}: Час {hour}: {error_count} ошибок из {total_orders} заказов ({error_percentage}%)")
-            except Exception as e:
-                print(f"ERROR processing row {row}: {e}")
-                continue
-    
-    # Упрощаем логику демо-данных: только если ВООБЩЕ нет ошибок
-    if not error_hours_data and check_result and check_result[0][0] == 0:
-        print(f"DEBUG: ВНИМАНИЕ: Вообще нет ошибок за период {start_date} - {end_date}")
-        print(f"DEBUG: Показываем сообщение 'Нет данных' вместо демо-данных")
-        return []
+    for hour in rank_hours(profile, 'error_percentage',
+                           min_counts={'error_orders': 1, 'total_orders': 1}):
+        error_hours_data.append({
+            'hour': hour['hour'],
+            'error_orders_count': hour['error_orders'],
+            'total_orders_in_hour': hour['total_orders'],
+            'error_percentage': hour['error_percentage'],
+            'error_types': hour['error_types']
+        })
+        print(f"DEBUG: Запись {len(error_hours_data)}: Час {hour['hour']}: {hour['error_orders']} ошибок "
+              f"из {hour['total_orders']} заказов ({hour['error_percentage']}%)")
     
     print(f"DEBUG: Итоговые данные: {len(error_hours_data)} записей")
     return error_hours_data
@@ -687,7 +592,7 @@ def get_shift_comparison(start_date, end_date):
                 ELSE 0 
             END as avg_time_per_op
         FROM dwh.operations_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
             AND fio IS NOT NULL
             AND START_DATE_TIME IS NOT NULL
             AND END_DATE_TIME IS NOT NULL
@@ -700,20 +605,10 @@ def get_shift_comparison(start_date, end_date):
             COUNT(DISTINCT SHIPMENT_ID) as total_orders,
             SUM(CASE WHEN timeliness_status IN ('вовремя', 'Вовремя') THEN 1 ELSE 0 END) as timely_orders
         FROM dwh.orders_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
             AND fio IS NOT NULL
             AND ORDER_TYPE = 'Клиент'
         GROUP BY fio
-    ),
-    fines_data AS (
-        SELECT 
-            fio,
-            COUNT(*) as fines_count,
-            COALESCE(SUM(fine_amount), 0) as fines_amount
-        FROM dm.fact_fines 
-        WHERE date_key BETWEEN %(start_date)s AND %(end_date)s
-            AND fio IS NOT NULL
-        GROUP BY fio
     )
     SELECT 
         o.fio as employee,
@@ -748,226 +643,220 @@ def get_shift_comparison(start_date, end_date):
             WHEN COALESCE(t.total_orders, 0) > 0 
             THEN ROUND(COALESCE(t.timely_orders, 0) * 100.0 / t.total_orders, 1)
             ELSE 100.0
-        END as timely_percent,
-        -- Штрафы
-        COALESCE(f.fines_count, 0) as fines_count,
-        COALESCE(f.fines_amount, 0) as fines_amount
+        END as timely_percent
     FROM operations_data o
     LEFT JOIN timeliness_data t ON o.fio = t.fio
-    LEFT JOIN fines_data f ON o.fio = f.fio
     ORDER BY ops_per_hour DESC
     """
     
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    comparison_data = []
-    if result:
-        for row in result:
-            try:
-                comparison_data.append({
-                    'Сотрудник': row[0],
-                    'Операций': int(float(row[1])) if row[1] else 0,
-                    'Время_работы': row[2] if row[2] else '--:--',
-                    'Операций_в_час': float(row[3]) if row[3] else 0.0,
-                    'Занятость_процент': float(row[4]) if row[4] else 0.0,
-                    'Вовремя_процент': float(row[5]) if row[5] else 100.0,
-                    'Штрафы_кол': int(float(row[6])) if row[6] else 0,
-                    'Штрафы_сумма': float(row[7]) if row[7] else 0.0
-                })
-            except Exception as e:
-                print(f"Error processing shift comparison row: {e}")
-                continue
+    # Штрафы берутся из куба штрафов за тот же период (параллельно с основным запросом)
+    result, fines_cube = run_batch([
+        lambda: execute_query_cached(query, {
+            'start_date': start_date,
+            'end_date': end_date
+        }),
+        lambda: get_fines_cube(start_date, end_date)
+    ])
     
-    return comparison_data
+    if not result:
+        return []
+
+    fines_by_employee = fines_cube['by_employee']
+
+    try:
+        df = result.to_dataframe()
+        fines_count = {fio: totals['count'] for fio, totals in fines_by_employee.items()}
+        fines_amount = {fio: totals['total_amount'] for fio, totals in fines_by_employee.items()}
+        timely_percent = df['timely_percent'].astype(float)
+        comparison_data = pd.DataFrame({
+            'Сотрудник': df['employee'],
+            'Операций': df['operations_count'].fillna(0).astype(int),
+            'Время_работы': df['work_duration'].fillna('').replace('', '--:--'),
+            'Операций_в_час': df['ops_per_hour'].astype(float).fillna(0.0),
+            'Занятость_процент': df['busy_percent'].astype(float).fillna(0.0),
+            'Вовремя_процент': timely_percent.where(timely_percent.fillna(0) != 0, 100.0),
+            'Штрафы_кол': df['employee'].map(fines_count).fillna(0).astype(int),
+            'Штрафы_сумма': df['employee'].map(fines_amount).astype(float).fillna(0.0)
+        })
+    except Exception as e:
+        print(f"Error processing shift comparison data: {e}")
+        return []
+
+    return comparison_data.to_dict('records')
 
 def get_error_hours_data(start_date, end_date):
     """
     Получение данных о часах с ошибками в заказах
     Возвращает топ-5 часов с наибольшим количеством ошибок
     """
-    query = """
-    SELECT 
-        EXTRACT(HOUR FROM s.date_time_stamp) as error_hour,
-        COUNT(DISTINCT o.SHIPMENT_ID) as error_orders_count
-    FROM dwh.orders_enriched o
-    INNER JOIN olap.raw_shtraf_edit s ON o.SHIPMENT_ID = s.reference_id
-    WHERE o.date BETWEEN %(start_date)s AND %(end_date)s
-        AND o.ORDER_TYPE = 'Клиент'
-        AND s.name = 'Штраф по претензии'
-        AND DATE(s.date_time_stamp) BETWEEN %(start_date)s AND %(end_date)s
-        AND s.date_time_stamp IS NOT NULL
-    GROUP BY EXTRACT(HOUR FROM s.date_time_stamp)
-    HAVING COUNT(DISTINCT o.SHIPMENT_ID) >= 2
-    ORDER BY error_orders_count DESC
-    LIMIT 5
-    """
-    
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    profile = get_hourly_order_profile(start_date, end_date)
     
     error_hours_data = []
-    if result:
-        for row in result:
-            hour = int(float(row[0])) if row[0] else 0
-            error_count = int(float(row[1])) if row[1] else 0
-            
-            # Получаем общее количество заказов за этот час
-            total_query = """
-            SELECT COUNT(DISTINCT SHIPMENT_ID)
-            FROM dwh.orders_enriched 
-            WHERE date BETWEEN %(start_date)s AND %(end_date)s
-                AND ORDER_TYPE = 'Клиент'
-                AND START_DATE_TIME IS NOT NULL
-                AND EXTRACT(HOUR FROM START_DATE_TIME) = %(hour)s
-            """
-            
-            total_result = execute_query_cached(total_query, {
-                'start_date': start_date,
-                'end_date': end_date,
-                'hour': hour
-            })
-            
-            total_orders = int(float(total_result[0][0])) if total_result and total_result[0][0] else 0
-            error_percentage = 0
-            if total_orders > 0:
-                error_percentage = round((error_count / total_orders) * 100, 1)
-            
-            error_hours_data.append({
-                'hour': hour,
-                'error_orders_count': error_count,
-                'total_orders_in_hour': total_orders,
-                'error_percentage': error_percentage
-            })
+    for hour in rank_hours(profile, 'claim_orders', min_counts={'claim_orders': 2}):
+        error_count = hour['claim_orders']
+        total_orders = hour['total_orders']
+        error_percentage = 0
+        if total_orders > 0:
+            error_percentage = round((error_count / total_orders) * 100, 1)
+        
+        error_hours_data.append({
+            'hour': hour['hour'],
+            'error_orders_count': error_count,
+            'total_orders_in_hour': total_orders,
+            'error_percentage': error_percentage
+        })
     
     return error_hours_data
 
 # Получение данных для детальной аналитики сотрудника
-def get_employee_analytics(employee_name, start_date, end_date):
-    try:
-        # Основные метрики производительности
-        query_regular = """
+def employee_analytics_request(employee_name, start_date, end_date):
+    """Запрос строки аналитики сотрудника и его параметры"""
+    query = """
+    SELECT *
+    FROM (
         SELECT 
-            COUNT(*) as total_regular_operations,
-            SUM(duration_sec) / 60.0 as total_work_minutes,
-            MIN(START_DATE_TIME) as first_op_time,
-            MAX(END_DATE_TIME) as last_op_time,
-            COALESCE(SUM(price_per_op), 0) as regular_earnings
-        FROM dwh.operations_enriched 
-        WHERE fio = %(employee_name)s
-            AND date BETWEEN %(start_date)s AND %(end_date)s
-        """
-        
-        regular_result = execute_query_cached(query_regular, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        
-        # Получаем операции приемки
-        reception_query = """
+            SUM(type_count) as total_regular_operations,
+            SUM(type_duration_sec) / 60.0 as total_work_minutes,
+            MIN(type_first_op_time) as first_op_time,
+            MAX(type_last_op_time) as last_op_time,
+            SUM(type_earnings) as regular_earnings,
+            groupArray((operation_type, type_count, type_duration_sec)) as operations_by_type
+        FROM (
+            SELECT 
+                WORK_TYPE as operation_type,
+                COUNT(*) as type_count,
+                SUM(duration_sec) as type_duration_sec,
+                MIN(START_DATE_TIME) as type_first_op_time,
+                MAX(END_DATE_TIME) as type_last_op_time,
+                COALESCE(SUM(price_per_op), 0) as type_earnings
+            FROM dwh.operations_enriched 
+            WHERE fio = {employee_name:String}
+                AND date BETWEEN {start_date:Date} AND {end_date:Date}
+            GROUP BY WORK_TYPE
+        )
+    ) operations
+    CROSS JOIN (
         SELECT 
             COUNT(*) as reception_count,
             MIN(event_time) as first_reception_time,
             MAX(event_time) as last_reception_time
         FROM dm.fact_transaction_events 
-        WHERE fio = %(employee_name)s
-            AND DATE(event_time) BETWEEN %(start_date)s AND %(end_date)s
+        WHERE fio = {employee_name:String}
+            AND DATE(event_time) BETWEEN {start_date:Date} AND {end_date:Date}
             AND event_time IS NOT NULL
             AND smena IN ('1', '2')
-        """
-        
-        reception_result = execute_query_cached(reception_query, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
+    ) reception
+    CROSS JOIN (
+        SELECT 
+            SUM(total_work_duration_sec) / 60.0 as activity_work_minutes,
+            SUM(total_idle_duration_sec) / 60.0 as total_idle_minutes,
+            SUM(idle_count_5_10) as idle_5_10_count,
+            SUM(idle_count_10_30) as idle_10_30_count,
+            SUM(idle_count_30_60) as idle_30_60_count,
+            SUM(idle_count_60plus) as idle_60plus_count
+        FROM dm.fact_employee_activity 
+        WHERE fio = {employee_name:String}
+            AND date_key BETWEEN {start_date:Date} AND {end_date:Date}
+    ) idle
+    CROSS JOIN (
+        SELECT 
+            COUNT(DISTINCT SHIPMENT_ID) as orders_completed,
+            COUNT(DISTINCT CASE WHEN ORDER_TYPE = 'Клиент' THEN SHIPMENT_ID END) as client_orders,
+            SUM(CASE WHEN ORDER_TYPE = 'Клиент' AND timeliness_status IN ('вовремя', 'Вовремя') THEN 1 ELSE 0 END) as timely_orders
+        FROM dwh.orders_enriched 
+        WHERE fio = {employee_name:String}
+            AND date BETWEEN {start_date:Date} AND {end_date:Date}
+    ) orders
+    CROSS JOIN (
+        SELECT 
+            COUNT(*) as fines_count,
+            COALESCE(SUM(fine_amount), 0) as fines_amount
+        FROM dm.fact_fines 
+        WHERE fio = {employee_name:String}
+            AND date_key BETWEEN {start_date:Date} AND {end_date:Date}
+    ) fines
+    """
+    return query, {'employee_name': employee_name, 'start_date': start_date, 'end_date': end_date}
+
+def employee_analytics_row_from_result(result):
+    """Строка аналитики словарем или None"""
+    return dict(zip(result.names, result[0])) if result else None
+
+def get_employee_analytics_row(employee_name, start_date, end_date):
+    """
+    Все данные модального окна аналитики сотрудника за одно обращение.
+
+    Каждая таблица читается один раз, однострочные подзапросы
+    объединяются CROSS JOIN. Разбивка по типам операций приходит массивом
+    кортежей (тип, количество, секунды) из того же прохода по
+    dwh.operations_enriched. Результат кэшируется, поэтому
+    get_employee_analytics и get_employee_operations_detail делят один запрос.
+    """
+    query, params = employee_analytics_request(employee_name, start_date, end_date)
+    return employee_analytics_row_from_result(execute_query_cached(query, params))
+
+def _idle_data_from_row(row):
+    """Словарь простоев из строки с суммами fact_employee_activity"""
+    return {
+        'total_work_minutes': float(row['activity_work_minutes']) if row['activity_work_minutes'] else 0.0,
+        'total_idle_minutes': float(row['total_idle_minutes']) if row['total_idle_minutes'] else 0.0,
+        'idle_counts': {
+            '5-10 мин': int(row['idle_5_10_count'] or 0),
+            '10-30 мин': int(row['idle_10_30_count'] or 0),
+            '30-60 мин': int(row['idle_30_60_count'] or 0),
+            '>1 часа': int(row['idle_60plus_count'] or 0)
+        }
+    }
+
+def _operations_by_type(row):
+    """Типы операций (тип, количество, секунды) по убыванию количества"""
+    return sorted(row['operations_by_type'] or [], key=lambda item: item[1], reverse=True)
+
+def get_employee_analytics(employee_name, start_date, end_date):
+    try:
+        row = get_employee_analytics_row(employee_name, start_date, end_date)
+        if row is None:
+            return None
         
         # Расчет заработка от приемки
-        reception_earnings = 0.0
-        reception_count = 0
-        first_reception_time = ''
-        last_reception_time = ''
+        reception_count = int(row['reception_count'] or 0)
+        first_reception_time = row['first_reception_time'] if row['first_reception_time'] else ''
+        last_reception_time = row['last_reception_time'] if row['last_reception_time'] else ''
+        reception_earnings = reception_count * 18.70
         
-        if reception_result and reception_result[0]:
-            reception_count = int(float(reception_result[0][0])) if reception_result[0][0] else 0
-            first_reception_time = reception_result[0][1] if reception_result[0][1] else ''
-            last_reception_time = reception_result[0][2] if reception_result[0][2] else ''
-            reception_earnings = reception_count * 18.70
+        total_regular_ops = int(row['total_regular_operations'] or 0)
+        total_work_minutes = float(row['total_work_minutes']) if row['total_work_minutes'] else 0.0
+        first_regular_time = str(row['first_op_time']) if row['first_op_time'] else ''
+        last_regular_time = str(row['last_op_time']) if row['last_op_time'] else ''
+        regular_earnings = float(row['regular_earnings']) if row['regular_earnings'] else 0.0
         
-        if not regular_result or not regular_result[0]:
-            # Если нет обычных операций, но есть приемка
-            if reception_count > 0:
-                total_ops = reception_count
-                total_earnings = reception_earnings
-                work_start_time = first_reception_time
-                work_end_time = last_reception_time
-                regular_earnings = 0.0
-                total_work_minutes = 0.0
-            else:
-                return None
-        else:
-            row = regular_result[0]
-            total_regular_ops = int(float(row[0])) if row[0] else 0
-            total_work_minutes = float(row[1]) if row[1] else 0.0
-            first_regular_time = str(row[2]) if row[2] else ''
-            last_regular_time = str(row[3]) if row[3] else ''
-            regular_earnings = float(row[4]) if row[4] else 0.0
-            
-            total_ops = total_regular_ops + reception_count
-            total_earnings = regular_earnings + reception_earnings
-            
-            # Определяем общее время работы
-            work_start_time = first_regular_time
-            work_end_time = last_regular_time
-            
-            if first_reception_time:
-                if not work_start_time or first_reception_time < work_start_time:
-                    work_start_time = first_reception_time
-            if last_reception_time:
-                if not work_end_time or last_reception_time > work_end_time:
-                    work_end_time = last_reception_time
+        total_ops = total_regular_ops + reception_count
+        total_earnings = regular_earnings + reception_earnings
         
-        # Получаем данные о простоях
-        idle_data = get_employee_idle_data(employee_name, start_date, end_date)
+        # Определяем общее время работы
+        work_start_time = first_regular_time
+        work_end_time = last_regular_time
         
-        # Статистика по типам операций (обновленная - добавляем приемку)
-        ops_query = """
-        SELECT 
-            WORK_TYPE as operation_type,
-            COUNT(*) as operation_count,
-            CASE 
-                WHEN COUNT(*) > 0 THEN AVG(duration_sec) / 60.0
-                ELSE 0 
-            END as avg_time_minutes,
-            SUM(duration_sec) / 60.0 as total_time_minutes
-        FROM dwh.operations_enriched 
-        WHERE fio = %(employee_name)s
-            AND date BETWEEN %(start_date)s AND %(end_date)s
-        GROUP BY WORK_TYPE
-        ORDER BY operation_count DESC
-        LIMIT 10
-        """
+        if first_reception_time:
+            if not work_start_time or first_reception_time < work_start_time:
+                work_start_time = first_reception_time
+        if last_reception_time:
+            if not work_end_time or last_reception_time > work_end_time:
+                work_end_time = last_reception_time
         
-        ops_result = execute_query_cached(ops_query, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
+        # Данные о простоях
+        idle_data = _idle_data_from_row(row)
         
+        # Статистика по типам операций (топ-10) плюс приемка
         operations_stats = []
-        if ops_result:
-            for op_row in ops_result:
-                operations_stats.append({
-                    'type': op_row[0],
-                    'count': int(float(op_row[1])) if op_row[1] else 0,
-                    'avg_time': round(float(op_row[2]), 1) if op_row[2] else 0.0,
-                    'total_time': round(float(op_row[3]), 1) if op_row[3] else 0.0
-                })
+        for operation_type, count, duration_sec in _operations_by_type(row)[:10]:
+            duration_sec = float(duration_sec) if duration_sec else 0.0
+            operations_stats.append({
+                'type': operation_type,
+                'count': int(count),
+                'avg_time': round(duration_sec / count / 60.0, 1) if count else 0.0,
+                'total_time': round(duration_sec / 60.0, 1)
+            })
         
         # Добавляем операцию "приемка" в статистику
         if reception_count > 0:
@@ -979,68 +868,17 @@ def get_employee_analytics(employee_name, start_date, end_date):
             })
         
         # Завершенные заказы
-        orders_completed_query = """
-        SELECT COUNT(DISTINCT SHIPMENT_ID) 
-        FROM dwh.orders_enriched 
-        WHERE fio = %(employee_name)s
-            AND date BETWEEN %(start_date)s AND %(end_date)s
-        """
-        
-        orders_completed_result = execute_query_cached(orders_completed_query, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        
-        orders_completed = 0
-        if orders_completed_result and orders_completed_result[0]:
-            orders_completed = int(float(orders_completed_result[0][0])) if orders_completed_result[0][0] else 0
+        orders_completed = int(row['orders_completed'] or 0)
         
         # Своевременность
-        timeliness_query = """
-        SELECT 
-            COUNT(DISTINCT SHIPMENT_ID) as total_orders,
-            SUM(CASE WHEN timeliness_status IN ('вовремя', 'Вовремя') THEN 1 ELSE 0 END) as timely_orders
-        FROM dwh.orders_enriched 
-        WHERE fio = %(employee_name)s
-            AND date BETWEEN %(start_date)s AND %(end_date)s
-            AND ORDER_TYPE = 'Клиент'
-        """
-        
-        timeliness_result = execute_query_cached(timeliness_query, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        
         timely_percentage = 100.0
-        if timeliness_result and timeliness_result[0]:
-            total_orders = int(float(timeliness_result[0][0])) if timeliness_result[0][0] else 0
-            timely_orders = int(float(timeliness_result[0][1])) if timeliness_result[0][1] else 0
-            if total_orders > 0:
-                timely_percentage = round(timely_orders * 100.0 / total_orders, 1)
+        client_orders = int(row['client_orders'] or 0)
+        if client_orders > 0:
+            timely_percentage = round(int(row['timely_orders'] or 0) * 100.0 / client_orders, 1)
         
         # Штрафы
-        fines_query = """
-        SELECT 
-            COUNT(*) as fines_count,
-            COALESCE(SUM(fine_amount), 0) as fines_amount
-        FROM dm.fact_fines 
-        WHERE fio = %(employee_name)s
-            AND date_key BETWEEN %(start_date)s AND %(end_date)s
-        """
-        
-        fines_result = execute_query_cached(fines_query, {
-            'employee_name': employee_name,
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        
-        fines_count = 0
-        fines_amount = 0.0
-        if fines_result and fines_result[0]:
-            fines_count = int(float(fines_result[0][0])) if fines_result[0][0] else 0
-            fines_amount = float(fines_result[0][1]) if fines_result[0][1] else 0.0
+        fines_count = int(row['fines_count'] or 0)
+        fines_amount = float(row['fines_amount']) if row['fines_amount'] else 0.0
         
         # Расчет времени работы
         work_duration = '0ч 0м'
@@ -1082,29 +920,14 @@ def get_employee_analytics(employee_name, start_date, end_date):
         print(f"Error in get_employee_analytics: {e}")
         return None
 
-# Получение деталей операций по сотруднику
+# Получение деталей операций по сотруднику (из того же запроса, что и аналитика)
 def get_employee_operations_detail(employee_name, start_date, end_date):
-    query = """
-    SELECT 
-        WORK_TYPE as operation_type,
-        COUNT(*) as operation_count
-    FROM dwh.operations_enriched 
-    WHERE fio = %(employee_name)s
-        AND date BETWEEN %(start_date)s AND %(end_date)s
-    GROUP BY WORK_TYPE
-    ORDER BY operation_count DESC
-    """
-    
-    result = execute_query_cached(query, {
-        'employee_name': employee_name,
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    row = get_employee_analytics_row(employee_name, start_date, end_date)
     
     operations_detail = {}
-    if result:
-        for row in result:
-            operations_detail[row[0]] = int(float(row[1])) if row[1] else 0
+    if row:
+        for operation_type, count, _ in _operations_by_type(row):
+            operations_detail[operation_type] = int(count)
     
     return operations_detail
 
@@ -1115,7 +938,7 @@ def get_arrival_timeliness(start_date, end_date):
         status,
         COUNT(DISTINCT receipt_id) as count
     FROM dm.fact_receipts_status 
-    WHERE date_key BETWEEN %(start_date)s AND %(end_date)s
+    WHERE date_key BETWEEN {start_date:Date} AND {end_date:Date}
     GROUP BY status
     """
     
@@ -1141,33 +964,16 @@ def get_arrival_timeliness(start_date, end_date):
 
 # Получение данных для своевременности заказов (для карточек)
 def get_order_timeliness(start_date, end_date):
-    query = """
-    SELECT 
-        timeliness_status,
-        COUNT(DISTINCT SHIPMENT_ID) as count
-    FROM dwh.orders_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
-        AND ORDER_TYPE = 'Клиент'
-    GROUP BY timeliness_status
-    """
-    
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
     timely_orders = 0
     delayed_orders = 0
     
-    if result:
-        for row in result:
-            status_str = str(row[0]).lower() if row[0] else ''
-            count_val = int(float(row[1])) if row[1] else 0
-            
-            if 'вовремя' in status_str:
-                timely_orders = count_val
-            elif 'просрочено' in status_str:
-                delayed_orders = count_val
+    for status, count_val in get_timeliness_aggregate(start_date, end_date)['by_status'].items():
+        status_str = str(status).lower() if status else ''
+        
+        if 'вовремя' in status_str:
+            timely_orders = count_val
+        elif 'просрочено' in status_str:
+            delayed_orders = count_val
     
     return timely_orders, delayed_orders
 
@@ -1201,7 +1007,7 @@ def get_order_accuracy_chart_data(start_date, end_date):
             {date_expr},
             SHIPMENT_ID
         FROM dwh.orders_enriched 
-        WHERE date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE date BETWEEN {{start_date:Date}} AND {{end_date:Date}}
             AND ORDER_TYPE = 'Клиент'
     ),
     error_orders AS (
@@ -1210,10 +1016,10 @@ def get_order_accuracy_chart_data(start_date, end_date):
             o.SHIPMENT_ID
         FROM dwh.orders_enriched o
         INNER JOIN olap.raw_shtraf_edit s ON o.SHIPMENT_ID = s.reference_id
-        WHERE o.date BETWEEN %(start_date)s AND %(end_date)s
+        WHERE o.date BETWEEN {{start_date:Date}} AND {{end_date:Date}}
             AND o.ORDER_TYPE = 'Клиент'
             AND s.name = 'Штраф по претензии'
-            AND DATE(s.date_time_stamp) BETWEEN %(start_date)s AND %(end_date)s
+            AND DATE(s.date_time_stamp) BETWEEN {{start_date:Date}} AND {{end_date:Date}}
     )
     SELECT 
         a.period,
@@ -1255,204 +1061,233 @@ def get_order_accuracy_chart_data(start_date, end_date):
     
     return chart_data
 
-# Получение данных для диаграмм своевременности (ИСПРАВЛЕННЫЙ ЗАПРОС)
-def get_timeliness_chart_data(start_date, end_date, timeliness_type='timely'):
-    """Получение данных для диаграмм своевременности с правильной группировкой"""
-    
-    # Рассчитываем количество дней в периоде
+# Наборы группировки агрегата своевременности по значению
+# grouping(status_group, ROUTING_CODE, period, timeliness_status)
+TIMELINESS_BY_ROUTING, TIMELINESS_BY_GROUP, TIMELINESS_BY_STATUS, TIMELINESS_TOTAL = 1, 7, 14, 15
+
+
+def _period_expression(start_date, end_date):
+    """Группировка периода: дни до 7 дней, недели до 30, иначе месяцы"""
     start_dt = datetime.strptime(start_date, '%Y-%m-%d')
     end_dt = datetime.strptime(end_date, '%Y-%m-%d')
     delta_days = (end_dt - start_dt).days + 1
     
-    # Определяем группировку в зависимости от периода
     if delta_days <= 7:
-        # До 7 дней - группировка по дням
-        date_expr = "toDate(date) as period"
-        order_expr = "period"
+        return "toDate(date)"
     elif delta_days <= 30:
-        # До 30 дней - группировка по неделям
-        date_expr = "toStartOfWeek(date) as period"
-        order_expr = "period"
-    else:
-        # Более 30 дней - группировка по месяцам
-        date_expr = "toStartOfMonth(date) as period"
-        order_expr = "period"
-    
-    # Определяем условие фильтрации по статусу
-    status_condition = ""
-    if timeliness_type == 'timely':
-        status_condition = "timeliness_status IN ('вовремя', 'Вовремя')"
-    else:  # 'delayed'
-        status_condition = "timeliness_status IN ('просрочено', 'Просрочено')"
-    
+        return "toStartOfWeek(date)"
+    return "toStartOfMonth(date)"
+
+def timeliness_aggregate_request(start_date, end_date):
+    """Запрос агрегата своевременности и его параметры"""
     query = f"""
     SELECT 
-        {date_expr},
+        CASE 
+            WHEN timeliness_status IN ('вовремя', 'Вовремя') THEN 'timely'
+            WHEN timeliness_status IN ('просрочено', 'Просрочено') THEN 'delayed'
+            ELSE 'other'
+        END as status_group,
         ROUTING_CODE,
+        {_period_expression(start_date, end_date)} as period,
+        timeliness_status,
+        grouping(status_group, ROUTING_CODE, period, timeliness_status) as grouping_id,
         COUNT(DISTINCT SHIPMENT_ID) as order_count
     FROM dwh.orders_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
+    WHERE date BETWEEN {{start_date:Date}} AND {{end_date:Date}}
         AND ORDER_TYPE = 'Клиент'
-        AND {status_condition}
-        AND ROUTING_CODE IS NOT NULL
-    GROUP BY period, ROUTING_CODE
-    ORDER BY {order_expr}
+    GROUP BY GROUPING SETS (
+        (status_group, ROUTING_CODE, period),
+        (timeliness_status),
+        (status_group),
+        ()
+    )
+    ORDER BY period
+    SETTINGS force_grouping_standard_compatibility = 1
+    """
+    return query, {'start_date': start_date, 'end_date': end_date}
+
+def timeliness_aggregate_from_result(result):
+    """Графики, статусы и итоги своевременности из результата агрегата"""
+    aggregate = {
+        'charts': {'timely': [], 'delayed': []},
+        'by_status': {},
+        'timely': 0,
+        'delayed': 0,
+        'total': 0
+    }
+    for status_group, routing_code, period, status, grouping_id, order_count in result:
+        order_count = int(order_count or 0)
+        if grouping_id == TIMELINESS_BY_ROUTING:
+            if status_group in aggregate['charts'] and routing_code is not None:
+                aggregate['charts'][status_group].append((str(period)[:10], routing_code, order_count))
+        elif grouping_id == TIMELINESS_BY_STATUS:
+            aggregate['by_status'][status] = order_count
+        elif grouping_id == TIMELINESS_BY_GROUP:
+            if status_group in ('timely', 'delayed'):
+                aggregate[status_group] = order_count
+        elif grouping_id == TIMELINESS_TOTAL:
+            aggregate['total'] = order_count
+    
+    return aggregate
+
+def get_timeliness_aggregate(start_date, end_date):
+    """
+    Агрегат своевременности клиентских заказов за период одним проходом.
+
+    GROUPING SETS дают уникальные заказы по (статус, маршрут, период)
+    для обоих графиков, по исходному timeliness_status и по группам
+    'timely'/'delayed' для KPI, а также общее число заказов.
+    Из него строятся get_timeliness_chart_data, get_order_timeliness
+    и get_orders_timely.
     """
+    query, params = timeliness_aggregate_request(start_date, end_date)
+    return timeliness_aggregate_from_result(execute_query_cached(query, params))
+
+# Получение данных для диаграмм своевременности (из общего агрегата своевременности)
+def get_timeliness_chart_data(start_date, end_date, timeliness_type='timely'):
+    """Получение данных для диаграмм своевременности с правильной группировкой"""
     
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    rows = get_timeliness_aggregate(start_date, end_date)['charts'][
+        'timely' if timeliness_type == 'timely' else 'delayed'
+    ]
     
     # Подготавливаем структуру данных
-    periods_set = set()
     data_dict = {}
     
-    if result:
-        for row in result:
-            try:
-                period_str = str(row[0])[:10] if row[0] else ''
-                routing_code = row[1] if row[1] else ''
-                order_count = int(float(row[2])) if row[2] else 0
-                
-                periods_set.add(period_str)
-                
-                if period_str not in data_dict:
-                    data_dict[period_str] = {
-                        'Доставка_клиенту_с_РЦ': 0,
-                        'РЦ': 0
-                    }
-                
-                # Приводим routing_code к стандартному виду для группировки
-                routing_lower = routing_code.lower() if routing_code else ''
-                
-                if 'доставка клиенту' in routing_lower and 'рц' in routing_lower:
-                    data_dict[period_str]['Доставка_клиенту_с_РЦ'] += order_count
-                elif routing_lower == 'рц':
-                    data_dict[period_str]['РЦ'] += order_count
-                else:
-                    # Если другой тип, добавляем в "РЦ" или создаем отдельную категорию
-                    data_dict[period_str]['РЦ'] += order_count
-                    
-            except Exception as e:
-                print(f"Error processing timeliness data: {e}")
-                continue
-    
-    # Преобразуем в список с отсортированными периодами
-    chart_data = []
-    sorted_periods = sorted(list(periods_set))
-    
-    for period in sorted_periods:
-        if period in data_dict:
-            chart_data.append({
-                'period': period,
-                'Доставка_клиенту_с_РЦ': data_dict[period]['Доставка_клиенту_с_РЦ'],
-                'РЦ': data_dict[period]['РЦ']
-            })
-        else:
-            chart_data.append({
-                'period': period,
+    for period_str, routing_code, order_count in rows:
+        if period_str not in data_dict:
+            data_dict[period_str] = {
                 'Доставка_клиенту_с_РЦ': 0,
                 'РЦ': 0
-            })
+            }
+        
+        # Приводим routing_code к стандартному виду для группировки
+        routing_lower = routing_code.lower() if routing_code else ''
+        
+        if 'доставка клиенту' in routing_lower and 'рц' in routing_lower:
+            data_dict[period_str]['Доставка_клиенту_с_РЦ'] += order_count
+        else:
+            # РЦ и прочие типы маршрутов
+            data_dict[period_str]['РЦ'] += order_count
     
-    return chart_data
+    # Преобразуем в список с отсортированными периодами
+    return [
+        {
+            'period': period,
+            'Доставка_клиенту_с_РЦ': data_dict[period]['Доставка_клиенту_с_РЦ'],
+            'РЦ': data_dict[period]['РЦ']
+        }
+        for period in sorted(data_dict)
+    ]
 
-# Получение данных по штрафам
-def get_fines_data(start_date, end_date):
-    summary_query = """
+# Наборы группировки куба штрафов по значению grouping(fio, fine_category, date_key, fine_amount)
+FINES_DETAIL, FINES_BY_EMPLOYEE, FINES_BY_CATEGORY, FINES_TOTAL = 0, 7, 11, 15
+
+
+def fines_cube_request(start_date, end_date):
+    """Запрос куба штрафов и его параметры"""
+    # Штрафы по (день, сотрудник, категория, сумма) из витрины rollup.fines_daily
+    source, source_params = rollup_source('fines_daily')
+    query = f"""
     SELECT 
-        fio,
-        COUNT(*) as fines_count,
-        COALESCE(SUM(fine_amount), 0) as total_amount,
-        CASE 
-            WHEN COUNT(*) > 0 THEN COALESCE(SUM(fine_amount), 0) / COUNT(*)
-            ELSE 0 
-        END as avg_amount
-    FROM dm.fact_fines 
-    WHERE date_key BETWEEN %(start_date)s AND %(end_date)s
-        AND fio IS NOT NULL
-    GROUP BY fio
-    ORDER BY fines_count DESC
+        employee as fio,
+        category as fine_category,
+        day as date_key,
+        amount as fine_amount,
+        grouping(fio, fine_category, date_key, fine_amount) as grouping_id,
+        SUM(fine_count) as fines_count,
+        SUM(amount_total) as total_amount
+    FROM ({source})
+    WHERE day BETWEEN {{start_date:Date}} AND {{end_date:Date}}
+    GROUP BY GROUPING SETS (
+        (fio, fine_category, date_key, fine_amount),
+        (fio),
+        (fine_category),
+        ()
+    )
+    SETTINGS force_grouping_standard_compatibility = 1
     """
-    
-    summary_result = execute_query_cached(summary_query, {
+    return query, {
         'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    summary_data = []
-    if summary_result:
-        for row in summary_result:
-            summary_data.append({
-                'Сотрудник': row[0],
-                'Количество_штрафов': int(float(row[1])) if row[1] else 0,
-                'Сумма_штрафов': float(row[2]) if row[2] else 0.0,
-                'Средний_штраф': float(row[3]) if row[3] else 0.0,
-                'Штрафы': []
-            })
-    
-    category_query = """
-    SELECT 
-        fine_category,
-        COUNT(*) as category_count,
-        COALESCE(SUM(fine_amount), 0) as category_total,
-        CASE 
-            WHEN COUNT(*) > 0 THEN COALESCE(SUM(fine_amount), 0) / COUNT(*)
-            ELSE 0 
-        END as category_avg
-    FROM dm.fact_fines 
-    WHERE date_key BETWEEN %(start_date)s AND %(end_date)s
-        AND fine_category IS NOT NULL
-    GROUP BY fine_category
+        'end_date': end_date,
+        **source_params
+    }
+
+def fines_cube_from_result(result):
+    """Итоги и детализация штрафов из результата куба"""
+    cube = {
+        'by_employee': {},
+        'by_category': {},
+        'total': {'count': 0, 'total_amount': 0.0},
+        'details': {}
+    }
+    for fio, category, date_key, amount, grouping_id, count, total in result:
+        totals = {'count': int(count), 'total_amount': float(total) if total else 0.0}
+        if grouping_id == FINES_DETAIL:
+            if fio is not None:
+                fine = {'category': category, 'amount': float(amount) if amount else 0.0, 'date': date_key}
+                cube['details'].setdefault(fio, []).extend(dict(fine) for _ in range(int(count)))
+        elif grouping_id == FINES_BY_EMPLOYEE:
+            if fio is not None:
+                cube['by_employee'][fio] = totals
+        elif grouping_id == FINES_BY_CATEGORY:
+            if category is not None:
+                cube['by_category'][category] = totals
+        elif grouping_id == FINES_TOTAL:
+            cube['total'] = totals
+    
+    for fines in cube['details'].values():
+        fines.sort(key=lambda fine: fine['date'], reverse=True)
+    
+    return cube
+
+def get_fines_cube(start_date, end_date):
+    """
+    Куб штрафов за период одним проходом по витрине rollup.fines_daily
+    (дни, для которых она не готова, - по dm.fact_fines).
+
+    GROUPING SETS сразу дают итоги по сотрудникам, по категориям, общий
+    итог и детализацию (сотрудник, категория, дата, сумма) для модального
+    окна. Из этого результата обслуживаются get_fines_data,
+    get_employee_fines_details и штрафы в get_shift_comparison.
     """
+    query, params = fines_cube_request(start_date, end_date)
+    return fines_cube_from_result(execute_query_cached(query, params))
+
+# Получение данных по штрафам
+def get_fines_data(start_date, end_date):
+    cube = get_fines_cube(start_date, end_date)
     
-    category_result = execute_query_cached(category_query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    summary_data = []
+    for fio, totals in cube['by_employee'].items():
+        summary_data.append({
+            'Сотрудник': fio,
+            'Количество_штрафов': totals['count'],
+            'Сумма_штрафов': totals['total_amount'],
+            'Средний_штраф': totals['total_amount'] / totals['count'] if totals['count'] else 0.0,
+            'Штрафы': []
+        })
+    summary_data.sort(key=lambda x: x['Количество_штрафов'], reverse=True)
     
     category_data = {}
-    if category_result:
-        for row in category_result:
-            category_data[row[0]] = {
-                'count': int(float(row[1])) if row[1] else 0,
-                'total_amount': float(row[2]) if row[2] else 0.0,
-                'average_amount': float(row[3]) if row[3] else 0.0
-            }
-    
-    kpi_query = """
-    SELECT 
-        COUNT(*) as total_fines,
-        COALESCE(SUM(fine_amount), 0) as total_amount,
-        CASE 
-            WHEN COUNT(*) > 0 THEN COALESCE(SUM(fine_amount), 0) / COUNT(*)
-            ELSE 0 
-        END as avg_fine_amount
-    FROM dm.fact_fines 
-    WHERE date_key BETWEEN %(start_date)s AND %(end_date)s
-    """
-    
-    kpi_result = execute_query_cached(kpi_query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    for category, totals in cube['by_category'].items():
+        category_data[category] = {
+            'count': totals['count'],
+            'total_amount': totals['total_amount'],
+            'average_amount': totals['total_amount'] / totals['count'] if totals['count'] else 0.0
+        }
     
+    total = cube['total']
     kpi_data = {
-        'total_fines': 0,
-        'total_amount': 0.0,
-        'avg_fine_amount': 0.0,
+        'total_fines': total['count'],
+        'total_amount': total['total_amount'],
+        'avg_fine_amount': total['total_amount'] / total['count'] if total['count'] else 0.0,
         'max_fines_employee': 'Нет данных',
         'max_fines_count': 0,
         'max_amount_employee': 'Нет данных',
         'max_amount': 0.0
     }
     
-    if kpi_result and kpi_result[0]:
-        kpi_data['total_fines'] = int(float(kpi_result[0][0])) if kpi_result[0][0] else 0
-        kpi_data['total_amount'] = float(kpi_result[0][1]) if kpi_result[0][1] else 0.0
-        kpi_data['avg_fine_amount'] = float(kpi_result[0][2]) if kpi_result[0][2] else 0.0
-    
     if summary_data:
         max_fines = max(summary_data, key=lambda x: x['Количество_штрафов'])
         kpi_data['max_fines_employee'] = max_fines['Сотрудник']
@@ -1468,35 +1303,10 @@ def get_fines_data(start_date, end_date):
         'kpi_data': kpi_data
     }
 
-# Получение деталей штрафов для сотрудника
+# Получение деталей штрафов для сотрудника (из куба штрафов, без отдельного запроса)
 def get_employee_fines_details(employee_name, start_date, end_date):
-    query = """
-    SELECT 
-        fine_category,
-        fine_amount,
-        date_key
-    FROM dm.fact_fines 
-    WHERE fio = %(employee_name)s
-        AND date_key BETWEEN %(start_date)s AND %(end_date)s
-    ORDER BY date_key DESC
-    """
-    
-    result = execute_query_cached(query, {
-        'employee_name': employee_name,
-        'start_date': start_date,
-        'end_date': end_date
-    })
-    
-    fines = []
-    if result:
-        for row in result:
-            fines.append({
-                'category': row[0],
-                'amount': float(row[1]) if row[1] else 0.0,
-                'date': row[2]
-            })
-    
-    return fines
+    cube = get_fines_cube(start_date, end_date)
+    return [dict(fine) for fine in cube['details'].get(employee_name, [])]
 
 # Получение данных для таблицы заказов
 def get_orders_table(start_date, end_date):
@@ -1511,7 +1321,7 @@ def get_orders_table(start_date, end_date):
         END as status,
         date as create_date
     FROM dwh.orders_enriched 
-    WHERE date BETWEEN %(start_date)s AND %(end_date)s
+    WHERE date BETWEEN {start_date:Date} AND {end_date:Date}
     ORDER BY date DESC
     LIMIT 50
     """
@@ -1574,7 +1384,7 @@ def get_todays_shift_employees():
     query = """
     SELECT DISTINCT fio, brigada, smena, deleted, position
     FROM olap.raw_user_cadr_edit 
-    WHERE smena = %(today_shift)s
+    WHERE smena = {today_shift:String}
         AND fio IS NOT NULL 
         AND fio != ''
         AND brigada IS NOT NULL
@@ -1657,31 +1467,35 @@ def get_todays_shift_employees():
         print(f"Не найдено сотрудников для смены {today_shift}")
         return [], {}
 
+def _fio_list(names):
+    """Список ФИО для параметра Array(String): без повторов и пустых, по порядку"""
+    return sorted({name for name in names if name})
+
 def get_reception_operations(today, employees_list):
     """Получение операций приемки за сегодняшний день для списка сотрудников"""
     if not employees_list:
         return {}
     
-    # Формируем список для SQL запроса
-    employees_fio_list = [emp['fio'] for emp in employees_list]
-    employees_list_str = "','".join(employees_fio_list)
-    
     # Получаем минимальное время операции для каждого сотрудника
-    query = f"""
+    # (список ФИО передается параметром-массивом, текст запроса постоянный)
+    query = """
     SELECT 
         fio,
         MIN(event_time) as first_reception_time,
         COUNT(*) as reception_count
     FROM dm.fact_transaction_events 
-    WHERE DATE(event_time) = %(today)s
-        AND fio IN ('{employees_list_str}')
+    WHERE DATE(event_time) = {today:Date}
+        AND fio IN {fio_list:Array(String)}
         AND fio IS NOT NULL
         AND event_time IS NOT NULL
         AND smena IN ('1', '2')
     GROUP BY fio
     """
     
-    result = execute_query_cached(query, {'today': today})
+    result = execute_query_cached(query, {
+        'today': today,
+        'fio_list': _fio_list(emp['fio'] for emp in employees_list)
+    })
     
     reception_operations = {}
     if result:
@@ -1701,34 +1515,38 @@ def get_reception_operations(today, employees_list):
 
 def get_reception_operations_period(start_date, end_date, employees_list=None):
     """Получение операций приемки за период для списка сотрудников"""
-    if employees_list and not employees_list:
+    # Пустой список сотрудников - пустой результат, None - все сотрудники
+    if employees_list is not None and not employees_list:
         return {}
     
     base_query = """
     SELECT 
+        DATE(event_time) as day,
         fio,
         COUNT(*) as reception_count,
         MIN(event_time) as first_reception_time,
         MAX(event_time) as last_reception_time
     FROM dm.fact_transaction_events 
-    WHERE DATE(event_time) BETWEEN %(start_date)s AND %(end_date)s
+    WHERE DATE(event_time) BETWEEN {start_date:Date} AND {end_date:Date}
         AND fio IS NOT NULL
         AND event_time IS NOT NULL
         AND smena IN ('1', '2')
     """
     
+    params = {}
     if employees_list:
-        employees_list_str = "','".join(employees_list)
-        query = base_query + f" AND fio IN ('{employees_list_str}')"
+        query = base_query + " AND fio IN {fio_list:Array(String)}"
+        params['fio_list'] = _fio_list(employees_list)
     else:
         query = base_query
     
-    query += " GROUP BY fio"
+    query += " GROUP BY day, fio"
     
-    result = execute_query_cached(query, {
-        'start_date': start_date,
-        'end_date': end_date
-    })
+    result = execute_daily_aggregate(query, start_date, end_date, keys=['fio'], aggregates={
+        'reception_count': 'sum',
+        'first_reception_time': 'min',
+        'last_reception_time': 'max'
+    }, params=params)
     
     reception_operations = {}
     if result:
@@ -1769,23 +1587,25 @@ def get_employees_on_shift():
     print(f"Всего сотрудников в сегодняшней смене: {len(shift_employees)}")
     
     # 1. Получаем обычные операции за сегодня для этих сотрудников
-    employees_fio_list = [emp['fio'] for emp in shift_employees]
-    employees_list_str = "','".join(employees_fio_list)
+    fio_list = _fio_list(emp['fio'] for emp in shift_employees)
     
-    query_today_operations = f"""
+    query_today_operations = """
     SELECT 
         fio,
         MIN(START_DATE_TIME) as first_operation_time,
         COUNT(*) as operations_count
     FROM dwh.operations_enriched 
-    WHERE date = %(today)s
-        AND fio IN ('{employees_list_str}')
+    WHERE date = {today:Date}
+        AND fio IN {fio_list:Array(String)}
         AND fio IS NOT NULL
         AND START_DATE_TIME IS NOT NULL
     GROUP BY fio
     """
     
-    today_operations_result = execute_query_cached(query_today_operations, {'today': today})
+    today_operations_result = execute_query_cached(query_today_operations, {
+        'today': today,
+        'fio_list': fio_list
+    })
     
     # Создаем словарь обычных операций за сегодня
     today_operations = {}
@@ -1805,14 +1625,14 @@ def get_employees_on_shift():
     reception_operations = get_reception_operations(today, shift_employees)
     
     # 3. Получаем информацию о сотрудниках из olap.raw_user_cadr_edit (исключаем уволенных и управление)
-    query_employees_info = f"""
+    query_employees_info = """
     SELECT 
         fio,
         COALESCE(position, 'Не указана') as position,
         COALESCE(brigada, 'Не указана') as brigade,
         COALESCE(smena, 'Не указана') as smena
     FROM olap.raw_user_cadr_edit 
-    WHERE fio IN ('{employees_list_str}')
+    WHERE fio IN {fio_list:Array(String)}
         AND fio IS NOT NULL 
         AND fio != ''
         AND (deleted IS NULL OR deleted = 'False')  -- Исключаем уволенных
@@ -1831,7 +1651,7 @@ def get_employees_on_shift():
     ORDER BY fio
     """
     
-    employees_info_result = execute_query_cached(query_employees_info)
+    employees_info_result = execute_query_cached(query_employees_info, {'fio_list': fio_list})
     
     # Создаем словарь информации о сотрудниках
     employees_info = {}
@@ -2053,22 +1873,47 @@ employees = get_employees()
 operation_types = get_operation_types()
 fine_categories = get_fine_categories()
 
-performance_data_cache = []
-employee_analytics_cache = {}
-employee_operations_detail_cache = {}
-shift_comparison_cache = []
-problematic_hours_cache = []
+# Снимки данных по диапазону дат: одно вычисление на диапазон, которое
+# читают все пользователи с этим диапазоном. Срок короткий, так как
+# исходные запросы кэшируются отдельно и сбрасываются при изменении данных
+range_snapshots = QueryCache(max_bytes=64 * 1024 * 1024, default_ttl=60)
+_snapshot_flight = SingleFlight()
+
+def _compute_range_snapshot(start_date, end_date):
+    # Части снимка независимы и считаются параллельно; рейтинги часов
+    # строятся по одному профилю, второй вызов дождется первого
+    names = ('performance_data', 'shift_comparison', 'problematic_hours', 'error_hours')
+    values = run_batch([
+        lambda: get_performance_data(start_date, end_date),
+        lambda: get_shift_comparison(start_date, end_date),
+        lambda: get_problematic_hours(start_date, end_date),
+        lambda: get_error_hours_top_data(start_date, end_date)
+    ])
+    return dict(zip(names, values))
+
+def get_range_snapshot(start_date, end_date):
+    """Данные основных таблиц и графиков за диапазон (вычисляются один раз)"""
+    key = f"{start_date}:{end_date}"
+    snapshot = range_snapshots.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    def compute():
+        cached = range_snapshots.get(key)
+        if cached is not None:
+            return cached
+        computed = _compute_range_snapshot(start_date, end_date)
+        # Части вытесненного вызова пустые, такой снимок не сохраняем
+        raise_if_cancelled()
+        range_snapshots.set(key, computed)
+        return computed
+
+    return run_shared(_snapshot_flight, key, compute)
 
 def refresh_data(start_date, end_date):
-    """Обновление всех данных"""
-    global performance_data_cache, employee_analytics_cache, employee_operations_detail_cache
-    global shift_comparison_cache, problematic_hours_cache
-    
-    performance_data_cache = get_performance_data(start_date, end_date)
-    shift_comparison_cache = get_shift_comparison(start_date, end_date)
-    problematic_hours_cache = get_problematic_hours(start_date, end_date)
-    employee_analytics_cache = {}
-    employee_operations_detail_cache = {}
+    """Обновление всех данных: пересчет снимка за диапазон"""
+    range_snapshots.delete(f"{start_date}:{end_date}")
+    return get_range_snapshot(start_date, end_date)
 
 def get_all_storage_data():
     """
@@ -2113,78 +1958,39 @@ def get_all_storage_data():
         AND (LOCATION_CLASS = 'Inventory' OR LOCATION_CLASS IS NULL)
     """
     
-    result = execute_query_cached(query)
-    
-    if not result:
-        return {
-            'all_data': [],
-            'filter_options': {
-                'storage_type': [],
-                'locating_zone': [],
-                'allocation_zone': [],
-                'location_type': [],
-                'work_zone': []
-            }
-        }
-    
-    # Обработка данных
+    filter_keys = ['storage_type', 'locating_zone', 'allocation_zone', 'location_type', 'work_zone']
+    text_columns = ['location_id', 'status', 'location_type', 'locating_zone',
+                    'allocation_zone', 'work_zone', 'storage_type']
     all_data = []
-    filter_sets = {
-        'storage_type': set(),
-        'locating_zone': set(),
-        'allocation_zone': set(),
-        'location_type': set(),
-        'work_zone': set()
-    }
+    filter_sets = {key: set() for key in filter_keys}
     
-    for row in result:
-        try:
-            location_id = row[0] if row[0] else ''
-            status = row[1] if row[1] else ''
-            location_type = row[2] if row[2] else ''
-            locating_zone = row[3] if row[3] else ''
-            allocation_zone = row[4] if row[4] else ''
-            work_zone = row[5] if row[5] else ''
-            storage_type = row[6] if row[6] else 'Остальное'
+    # Читаем ответ блоками, не держа весь ответ в памяти
+    try:
+        for block in execute_query_stream(query, profile=QUERY_PROFILES['get_all_storage_data']):
+            # Обработка блока целыми колонками
+            df = block.to_dataframe()
+            for column in text_columns:
+                df[column] = df[column].fillna('').astype(object)
+            df['storage_type'] = df['storage_type'].replace('', 'Остальное')
             
             # Проверяем что статус правильный
-            if status not in ['Empty', 'Storage', 'Picking']:
-                continue
-            
-            data_item = {
-                'location_id': location_id,
-                'status': status,
-                'location_type': location_type,
-                'locating_zone': locating_zone,
-                'allocation_zone': allocation_zone,
-                'work_zone': work_zone,
-                'storage_type': storage_type,
-                'is_empty': 1 if status == 'Empty' else 0,
-                'is_occupied': 1 if status in ['Storage', 'Picking'] else 0
-            }
-            
-            all_data.append(data_item)
+            df = df[df['status'].isin(['Empty', 'Storage', 'Picking'])]
+            df = df.assign(
+                is_empty=(df['status'] == 'Empty').astype(int),
+                is_occupied=df['status'].isin(['Storage', 'Picking']).astype(int)
+            )
             
-            # Добавляем значения в фильтры
-            if storage_type and storage_type != '':
-                filter_sets['storage_type'].add(storage_type)
-            if locating_zone and locating_zone != '':
-                filter_sets['locating_zone'].add(locating_zone)
-            if allocation_zone and allocation_zone != '':
-                filter_sets['allocation_zone'].add(allocation_zone)
-            if location_type and location_type != '':
-                filter_sets['location_type'].add(location_type)
-            if work_zone and work_zone != '':
-                filter_sets['work_zone'].add(work_zone)
-                
-        except Exception as e:
-            print(f"Error processing storage data row: {e}")
-            continue
+            all_data.extend(df[text_columns + ['is_empty', 'is_occupied']].to_dict('records'))
+            for key in filter_keys:
+                filter_sets[key].update(df[key].unique())
+    except Exception as e:
+        print(f"Error loading storage data: {e}")
+        all_data = []
+        filter_sets = {key: set() for key in filter_keys}
     
-    # Преобразуем множества в отсортированные списки
-    filter_options = {}
-    for key, value_set in filter_sets.items():
-        filter_options[key] = sorted(list(value_set))
+    # Значения для фильтров: уникальные непустые, отсортированные
+    filter_options = {key: sorted(value for value in values if value)
+                      for key, values in filter_sets.items()}
     
     return {
         'all_data': all_data,
@@ -2298,93 +2104,9 @@ def get_revision_stats(start_date=None, end_date=None):
     """
     Получение статистики по ревизиям по событию
     В таблице нет поля date, поэтому используем все записи
+    (см. get_general_static_kpi)
     """
-    print(f"[DEBUG] get_revision_stats вызвана")
-    
-    # Тестовый запрос: посмотреть все данные в таблице
-    query_test = """
-    SELECT 
-        WORK_TYPE,
-        INSTRUCTION_TYPE,
-        CONDITION,
-        COUNT(*) as count
-    FROM olap.raw_work_instruction_view2 
-    GROUP BY WORK_TYPE, INSTRUCTION_TYPE, CONDITION
-    ORDER BY count DESC
-    """
-    
-    try:
-        # Сначала выполняем тестовый запрос
-        test_result = execute_query_cached(query_test)
-        
-        print(f"[DEBUG] Всего найдено {len(test_result)} комбинаций данных:")
-        for row in test_result:
-            work_type = row[0] if row[0] else ''
-            instr_type = row[1] if row[1] else ''
-            condition = row[2] if row[2] else ''
-            count = int(float(row[3])) if row[3] else 0
-            
-            print(f"[DEBUG] WORK_TYPE='{work_type}', INSTRUCTION_TYPE='{instr_type}', CONDITION='{condition}': {count} шт.")
-        
-        # Основные запросы (БЕЗ ФИЛЬТРА ПО DATE - его нет в таблице!)
-        
-        # 1. Открытые ревизии (Detail + Open)
-        query_open = """
-        SELECT 
-            COUNT(*) as open_revisions
-        FROM olap.raw_work_instruction_view2 
-        WHERE WORK_TYPE = 'Ревизия по событию'
-            AND INSTRUCTION_TYPE = 'Detail'
-            AND CONDITION = 'Open'
-        """
-        
-        # 2. Ревизии на согласовании (Header + In Process)
-        query_in_process = """
-        SELECT 
-            COUNT(*) as in_process_revisions
-        FROM olap.raw_work_instruction_view2 
-        WHERE WORK_TYPE = 'Ревизия по событию'
-            AND INSTRUCTION_TYPE = 'Header'
-            AND CONDITION = 'In Process'
-        """
-        
-        # Выполняем запросы
-        open_result = execute_query_cached(query_open)
-        in_process_result = execute_query_cached(query_in_process)
-        
-        # Извлекаем значения
-        open_revisions = 0
-        in_process_revisions = 0
-        
-        if open_result and open_result[0] and open_result[0][0]:
-            open_revisions = int(float(open_result[0][0]))
-        
-        if in_process_result and in_process_result[0] and in_process_result[0][0]:
-            in_process_revisions = int(float(in_process_result[0][0]))
-        
-        # Общее количество (сумма открытых и на согласовании)
-        total_revisions = open_revisions + in_process_revisions
-        
-        print(f"[DEBUG] Статистика по ревизиям:")
-        print(f"[DEBUG] - WORK_TYPE='Ревизия по событию', INSTRUCTION_TYPE='Detail', CONDITION='Open': {open_revisions} шт.")
-        print(f"[DEBUG] - WORK_TYPE='Ревизия по событию', INSTRUCTION_TYPE='Header', CONDITION='In Process': {in_process_revisions} шт.")
-        print(f"[DEBUG] - Всего ревизий: {total_revisions}")
-        
-        return {
-            'total_revisions': total_revisions,
-            'open_revisions': open_revisions,
-            'in_process_revisions': in_process_revisions
-        }
-        
-    except Exception as e:
-        print(f"[ERROR] Ошибка в get_revision_stats: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'total_revisions': 0,
-            'open_revisions': 0,
-            'in_process_revisions': 0
-        }
+    return dict(get_general_static_kpi().revisions)
     
 def get_placement_errors():
     """
@@ -2401,15 +2123,41 @@ def get_placement_errors():
        - Если ITEM_CATEGORY9 = "C" И LOCATING_ZONE = "KC_ST_C" → "Верно"
        - В остальных случаях → "Ошибка"
     5. Считаем количество ошибок и верных размещений
+    (см. get_general_static_kpi)
     """
-    query = """
-    WITH placement_data AS (
+    return dict(get_general_static_kpi().placement)
+
+
+# Все карточки общей вкладки: ревизии, ошибки размещения, ячейки и точность заказов
+GeneralKPIBundle = namedtuple('GeneralKPIBundle', ['revisions', 'placement', 'storage', 'accuracy'])
+
+# Карточки общей вкладки, не зависящие от периода
+GeneralStaticKPI = namedtuple('GeneralStaticKPI', ['revisions', 'placement', 'storage'])
+
+# Ревизии, ошибки размещения и ячейки по текущему состоянию таблиц (без дат)
+GENERAL_STATIC_KPI_QUERY = """
+SELECT *
+FROM (
+    SELECT 
+        countIf(INSTRUCTION_TYPE = 'Detail' AND CONDITION = 'Open') as open_revisions,
+        countIf(INSTRUCTION_TYPE = 'Header' AND CONDITION = 'In Process') as in_process_revisions
+    FROM olap.raw_work_instruction_view2 
+    WHERE WORK_TYPE = 'Ревизия по событию'
+) revisions
+CROSS JOIN (
+    SELECT 
+        countIf(placement_ok) as correct_count,
+        countIf(NOT placement_ok) as error_count,
+        greatest(uniqExactIf(COMPLETED_BY_USER, placement_ok),
+                 uniqExactIf(COMPLETED_BY_USER, NOT placement_ok)) as unique_users,
+        greatest(uniqExactIf(ITEM, placement_ok),
+                 uniqExactIf(ITEM, NOT placement_ok)) as unique_items
+    FROM (
         SELECT 
-            w.COMPLETED_BY_USER,
-            w.ITEM,
-            w.LOCATING_ZONE,
-            i.ITEM_CATEGORY9,
-            w.DATE_TIME_STAMP
+            w.COMPLETED_BY_USER as COMPLETED_BY_USER,
+            w.ITEM as ITEM,
+            (i.ITEM_CATEGORY9 IN ('A', 'B') AND w.LOCATING_ZONE IN ('KC_ST_A', 'KC_ST_B'))
+                OR (i.ITEM_CATEGORY9 = 'C' AND w.LOCATING_ZONE = 'KC_ST_C') as placement_ok
         FROM olap.raw_work_instruction_view2 w
         LEFT JOIN olap.raw_item i ON w.ITEM = i.ITEM
         WHERE w.WORK_TYPE = 'Размещение KC'
@@ -2418,89 +2166,128 @@ def get_placement_errors():
             AND w.DATE_TIME_STAMP IS NOT NULL
             AND w.DATE_TIME_STAMP != ''
             AND toYear(parseDateTimeBestEffortOrNull(w.DATE_TIME_STAMP)) = 2025
-    ),
-    categorized_data AS (
-        SELECT 
-            COMPLETED_BY_USER,
-            ITEM,
-            LOCATING_ZONE,
-            ITEM_CATEGORY9,
-            DATE_TIME_STAMP,
-            CASE 
-                WHEN (ITEM_CATEGORY9 IN ('A', 'B') AND LOCATING_ZONE IN ('KC_ST_A', 'KC_ST_B')) 
-                     OR (ITEM_CATEGORY9 = 'C' AND LOCATING_ZONE = 'KC_ST_C')
-                THEN 'Верно'
-                ELSE 'Ошибка'
-            END as placement_status
-        FROM placement_data
-        WHERE ITEM_CATEGORY9 IS NOT NULL
-            AND ITEM_CATEGORY9 != ''
-            AND LOCATING_ZONE IS NOT NULL
-            AND LOCATING_ZONE != ''
+            AND i.ITEM_CATEGORY9 IS NOT NULL
+            AND i.ITEM_CATEGORY9 != ''
+            AND w.LOCATING_ZONE IS NOT NULL
+            AND w.LOCATING_ZONE != ''
     )
+) placement
+CROSS JOIN (
     SELECT 
-        placement_status,
-        COUNT(*) as count,
-        COUNT(DISTINCT COMPLETED_BY_USER) as unique_users,
-        COUNT(DISTINCT ITEM) as unique_items
-    FROM categorized_data
-    GROUP BY placement_status
-    """
+        COUNT(DISTINCT LOCATION) as total_cells,
+        SUM(CASE WHEN LOCATION_STS IN ('Storage', 'Picking') THEN 1 ELSE 0 END) as occupied_cells,
+        SUM(CASE WHEN LOCATION_STS = 'Empty' THEN 1 ELSE 0 END) as free_cells
+    FROM olap.raw_location 
+    WHERE LOCATION IS NOT NULL 
+        AND LOCATION != ''
+        AND LOCATION_STS IS NOT NULL
+        AND LOCATION_STS != 'Frozen'
+        AND LOCATION_TYPE IS NOT NULL
+        AND LOCATION_TYPE NOT IN ('Брак/бой DMG', 'Напольная', 'Улица KC', 'Ячейки KSP')
+        AND (LOCATION_CLASS = 'Inventory' OR LOCATION_CLASS IS NULL)
+) storage
+"""
+
+
+def general_static_kpi_from_result(result):
+    """GeneralStaticKPI из строки результата GENERAL_STATIC_KPI_QUERY"""
+    row = dict(zip(result.names, result[0])) if result else {}
+    value = lambda name: int(row.get(name) or 0)
+    
+    open_revisions = value('open_revisions')
+    in_process_revisions = value('in_process_revisions')
+    revisions = {
+        'total_revisions': open_revisions + in_process_revisions,
+        'open_revisions': open_revisions,
+        'in_process_revisions': in_process_revisions
+    }
     
-    try:
-        result = execute_query_cached(query)
-        
-        print(f"[DEBUG] get_placement_errors результат: {result}")
-        
-        # Извлекаем значения
-        correct_count = 0
-        error_count = 0
-        unique_users = 0
-        unique_items = 0
-        
-        if result:
-            for row in result:
-                status = row[0] if row[0] else ''
-                count = int(float(row[1])) if row[1] else 0
-                users = int(float(row[2])) if row[2] else 0
-                items = int(float(row[3])) if row[3] else 0
-                
-                if status == 'Верно':
-                    correct_count = count
-                elif status == 'Ошибка':
-                    error_count = count
-                
-                # Берем максимум из уникальных пользователей/предметов
-                unique_users = max(unique_users, users)
-                unique_items = max(unique_items, items)
-        
-        total_count = correct_count + error_count
-        
-        # Рассчитываем процент ошибок
-        error_percentage = 0
-        if total_count > 0:
-            error_percentage = round((error_count / total_count) * 100, 1)
-        
-        print(f"[DEBUG] Итог: Верно={correct_count}, Ошибок={error_count}, Всего={total_count}, % ошибок={error_percentage}%")
-        
-        return {
-            'correct_count': correct_count,
-            'error_count': error_count,
-            'total_count': total_count,
-            'error_percentage': error_percentage,
-            'unique_users': unique_users,
-            'unique_items': unique_items
-        }
-        
-    except Exception as e:
-        print(f"[ERROR] Ошибка в get_placement_errors: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'correct_count': 0,
-            'error_count': 0,
-            'total_count': 0,
-            'error_percentage': 0,
-            'unique_users': 0,
-            'unique_items': 0
-        }
\ No newline at end of file
+    correct_count = value('correct_count')
+    error_count = value('error_count')
+    total_count = correct_count + error_count
+    placement = {
+        'correct_count': correct_count,
+        'error_count': error_count,
+        'total_count': total_count,
+        'error_percentage': round((error_count / total_count) * 100, 1) if total_count > 0 else 0,
+        'unique_users': value('unique_users'),
+        'unique_items': value('unique_items')
+    }
+    
+    total_cells = value('total_cells')
+    occupied_cells = value('occupied_cells')
+    free_cells = value('free_cells')
+    storage = {
+        'total_cells': total_cells,
+        'occupied_cells': occupied_cells,
+        'free_cells': free_cells,
+        'occupied_percent': round((occupied_cells / total_cells) * 100, 1) if total_cells > 0 else 0,
+        'free_percent': round((free_cells / total_cells) * 100, 1) if total_cells > 0 else 0
+    }
+    
+    return GeneralStaticKPI(revisions, placement, storage)
+
+def get_general_static_kpi():
+    """
+    Ревизии, ошибки размещения и ячейки хранения одним запросом.
+
+    Карточки считаются по текущему состоянию таблиц и не зависят от
+    периода, поэтому смена дат их не перезапрашивает: запись кэша одна,
+    после soft_ttl она отдается сразу и обновляется в фоне с профилем
+    'heavy'.
+    """
+    result = execute_query_cached(GENERAL_STATIC_KPI_QUERY,
+                                  policy=CACHE_POLICIES['get_general_static_kpi'],
+                                  profile=QUERY_PROFILES['get_general_static_kpi'])
+    return general_static_kpi_from_result(result)
+
+def general_accuracy_request(start_date, end_date):
+    """Запрос точности заказов за период и его параметры"""
+    query = """
+    SELECT 
+        uniqExact(o.SHIPMENT_ID) as total_orders,
+        uniqExactIf(o.SHIPMENT_ID, o.SHIPMENT_ID IN (
+            SELECT reference_id
+            FROM olap.raw_shtraf_edit
+            WHERE name = 'Штраф по претензии'
+                AND DATE(date_time_stamp) BETWEEN {start_date:Date} AND {end_date:Date}
+        )) as error_orders
+    FROM dwh.orders_enriched o
+    WHERE o.date BETWEEN {start_date:Date} AND {end_date:Date}
+        AND o.ORDER_TYPE = 'Клиент'
+    """
+    return query, {'start_date': start_date, 'end_date': end_date}
+
+def general_kpi_bundle_from_results(static_result, accuracy_result):
+    """GeneralKPIBundle из результатов запросов карточек без периода и точности"""
+    static = general_static_kpi_from_result(static_result)
+    row = dict(zip(accuracy_result.names, accuracy_result[0])) if accuracy_result else {}
+    total_orders = int(row.get('total_orders') or 0)
+    error_orders = int(row.get('error_orders') or 0)
+    accuracy_percentage = 100.0
+    if total_orders > 0:
+        accuracy_percentage = (total_orders - error_orders) * 100.0 / total_orders
+    accuracy = {
+        'accuracy': accuracy_percentage,
+        'orders_without_errors': total_orders - error_orders,
+        'total_orders': total_orders,
+        'error_orders': error_orders
+    }
+    return GeneralKPIBundle(static.revisions, static.placement, static.storage, accuracy)
+
+def get_general_kpi_bundle(start_date, end_date):
+    """
+    KPI общей вкладки.
+
+    Ревизии, ошибки размещения и ячейки не зависят от периода и берутся
+    из общей записи кэша (GENERAL_STATIC_KPI_QUERY), от дат зависит только
+    точность заказов. Оба запроса выполняются параллельно.
+    """
+    query, params = general_accuracy_request(start_date, end_date)
+    static_result, accuracy_result = run_batch([
+        lambda: execute_query_cached(GENERAL_STATIC_KPI_QUERY,
+                                     policy=CACHE_POLICIES['get_general_static_kpi'],
+                                     profile=QUERY_PROFILES['get_general_static_kpi']),
+        lambda: execute_query_cached(query, params, policy=CACHE_POLICIES['get_general_kpi_bundle'])
+    ])
+    return general_kpi_bundle_from_results(static_result, accuracy_result)
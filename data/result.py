@@ -0,0 +1,132 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def base_type(type_name):
+    """Тип без оберток Nullable(...) и LowCardinality(...)"""
+    # Обертки снимаются в любом порядке: LowCardinality(Nullable(String))
+    while type_name.startswith(('Nullable(', 'LowCardinality(')):
+        type_name = type_name[type_name.index('(') + 1:-1]
+    return type_name
+
+
+def numpy_dtype(type_name):
+    """Тип NumPy для колонки ClickHouse"""
+    nullable = 'Nullable(' in type_name
+    base = base_type(type_name)
+    if base.startswith(('Int', 'UInt')) and not nullable:
+        return np.uint64 if base == 'UInt64' else np.int64
+    if base.startswith(('Int', 'UInt', 'Float', 'Decimal')):
+        # NULL в числовых колонках становится NaN
+        return np.float64
+    if base == 'Date' or base == 'Date32':
+        return 'datetime64[D]'
+    if base.startswith('DateTime'):
+        return 'datetime64[s]'
+    if base == 'Bool':
+        return np.bool_
+    return object
+
+
+class QueryResult:
+    """
+    Колоночный результат запроса ClickHouse.
+
+    Хранит имена и типы колонок и сами колонки. Для старых мест вызова
+    ведет себя как последовательность строк: поддерживает len(), индексацию,
+    итерацию и проверку на пустоту, строки собираются лениво.
+    Массивы NumPy строятся один раз на колонку и переиспользуются,
+    DataFrame создается поверх них без копирования.
+    """
+
+    def __init__(self, names, types, columns, nbytes=0):
+        self.names = list(names)
+        self.types = list(types)
+        self.columns = columns
+        # Размер исходного ответа в байтах
+        self.nbytes = nbytes
+        self._arrays = {}
+
+    @classmethod
+    def from_rows(cls, names, types, rows, nbytes=0):
+        if rows:
+            columns = [list(column) for column in zip(*rows)]
+        else:
+            columns = [[] for _ in names]
+        return cls(names, types, columns, nbytes)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [])
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(*(column[index] for column in self.columns)))
+        return tuple(column[index] for column in self.columns)
+
+    def __repr__(self):
+        return f"QueryResult(columns={self.names}, rows={len(self)})"
+
+    def __getstate__(self):
+        # Кэш массивов NumPy не сериализуем, он строится заново
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def rows(self):
+        """Ленивый итератор строк-кортежей"""
+        return iter(self)
+
+    def column(self, name):
+        """Значения колонки по имени"""
+        return self.columns[self.names.index(name)]
+
+    def to_numpy(self, name):
+        """
+        Колонка в виде массива NumPy (кэшируется).
+
+        Массив общий для всех читателей закэшированного результата, поэтому
+        только для чтения; для изменения нужна копия (array.copy()).
+        """
+        array = self._arrays.get(name)
+        if array is None:
+            index = self.names.index(name)
+            values = self.columns[index]
+            dtype = numpy_dtype(self.types[index])
+            if dtype is np.float64:
+                values = [np.nan if value is None else value for value in values]
+            array = np.array(values, dtype=dtype)
+            array.flags.writeable = False
+            self._arrays[name] = array
+        return array
+
+    def to_dataframe(self):
+        """
+        Результат в виде pandas DataFrame поверх массивов NumPy.
+
+        Колонки только для чтения (см. to_numpy): колонку можно заменить
+        целиком (df[name] = ...), но не изменить на месте.
+        """
+        return pd.DataFrame({name: self.to_numpy(name) for name in self.names}, copy=False)
+
+    def estimated_size(self):
+        """Оценка занимаемой памяти в байтах по выборке значений"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.columns)
+        for column in self.columns:
+            size += sys.getsizeof(column)
+            sample = column[:64]
+            if sample:
+                per_value = sum(sys.getsizeof(value) for value in sample) / len(sample)
+                size += int(per_value * len(column))
+        return size
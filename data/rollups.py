@@ -0,0 +1,407 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import date, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: пересборку могут выполнять несколько процессов
+    fcntl = None
+
+from config.clickhouse_config import CLICKHOUSE_CONFIG
+from data.clickhouse_client import clickhouse_client, executor, profile_settings
+
+# Витрина: таблица rollup.*, исходная таблица и ее колонка даты, колонки
+# витрины и запрос, которым витрина строится из исходной таблицы
+Rollup = namedtuple('Rollup', ['table', 'source', 'date_column', 'columns', 'select'])
+
+# Запрос витрины агрегирует исходную таблицу за дни
+# [max({start_date}, {rollup_until} + 1), {end_date}]; NO_ROLLUP - все дни периода
+NO_ROLLUP = '1970-01-01'
+
+ROLLUPS = {
+    'employee_daily': Rollup(
+        table='rollup.employee_daily',
+        source='dwh.operations_enriched',
+        date_column='date',
+        columns=('day', 'employee', 'regular_ops', 'work_sec', 'earnings',
+                 'first_op_start', 'last_op_end'),
+        select="""
+        SELECT
+            date AS day,
+            assumeNotNull(fio) AS employee,
+            count() AS regular_ops,
+            toFloat64(SUM(duration_sec)) AS work_sec,
+            toFloat64(COALESCE(SUM(price_per_op), 0)) AS earnings,
+            toDateTime(assumeNotNull(MIN(START_DATE_TIME))) AS first_op_start,
+            toDateTime(assumeNotNull(MAX(END_DATE_TIME))) AS last_op_end
+        FROM dwh.operations_enriched
+        WHERE date BETWEEN greatest({start_date:Date}, {rollup_until:Date} + 1) AND {end_date:Date}
+            AND fio IS NOT NULL
+            AND START_DATE_TIME IS NOT NULL
+            AND END_DATE_TIME IS NOT NULL
+        GROUP BY date, fio
+        """
+    ),
+    'orders_hourly': Rollup(
+        table='rollup.orders_hourly',
+        source='dwh.orders_enriched',
+        date_column='date',
+        columns=('day', 'hour', 'row_count', 'delayed_count', 'orders_state'),
+        select="""
+        SELECT
+            date AS day,
+            toHour(assumeNotNull(START_DATE_TIME)) AS hour,
+            count() AS row_count,
+            countIf(timeliness_status IN ('просрочено', 'Просрочено')) AS delayed_count,
+            uniqExactStateIf(toString(assumeNotNull(SHIPMENT_ID)), SHIPMENT_ID IS NOT NULL) AS orders_state
+        FROM dwh.orders_enriched
+        WHERE date BETWEEN greatest({start_date:Date}, {rollup_until:Date} + 1) AND {end_date:Date}
+            AND ORDER_TYPE = 'Клиент'
+            AND START_DATE_TIME IS NOT NULL
+        GROUP BY date, hour
+        """
+    ),
+    'fines_daily': Rollup(
+        table='rollup.fines_daily',
+        source='dm.fact_fines',
+        date_column='date_key',
+        columns=('day', 'employee', 'category', 'amount', 'fine_count', 'amount_total'),
+        select="""
+        SELECT
+            toDate(date_key) AS day,
+            CAST(fio AS Nullable(String)) AS employee,
+            CAST(fine_category AS Nullable(String)) AS category,
+            CAST(fine_amount AS Nullable(Float64)) AS amount,
+            count() AS fine_count,
+            toFloat64(COALESCE(SUM(fine_amount), 0)) AS amount_total
+        FROM dm.fact_fines
+        WHERE date_key BETWEEN greatest({start_date:Date}, {rollup_until:Date} + 1) AND {end_date:Date}
+        GROUP BY date_key, fio, fine_category, fine_amount
+        """
+    ),
+}
+
+# Партиции исходных таблиц: по датам кусков определяются месяцы, а по
+# числу строк и последнему номеру блока - водяные знаки. Слияния кусков
+# не меняют ни того, ни другого, вставки и удаления меняют
+PARTS_QUERY = """
+SELECT
+    concat(database, '.', table) AS table_name,
+    partition_id,
+    min(min_date) AS min_date,
+    max(max_date) AS max_date,
+    sum(rows) AS rows,
+    max(max_block_number) AS max_block
+FROM system.parts
+WHERE active AND table_name IN {tables:Array(String)}
+GROUP BY table_name, partition_id
+"""
+
+# Последний водяной знак, с которым собран каждый месяц витрин
+STATE_QUERY = """
+SELECT rollup_name, month, argMax(source_mark, refreshed_at) AS source_mark
+FROM rollup.rollup_state
+GROUP BY rollup_name, month
+"""
+
+# Месяцы исходных таблиц без разбиения по дате и знак, с которым они прочитаны
+SOURCE_MONTHS_QUERY = """
+SELECT source, argMax(source_mark, refreshed_at) AS source_mark, argMax(months, refreshed_at) AS months
+FROM rollup.source_months
+GROUP BY source
+"""
+
+
+def _date(value):
+    return date.fromisoformat(str(value)[:10])
+
+
+def _month_end(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def _months(start, end):
+    """Первые числа месяцев, пересекающих [start, end]"""
+    months = []
+    month = start.replace(day=1)
+    while month <= end:
+        months.append(month)
+        month = _month_end(month) + timedelta(days=1)
+    return months
+
+
+class RollupManager:
+    """
+    Локальное обслуживание витрин rollup.* (схема - в migrations/).
+
+    Витрины разбиты на месяцы. Фоновая задача пересобирает месяц целиком
+    запросом витрины во временную таблицу и атомарно подменяет его через
+    REPLACE PARTITION, когда меняются данные исходной таблицы за этот
+    месяц. Водяной знак месяца - число строк и последний номер блока
+    пересекающих его партиций (слияния кусков их не меняют); в
+    rollup.rollup_state хранится знак, по которому месяц собран. Таблицы
+    без разбиения по дате (min_date = 1970-01-01) при любом изменении
+    пересобираются целиком, их месяцы хранятся в rollup.source_months.
+    Месяцы собираются от старых к новым, не больше months_per_run за
+    проход, а проход выполняет один процесс за раз (блокировка fcntl).
+
+    Запросы читают витрину до конца непрерывного ряда готовых месяцев
+    (ready_until), остальные дни - из исходной таблицы.
+    """
+
+    def __init__(self, client, rollups, interval=300.0, months_per_run=6, status_ttl=60.0,
+                 lock_path=None, timeout=600, settings=None, enabled=True):
+        self.client = client
+        self.rollups = rollups
+        self.interval = interval
+        self.months_per_run = months_per_run
+        # Как долго состояние готовности используется без перечитывания
+        self.status_ttl = status_ttl
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), 'dashboard-rollups.lock')
+        # Таймаут запросов сборки месяца (секунды)
+        self.timeout = timeout
+        self.settings = settings
+        self.enabled = enabled
+        self._status = None
+        self._status_at = 0.0
+        self._loading = False
+        self._available = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {'runs': 0, 'built': 0, 'errors': 0}
+
+    def ensure_started(self):
+        """Запуск фоновой пересборки в текущем процессе (поток не переживает fork)"""
+        if self._pid == os.getpid() or self.interval <= 0 or not self.enabled:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='clickhouse-rollups', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """Один проход пересборки устаревших месяцев"""
+        if fcntl is None:
+            self._refresh()
+            return
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Пересборку уже выполняет другой процесс
+                return
+            try:
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        status = self.load_status()
+        if not status:
+            return
+        stale = sorted(
+            (month, name) for name, months in status.items()
+            for month, (mark, built) in months.items() if mark != built
+        )
+        built = 0
+        for month, name in stale[:self.months_per_run]:
+            try:
+                self._build(name, month, status[name][month][0])
+                built += 1
+            except Exception as e:
+                print(f"Ошибка сборки витрины {self.rollups[name].table} за {month:%Y-%m}: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['built'] += built
+        if built:
+            self.load_status()
+
+    def _execute(self, query, params=None):
+        return self.client.execute(query, params, raise_errors=True, timeout=self.timeout,
+                                   settings=self.settings)
+
+    def _build(self, name, month, mark):
+        """Сборка месяца во временной таблице и подмена партиции витрины"""
+        rollup = self.rollups[name]
+        staging = f"{rollup.table}_build_{uuid.uuid4().hex[:8]}"
+        self._execute(f"CREATE TABLE {staging} AS {rollup.table}")
+        try:
+            self._execute(f"INSERT INTO {staging} ({', '.join(rollup.columns)}) {rollup.select}", {
+                'start_date': month,
+                'end_date': _month_end(month),
+                'rollup_until': NO_ROLLUP
+            })
+            self._execute(f"ALTER TABLE {rollup.table} "
+                          f"REPLACE PARTITION {month.year * 100 + month.month} FROM {staging}")
+        finally:
+            self._execute(f"DROP TABLE IF EXISTS {staging}")
+        self._execute("""
+        INSERT INTO rollup.rollup_state (rollup_name, month, source_mark)
+        SELECT {rollup_name:String}, {month:Date}, {mark:String}
+        """, {'rollup_name': name, 'month': month, 'mark': mark})
+
+    def load_status(self):
+        """
+        Перечитывание состояния витрин.
+
+        Возвращает {витрина: {месяц: (текущий знак, знак сборки)}} или
+        None, если витрины не установлены (миграции не применены).
+        """
+        try:
+            built = {}
+            for name, month, mark in self._execute(STATE_QUERY):
+                built.setdefault(name, {})[_date(month)] = mark
+            known = {
+                source: (mark, [_date(month) for month in months])
+                for source, mark, months in self._execute(SOURCE_MONTHS_QUERY)
+            }
+            parts = {}
+            for table, partition, min_date, max_date, rows, block in self._execute(PARTS_QUERY, {
+                'tables': sorted({rollup.source for rollup in self.rollups.values()})
+            }):
+                parts.setdefault(table, []).append(
+                    (_date(min_date), _date(max_date), f"{partition}:{rows}:{block}"))
+            status = {
+                name: self._month_status(rollup, parts.get(rollup.source, []),
+                                         built.get(name, {}), known)
+                for name, rollup in self.rollups.items()
+            }
+        except Exception as e:
+            if self._available is not False:
+                print(f"Витрины ClickHouse недоступны, запросы идут к исходным таблицам: {e}")
+            status = None
+        with self._lock:
+            self._available = status is not None
+            self._status = status
+            self._status_at = time.monotonic()
+        return status
+
+    def _month_status(self, rollup, parts, built, known):
+        unpartitioned = sorted(mark for _, max_date, mark in parts if max_date.year <= 1970)
+        all_months = []
+        if unpartitioned:
+            all_months = self._source_months(rollup, ' '.join(unpartitioned), known)
+
+        marks = {}
+        for min_date, max_date, mark in parts:
+            months = all_months if max_date.year <= 1970 else _months(min_date, max_date)
+            for month in months:
+                marks.setdefault(month, []).append(mark)
+
+        status = {}
+        for month in set(marks) | set(built):
+            # Месяц без кусков (удаленная партиция) собирается пустым
+            status[month] = (' '.join(sorted(marks.get(month, []))), built.get(month))
+        return status
+
+    def _source_months(self, rollup, mark, known):
+        """Месяцы таблицы без разбиения по дате: из rollup.source_months или из самой таблицы"""
+        if rollup.source in known and known[rollup.source][0] == mark:
+            return known[rollup.source][1]
+        result = self._execute(f"""
+        SELECT DISTINCT toStartOfMonth({rollup.date_column}) AS month
+        FROM {rollup.source}
+        """)
+        months = sorted(_date(month) for month, in result)
+        self._execute("""
+        INSERT INTO rollup.source_months (source, source_mark, months)
+        SELECT {source:String}, {mark:String}, {months:Array(Date)}
+        """, {'source': rollup.source, 'mark': mark, 'months': months})
+        known[rollup.source] = (mark, months)
+        return months
+
+    def ready_until(self, name):
+        """
+        Последний день непрерывного ряда готовых месяцев витрины или None.
+
+        Не ждет ClickHouse: устаревшее состояние перечитывается в фоне,
+        а до первого чтения витрина считается неготовой.
+        """
+        if not self.enabled:
+            return None
+        self.ensure_started()
+        with self._lock:
+            status = self._status
+            expired = time.monotonic() - self._status_at > self.status_ttl
+            if (status is None or expired) and not self._loading:
+                self._loading = True
+                load = True
+            else:
+                load = False
+        if load:
+            try:
+                executor.submit(self._load_in_background)
+            except RuntimeError:
+                # executor уже остановлен (завершение процесса)
+                with self._lock:
+                    self._loading = False
+
+        until = None
+        for month, (mark, built) in sorted((status or {}).get(name, {}).items()):
+            if mark != built:
+                break
+            until = _month_end(month)
+        return until.isoformat() if until else None
+
+    def _load_in_background(self):
+        try:
+            self.load_status()
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, available=self._available)
+        for name in self.rollups:
+            stats[name] = self.ready_until(name)
+        return stats
+
+
+# rollup_refresh_interval = 0 отключает локальную пересборку (например,
+# если витрины обслуживает другой экземпляр), use_rollups = False - чтение
+rollups = RollupManager(
+    clickhouse_client, ROLLUPS,
+    interval=CLICKHOUSE_CONFIG.get('rollup_refresh_interval', 300),
+    months_per_run=CLICKHOUSE_CONFIG.get('rollup_months_per_run', 6),
+    status_ttl=CLICKHOUSE_CONFIG.get('rollup_status_ttl', 60),
+    lock_path=CLICKHOUSE_CONFIG.get('rollup_lock_path'),
+    timeout=CLICKHOUSE_CONFIG.get('rollup_build_timeout', 600),
+    settings=profile_settings('background'),
+    enabled=CLICKHOUSE_CONFIG.get('use_rollups', True)
+)
+
+
+def rollup_source(name):
+    """
+    Подзапрос с колонками витрины name и его параметры.
+
+    Подзапрос фильтруется параметрами {start_date:Date} и {end_date:Date}
+    вызывающего запроса: дни готовых месяцев читаются из витрины, остальные
+    агрегируются из исходной таблицы тем же запросом, которым строится
+    витрина. Пока витрина не готова, подзапрос читает только исходную таблицу.
+    """
+    rollup = ROLLUPS[name]
+    until = rollups.ready_until(name)
+    if until is None:
+        return rollup.select, {'rollup_until': NO_ROLLUP}
+    source = f"""
+        SELECT {', '.join(rollup.columns)}
+        FROM {rollup.table}
+        WHERE day BETWEEN {{start_date:Date}} AND least({{end_date:Date}}, {{rollup_until:Date}})
+        UNION ALL
+        {rollup.select}
+    """
+    return source, {'rollup_until': until}
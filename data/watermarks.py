@@ -0,0 +1,262 @@
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+
+# Таблицы в FROM/JOIN запроса: только с явной базой (db.table)
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][\w]*\.[A-Za-z_][\w]*)', re.IGNORECASE)
+# EXTRACT(HOUR FROM x.column) - не таблица
+EXTRACT_RE = re.compile(r'EXTRACT\s*\(\s*\w+\s*$', re.IGNORECASE)
+
+# Параметры, по которым определяется последний день данных запроса
+DATE_TO_PARAMS = ('end_date', 'today', '__day__')
+
+# Водяные знаки по партициям: число строк и наибольший номер блока
+# не меняются при слиянии кусков, а меняются при вставке и удалении данных
+WATERMARK_QUERY = """
+SELECT
+    concat(database, '.', table) AS table_name,
+    partition_id,
+    min(min_date) AS min_date,
+    sum(rows) AS rows,
+    max(max_block_number) AS max_block
+FROM system.parts
+WHERE active AND table_name IN {tables:Array(String)}
+GROUP BY table_name, partition_id
+"""
+
+
+def query_tables(query):
+    """Таблицы, из которых читает запрос"""
+    return frozenset(
+        match.group(1).lower() for match in TABLE_RE.finditer(query)
+        if not EXTRACT_RE.search(query, max(0, match.start() - 32), match.start())
+    )
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def query_date_to(params):
+    """Последний день, который покрывает запрос, или None, если неизвестно"""
+    days = [_to_date(params[name]) for name in DATE_TO_PARAMS if params and params.get(name)]
+    days = [day for day in days if day is not None]
+    return max(days) if days else None
+
+
+def cache_meta(query, params=None, date_to=None):
+    """
+    Метаданные записи кэша: таблицы и последний день данных.
+    Водяные знаки таблиц добавляет WatermarkTracker.stamp.
+    """
+    return {
+        'tables': query_tables(query),
+        'date_to': date_to if date_to is not None else query_date_to(params)
+    }
+
+
+class WatermarkTracker:
+    """
+    Инвалидация кэша по изменению данных в таблицах.
+
+    Периодически читает system.parts для отслеживаемых таблиц. Водяной
+    знак партиции - число строк и наибольший номер блока: слияние кусков
+    их не меняет, вставка и удаление данных меняют. Если у таблицы
+    изменились партиции, из кэша удаляются записи, которые читают эту
+    таблицу и покрывают даты начиная с самой ранней даты измененных
+    партиций. Записи за прошлые периоды при этом остаются. Таблицы без
+    разбиения по дате (min_date = 1970-01-01) сбрасывают все зависящие
+    от них записи.
+
+    Записи общего кэша, созданные другими процессами, проверяются по
+    знакам, записанным в их метаданные (stamp) перед запросом: запись
+    отклоняется, если изменились партиции с ее датами. Первой проверки
+    чтение ждет не дольше first_probe_wait секунд, после чего запись
+    считается непроверенной: не используется, но и не удаляется.
+    """
+
+    def __init__(self, client, cache, tables, interval=60.0, history_ttl=7 * 24 * 60 * 60,
+                 settings=None, first_probe_wait=5.0):
+        self.client = client
+        # Настройки ClickHouse для запроса проверки
+        self.settings = settings
+        self.cache = cache
+        self.tables = [table.lower() for table in tables]
+        self.interval = interval
+        # TTL для прошлых периодов по отслеживаемым таблицам
+        self.history_ttl = history_ttl
+        # Партиции по таблицам: {таблица: {partition_id: (min_date, знак)}}; None до первой проверки
+        self._marks = None
+        # Сколько чтение общего кэша ждет первой проверки (секунды)
+        self.first_probe_wait = first_probe_wait
+        self._first_probe = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {'probes': 0, 'changes': 0, 'invalidated': 0, 'errors': 0}
+        cache.validator = self.is_valid
+
+    def ensure_started(self):
+        """Запуск фоновой проверки в текущем процессе (поток не переживает fork)"""
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='clickhouse-watermarks', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                # Ошибка инвалидации (например, занятый файл кэша) не останавливает проверку
+                print(f"Ошибка инвалидации кэша по водяным знакам: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+            time.sleep(self.interval)
+
+    def probe(self):
+        """Одна проверка водяных знаков с инвалидацией изменившихся таблиц"""
+        try:
+            result = self.client.execute(WATERMARK_QUERY, {'tables': self.tables},
+                                         raise_errors=True, settings=self.settings)
+        except Exception as e:
+            print(f"Ошибка проверки водяных знаков ClickHouse: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            # Неудачная первая проверка тоже завершает ожидание в is_valid
+            self._first_probe.set()
+            return
+
+        marks = {table: {} for table in self.tables}
+        for table, partition, min_date, rows, block in result:
+            marks.setdefault(table, {})[partition] = (_to_date(min_date), f"{partition}:{rows}:{block}")
+
+        moved = []
+        with self._lock:
+            self._stats['probes'] += 1
+            previous, self._marks = self._marks, marks
+            # Первая проверка только запоминает знаки
+            if previous is not None:
+                for table, partitions in marks.items():
+                    changed_from = self._changed_from(previous.get(table, {}), partitions)
+                    if changed_from is not None:
+                        self._stats['changes'] += 1
+                        moved.append((table, changed_from))
+        self._first_probe.set()
+
+        for table, changed_from in moved:
+            removed = self.cache.invalidate(
+                lambda meta: self._affected(meta, table, changed_from)
+            )
+            with self._lock:
+                self._stats['invalidated'] += removed
+
+    @staticmethod
+    def _changed_from(previous, current):
+        """Самая ранняя дата измененных, новых и удаленных партиций или None"""
+        dates = []
+        for partition in set(previous) | set(current):
+            old, new = previous.get(partition), current.get(partition)
+            if old != new:
+                # Дата удаленной партиции - из прошлой проверки
+                dates.extend(mark[0] for mark in (old, new) if mark is not None)
+        return min(dates) if dates else None
+
+    @staticmethod
+    def _affected(meta, table, changed_from):
+        if not meta or table not in meta['tables']:
+            return False
+        if meta['date_to'] is None:
+            return True
+        return meta['date_to'] >= changed_from
+
+    def _digest(self, table, date_to):
+        """Знак таблицы для записи: партиции с датами не позже date_to (под self._lock)"""
+        return ' '.join(sorted(
+            mark for min_date, mark in self._marks.get(table, {}).values()
+            if date_to is None or min_date <= date_to
+        ))
+
+    def stamp(self, meta):
+        """
+        Водяные знаки отслеживаемых таблиц в метаданных записи.
+
+        Вызывается до отправки запроса: по ним другие процессы проверяют
+        запись из общего кэша. До первой проверки знаков нет.
+        """
+        with self._lock:
+            if self._marks is not None:
+                meta['marks'] = {
+                    table: self._digest(table, meta['date_to'])
+                    for table in meta['tables'] if table in self.tables
+                }
+        return meta
+
+    def _wait_first_probe(self):
+        """Ожидание первой проверки, запущенной в этом процессе"""
+        if self._pid != os.getpid():
+            return False
+        return self._first_probe.wait(self.first_probe_wait)
+
+    def is_valid(self, meta):
+        """
+        Проверка записи из общего кэша, созданной, возможно, до изменения.
+
+        True - запись актуальна, False - данные изменились после ее
+        создания, None - проверить нечем (первая проверка не выполнена
+        или запись без водяных знаков).
+        """
+        if not meta:
+            return True
+        tables = [table for table in meta['tables'] if table in self.tables]
+        if not tables:
+            return True
+        if self._marks is None:
+            if self.interval <= 0:
+                # Проверка отключена, остаются только TTL
+                return True
+            # Изменения таблиц до запуска процесса еще неизвестны
+            self._wait_first_probe()
+        stamped = meta.get('marks') or {}
+        with self._lock:
+            if self._marks is None:
+                return None
+            for table in tables:
+                if table not in stamped:
+                    return None
+                if stamped[table] != self._digest(table, meta['date_to']):
+                    return False
+        return True
+
+    def ttl_for(self, meta, ttl):
+        """
+        TTL записи: прошлые периоды по отслеживаемым таблицам живут
+        history_ttl, так как их сбросит проверка при изменении данных.
+        """
+        date_to = meta['date_to']
+        if date_to is None or date_to >= date.today() or not meta['tables']:
+            return ttl
+        with self._lock:
+            if self._pid != os.getpid() or self._marks is None or \
+                    not all(table in self._marks for table in meta['tables']):
+                return ttl
+        return max(ttl, self.history_ttl)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tables'] = {table: len(partitions) for table, partitions in (self._marks or {}).items()}
+        return stats
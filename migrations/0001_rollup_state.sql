@@ -0,0 +1,12 @@
+-- Состояние витрин rollup.*: для каждого месяца витрины водяной знак
+-- исходной таблицы, по которому месяц был собран (см. data/rollups.py).
+-- Месяц готов, пока знак совпадает с текущим по system.parts
+CREATE TABLE IF NOT EXISTS rollup.rollup_state
+(
+    rollup_name String,
+    month Date,
+    source_mark String,
+    refreshed_at DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(refreshed_at)
+ORDER BY (rollup_name, month);
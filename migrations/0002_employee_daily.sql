@@ -0,0 +1,16 @@
+-- Сотрудник x день из dwh.operations_enriched (строки с fio, START_DATE_TIME
+-- и END_DATE_TIME): число операций, длительность, заработок, первая и
+-- последняя операция. Месяц пересобирается целиком через REPLACE PARTITION
+CREATE TABLE IF NOT EXISTS rollup.employee_daily
+(
+    day Date,
+    employee String,
+    regular_ops UInt64,
+    work_sec Float64,
+    earnings Float64,
+    first_op_start DateTime,
+    last_op_end DateTime
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(day)
+ORDER BY (day, employee);
@@ -0,0 +1,14 @@
+-- День x час суток из клиентских заказов dwh.orders_enriched: строки,
+-- просроченные строки и состояние uniqExact по SHIPMENT_ID, чтобы число
+-- различных заказов сливалось за любой набор дней
+CREATE TABLE IF NOT EXISTS rollup.orders_hourly
+(
+    day Date,
+    hour UInt8,
+    row_count UInt64,
+    delayed_count UInt64,
+    orders_state AggregateFunction(uniqExact, String)
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(day)
+ORDER BY (day, hour);
@@ -0,0 +1,14 @@
+-- Штрафы dm.fact_fines, сгруппированные по (день, сотрудник, категория,
+-- сумма): из этой детализации без потерь строится куб штрафов
+CREATE TABLE IF NOT EXISTS rollup.fines_daily
+(
+    day Date,
+    employee Nullable(String),
+    category Nullable(String),
+    amount Nullable(Float64),
+    fine_count UInt64,
+    amount_total Float64
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(day)
+ORDER BY (day, ifNull(employee, ''), ifNull(category, ''));
@@ -0,0 +1,12 @@
+-- Месяцы исходных таблиц без разбиения по дате (см. data/rollups.py):
+-- список перечитывается из самой таблицы только при смене ее водяного
+-- знака, а не при каждой загрузке состояния витрин в каждом процессе
+CREATE TABLE IF NOT EXISTS rollup.source_months
+(
+    source String,
+    source_mark String,
+    months Array(Date),
+    refreshed_at DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(refreshed_at)
+ORDER BY source;
@@ -0,0 +1,15 @@
+import sys
+import types
+
+# config/clickhouse_config.py не хранится в репозитории: тесты получают
+# свою конфигурацию без фоновых задач и с недоступным сервером, запросы
+# в ClickHouse в тестах подменяются заглушками
+config = types.ModuleType('config.clickhouse_config')
+config.CLICKHOUSE_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 9,
+    'watermark_interval': 0,
+    'rollup_refresh_interval': 0,
+    'use_rollups': False
+}
+sys.modules['config.clickhouse_config'] = config
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import pytest
+
+import data.async_client as async_client
+import data.clickhouse_client as clickhouse
+from data.cache import QueryCache
+from data.result import QueryResult
+
+
+class Backend:
+    """Общее хранилище, запоминающее потоки, из которых его вызывают"""
+
+    def __init__(self):
+        self.entries = {}
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return self.entries.get(key)
+
+    def set(self, key, value, ttl, soft_ttl, meta):
+        self.threads.append(threading.get_ident())
+        self.entries[key] = (value, ttl, ttl if soft_ttl is None else soft_ttl, meta)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = Backend()
+    cache = QueryCache(backend=backend)
+    monkeypatch.setattr(clickhouse, 'query_cache', cache)
+    monkeypatch.setattr(async_client, 'query_cache', cache)
+    return backend
+
+
+@pytest.fixture
+def server(monkeypatch):
+    queries = []
+
+    async def execute(query, params=None, **kwargs):
+        queries.append(query)
+        return QueryResult.from_rows(['value'], ['UInt8'], [(1,)])
+
+    monkeypatch.setattr(async_client.async_clickhouse_client, 'execute', execute)
+    return queries
+
+
+def test_backend_io_off_event_loop(backend, server):
+    async def main():
+        loop_thread = threading.get_ident()
+        first = await async_client.execute_query_cached_async("SELECT 1")
+        second = await async_client.execute_query_cached_async("SELECT 1")
+        return loop_thread, first, second
+
+    loop_thread, first, second = asyncio.run(main())
+    assert list(first) == list(second) == [(1,)]
+    assert len(server) == 1
+    # Промах в памяти читает и пишет хранилище в пуле потоков, повтор - из памяти
+    assert len(backend.threads) == 2
+    assert loop_thread not in backend.threads
+
+
+def test_entry_of_other_worker(backend, server):
+    key = clickhouse.query_cache_key("SELECT 1", None)
+    backend.entries[key] = (QueryResult.from_rows(['value'], ['UInt8'], [(2,)]), 60, 60, None)
+
+    result = asyncio.run(async_client.execute_query_cached_async("SELECT 1"))
+    assert list(result) == [(2,)]
+    assert server == []
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from data.cache import AsyncSingleFlight
+
+
+async def _settle():
+    # Даем ожидающим корутинам дойти до общего вызова
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_coroutines_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return object()
+
+        tasks = [asyncio.ensure_future(flight.do('key', fetch)) for _ in range(5)]
+        await _settle()
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'calls': 1, 'shared': 4, 'in_flight': 0}
+
+
+def test_exception_is_shared():
+    flight = AsyncSingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fail():
+            await release.wait()
+            raise ValueError("ошибка")
+
+        tasks = [asyncio.ensure_future(flight.do('key', fail)) for _ in range(3)]
+        await _settle()
+        release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_waiter_cancellation_keeps_shared_call():
+    flight = AsyncSingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 42
+
+        leader = asyncio.ensure_future(flight.do('key', fetch))
+        waiter = asyncio.ensure_future(flight.do('key', fetch))
+        await _settle()
+        waiter.cancel()
+        await _settle()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == 42
+
+
+def test_leader_cancellation_hands_over_to_waiter():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return len(calls)
+
+        leader = asyncio.ensure_future(flight.do('key', fetch))
+        waiter = asyncio.ensure_future(flight.do('key', fetch))
+        await _settle()
+        leader.cancel()
+        await _settle()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # Ожидающий не получает чужую отмену и повторяет вызов сам
+        return await waiter
+
+    assert asyncio.run(main()) == 2
+    assert len(calls) == 2
@@ -0,0 +1,73 @@
+import types
+
+import pytest
+
+import data.cache
+import data.clickhouse_client as clickhouse
+from data.cache import CachePolicy, QueryCache
+from data.result import QueryResult
+
+
+class InlineExecutor:
+    """Фоновые задачи выполняются сразу, в вызывающем потоке"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(data.cache, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(clickhouse, 'query_cache', QueryCache())
+    monkeypatch.setattr(clickhouse, 'executor', InlineExecutor())
+
+    fetched = []
+
+    def execute(query, params=None, **kwargs):
+        fetched.append(query)
+        return QueryResult.from_rows(['value'], ['UInt64'], [(len(fetched),)])
+
+    monkeypatch.setattr(clickhouse.clickhouse_client, 'execute', execute)
+    return types.SimpleNamespace(now=now, fetched=fetched)
+
+
+def _value(policy):
+    return clickhouse.execute_query_cached("SELECT value", policy=policy)[0][0]
+
+
+def test_stale_value_served_while_refreshing(env):
+    policy = CachePolicy(soft_ttl=10, hard_ttl=60)
+    assert _value(policy) == 1
+
+    env.now[0] += 5
+    assert _value(policy) == 1
+    assert len(env.fetched) == 1
+
+    # После soft_ttl отдается старое значение, обновление уходит в фон
+    env.now[0] += 15
+    assert _value(policy) == 1
+    assert len(env.fetched) == 2
+    assert _value(policy) == 2
+
+    # После hard_ttl запрос выполняется синхронно
+    env.now[0] += 61
+    assert _value(policy) == 3
+
+
+def test_failed_refresh_keeps_stale_value(env, monkeypatch):
+    policy = CachePolicy(soft_ttl=10, hard_ttl=60)
+    assert _value(policy) == 1
+
+    def fail(query, params=None, **kwargs):
+        raise clickhouse.ClickHouseError("сервер недоступен")
+
+    monkeypatch.setattr(clickhouse.clickhouse_client, 'execute', fail)
+    env.now[0] += 20
+    assert _value(policy) == 1
+    assert _value(policy) == 1
+
+
+def test_hard_ttl_not_below_soft_ttl():
+    with pytest.raises(ValueError):
+        CachePolicy(soft_ttl=60, hard_ttl=10)
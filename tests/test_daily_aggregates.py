@@ -0,0 +1,83 @@
+from datetime import date
+
+import data.daily_aggregates as daily
+from data.cache import QueryCache
+from data.result import QueryResult
+
+NAMES = ['day', 'fio', 'ops', 'first_op', 'last_op']
+TYPES = ['Date', 'String', 'UInt64', 'Nullable(DateTime)', 'Nullable(DateTime)']
+AGGREGATES = {'ops': 'sum', 'first_op': 'min', 'last_op': 'max'}
+
+
+def _partial(*rows):
+    return QueryResult.from_rows(NAMES, TYPES, list(rows))
+
+
+def test_merge_combines_days_by_key():
+    merged = daily._merge([
+        _partial(('2024-01-01', 'Иванов', 3, '2024-01-01 08:00:00', '2024-01-01 17:00:00'),
+                 ('2024-01-01', 'Петров', 1, None, None)),
+        _partial(('2024-01-02', 'Иванов', 2, '2024-01-02 07:30:00', '2024-01-02 16:00:00'),
+                 ('2024-01-02', 'Петров', 4, '2024-01-02 09:00:00', '2024-01-02 10:00:00'))
+    ], keys=['fio'], aggregates=AGGREGATES)
+
+    assert merged.names == NAMES[1:]
+    assert merged.types == TYPES[1:]
+    rows = {row[0]: row for row in merged}
+    assert rows['Иванов'] == ('Иванов', 5, '2024-01-01 08:00:00', '2024-01-02 16:00:00')
+    # NULL частичного агрегата не затирает значения других дней
+    assert rows['Петров'] == ('Петров', 5, '2024-01-02 09:00:00', '2024-01-02 10:00:00')
+
+
+def test_merge_without_keys_gives_one_row():
+    merged = daily._merge([
+        _partial(('2024-01-01', 'Иванов', 3, None, None)),
+        _partial(),
+        _partial(('2024-01-03', 'Петров', 4, None, None))
+    ], keys=[], aggregates={'ops': 'sum'})
+    assert len(merged) == 1
+    assert merged[0][1] == 7
+
+
+def test_merge_of_empty_partials():
+    assert not daily._merge([QueryResult.empty(), QueryResult.empty()], keys=['fio'],
+                            aggregates=AGGREGATES)
+
+
+def test_day_runs_split_on_gaps():
+    days = [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 4), date(2024, 1, 6), date(2024, 1, 7)]
+    assert daily._day_runs(days) == [
+        [date(2024, 1, 1), date(2024, 1, 2)],
+        [date(2024, 1, 4), date(2024, 1, 4)],
+        [date(2024, 1, 6), date(2024, 1, 7)]
+    ]
+
+
+def test_only_missing_days_are_queried(monkeypatch):
+    monkeypatch.setattr(daily, 'query_cache', QueryCache())
+    requested = []
+
+    def execute(query, params=None, **kwargs):
+        requested.append((params['start_date'], params['end_date']))
+        rows = []
+        day = params['start_date']
+        while day <= params['end_date']:
+            rows.append((day.isoformat(), 'Иванов', 1, None, None))
+            day = date.fromordinal(day.toordinal() + 1)
+        return QueryResult.from_rows(NAMES, TYPES, rows)
+
+    monkeypatch.setattr(daily.clickhouse_client, 'execute', execute)
+    query = "SELECT ... WHERE day BETWEEN {start_date:Date} AND {end_date:Date}"
+
+    def total(start, end):
+        result = daily.execute_daily_aggregate(query, start, end, keys=['fio'],
+                                               aggregates=AGGREGATES)
+        return result[0][1]
+
+    assert total('2024-01-01', '2024-01-03') == 3
+    assert total('2024-01-02', '2024-01-05') == 4
+    assert total('2024-01-01', '2024-01-05') == 5
+    assert requested == [
+        (date(2024, 1, 1), date(2024, 1, 3)),
+        (date(2024, 1, 4), date(2024, 1, 5))
+    ]
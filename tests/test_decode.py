@@ -0,0 +1,27 @@
+from data.clickhouse_client import decode_json_compact
+
+
+def test_decode_typed_rows():
+    body = (b'["id","name","amount","day"]\n'
+            b'["UInt64","Nullable(String)","Decimal(10, 2)","Date"]\n'
+            b'["18446744073709551615","a\\nb",1.5,"2024-01-31"]\n'
+            b'[2,null,"2.25","2024-02-01"]\n')
+    names, types, rows = decode_json_compact(body)
+    assert names == ['id', 'name', 'amount', 'day']
+    assert types[1] == 'Nullable(String)'
+    assert rows == [
+        [18446744073709551615, 'a\nb', 1.5, '2024-01-31'],
+        [2, None, 2.25, '2024-02-01']
+    ]
+
+
+def test_decode_header_only():
+    names, types, rows = decode_json_compact('["x"]\n["Int32"]\n')
+    assert names == ['x']
+    assert types == ['Int32']
+    assert rows == []
+
+
+def test_decode_empty_body():
+    assert decode_json_compact(b'') == ([], [], [])
+    assert decode_json_compact(b'\n') == ([], [], [])
@@ -0,0 +1,115 @@
+import os
+import types
+
+import pytest
+
+import data.cache
+from data.cache import QueryCache, SharedDiskCache, SQLiteCache
+from data.result import QueryResult
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Сроки записей на диске считаются по time.time(), вытеснение - по monotonic
+    now = [1000000.0]
+    monkeypatch.setattr(data.cache, 'time', types.SimpleNamespace(
+        time=lambda: now[0], monotonic=lambda: now[0]
+    ))
+    return now
+
+
+def _result(value):
+    return QueryResult.from_rows(['value'], ['Float64'], [(value,)])
+
+
+def test_shared_round_trip(tmp_path, clock):
+    disk = SharedDiskCache(str(tmp_path))
+    result = _result(1.5)
+    # Кэш массивов NumPy в файл не попадает
+    result.to_numpy('value')
+    assert disk.set('key', result, ttl=60, soft_ttl=10)
+
+    value, ttl, soft_ttl = disk.get('key')[:3]
+    assert list(value) == [(1.5,)]
+    assert value._arrays == {}
+    assert (ttl, soft_ttl) == (60, 10)
+    assert disk.get('missing') is None
+
+
+def test_shared_expiry(tmp_path, clock):
+    disk = SharedDiskCache(str(tmp_path))
+    disk.set('key', 'value', ttl=60)
+    clock[0] += 61
+    assert disk.get('key') is None
+    # Истекшая запись удаляется с диска
+    assert not os.path.exists(disk._path('key'))
+
+
+def test_shared_eviction_by_last_read(tmp_path, clock):
+    disk = SharedDiskCache(str(tmp_path), evict_interval=0)
+    disk.set('a', 'x' * 1000, ttl=60)
+    size = os.path.getsize(disk._path('a'))
+    disk.max_bytes = size * 2 + size // 2
+    disk.set('b', 'y' * 1000, ttl=60)
+    # Последнее чтение хранится в mtime: 'a' читали раньше, чем 'b'
+    os.utime(disk._path('a'), (1, 1))
+    os.utime(disk._path('b'), (2, 2))
+    disk.set('c', 'z' * 1000, ttl=60)
+
+    assert disk.get('a') is None
+    assert disk.get('b')[0] == 'y' * 1000
+    assert disk.get('c')[0] == 'z' * 1000
+    assert disk.stats()['evictions'] == 1
+
+
+def test_query_cache_reads_other_worker_entries(tmp_path, clock):
+    worker = QueryCache(backend=SharedDiskCache(str(tmp_path)))
+    other = QueryCache(backend=SharedDiskCache(str(tmp_path)))
+    worker.set('key', 'value', ttl=60, soft_ttl=10)
+
+    assert other.lookup('key') == ('value', False)
+    assert other.stats()['backend_hits'] == 1
+    # Запись перенесена в память процесса, диск больше не читается
+    assert other.lookup('key') == ('value', False)
+    assert other.stats()['backend_hits'] == 1
+
+    clock[0] += 20
+    assert QueryCache(backend=SharedDiskCache(str(tmp_path))).lookup('key') == ('value', True)
+
+
+def test_sqlite_survives_restart(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    SQLiteCache(path).set('key', _result(2.0), ttl=60, soft_ttl=10)
+
+    # Новый экземпляр - как после перезапуска процесса
+    value, ttl, soft_ttl = SQLiteCache(path).get('key')[:3]
+    assert list(value) == [(2.0,)]
+    assert (ttl, soft_ttl) == (60, 10)
+
+
+def test_sqlite_expiry(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = SQLiteCache(path)
+    cache.set('key', 'value', ttl=60)
+    clock[0] += 61
+    assert cache.get('key') is None
+    assert SQLiteCache(path).get('key') is None
+
+
+def test_sqlite_eviction_expired_then_least_recently_read(tmp_path, clock):
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), max_bytes=2500)
+    cache.set('old', 'o' * 1000, ttl=5)
+    cache.set('a', 'a' * 1000, ttl=60)
+    clock[0] += 10
+    # Устаревшая запись вытесняется первой
+    cache.set('b', 'b' * 1000, ttl=60)
+    assert cache.stats()['evictions'] == 1
+
+    clock[0] += 1
+    assert cache.get('a')[0] == 'a' * 1000
+    clock[0] += 1
+    # 'b' читали давнее, чем 'a'
+    cache.set('c', 'c' * 1000, ttl=60)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 2
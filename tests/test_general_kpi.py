@@ -0,0 +1,24 @@
+from data.queries import general_kpi_bundle_from_results
+from data.result import QueryResult
+
+
+def _accuracy(total_orders, error_orders):
+    result = QueryResult.from_rows(['total_orders', 'error_orders'], ['UInt64', 'UInt64'],
+                                   [(total_orders, error_orders)])
+    return general_kpi_bundle_from_results(QueryResult.empty(), result).accuracy
+
+
+def test_accuracy():
+    assert _accuracy(8, 2) == {'accuracy': 75.0, 'orders_without_errors': 6,
+                               'total_orders': 8, 'error_orders': 2}
+
+
+def test_all_orders_with_errors():
+    assert _accuracy(4, 4)['accuracy'] == 0.0
+
+
+def test_period_without_orders():
+    assert _accuracy(0, 0)['accuracy'] == 100.0
+    bundle = general_kpi_bundle_from_results(QueryResult.empty(), QueryResult.empty())
+    assert bundle.accuracy['accuracy'] == 100.0
+    assert bundle.revisions['total_revisions'] == 0
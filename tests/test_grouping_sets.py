@@ -0,0 +1,145 @@
+import re
+
+import pytest
+
+import data.queries as queries
+from data.queries import (
+    FINES_BY_CATEGORY, FINES_BY_EMPLOYEE, FINES_DETAIL, FINES_TOTAL, TIMELINESS_BY_GROUP,
+    TIMELINESS_BY_ROUTING, TIMELINESS_BY_STATUS, TIMELINESS_TOTAL
+)
+from data.result import QueryResult
+
+GROUPING_RE = re.compile(r'grouping\(([^)]*)\)')
+GROUPING_SETS_RE = re.compile(r'GROUPING SETS \((.*?)\n\s*\)', re.DOTALL)
+SET_RE = re.compile(r'\(([^()]*)\)')
+
+
+def _columns(text):
+    return [column.strip() for column in text.split(',') if column.strip()]
+
+
+def grouping_ids(query):
+    """
+    Значения grouping(...) для каждого набора GROUPING SETS запроса.
+
+    С force_grouping_standard_compatibility бит аргумента равен 1, когда
+    колонка не входит в набор; первый аргумент - старший бит.
+    """
+    arguments = _columns(GROUPING_RE.search(query).group(1))
+    ids = []
+    for grouping_set in SET_RE.findall(GROUPING_SETS_RE.search(query).group(1)):
+        columns = set(_columns(grouping_set))
+        ids.append(sum(1 << (len(arguments) - 1 - index)
+                       for index, argument in enumerate(arguments) if argument not in columns))
+    return ids
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Подмена execute_query_cached: запоминает запросы, отдает заданный результат"""
+    state = {'result': QueryResult.empty(), 'queries': []}
+
+    def execute_query_cached(query, params=None, **kwargs):
+        state['queries'].append((query, params))
+        return state['result']
+
+    monkeypatch.setattr(queries, 'execute_query_cached', execute_query_cached)
+    return state
+
+
+def test_fines_cube_grouping_ids_match_query(server):
+    queries.get_fines_cube('2024-01-01', '2024-01-31')
+    query, params = server['queries'][0]
+    assert 'force_grouping_standard_compatibility = 1' in query
+    assert grouping_ids(query) == [FINES_DETAIL, FINES_BY_EMPLOYEE, FINES_BY_CATEGORY, FINES_TOTAL]
+    assert params['start_date'] == '2024-01-01'
+    assert params['end_date'] == '2024-01-31'
+
+
+def test_fines_cube_from_result(server):
+    server['result'] = QueryResult.from_rows(
+        ['fio', 'fine_category', 'date_key', 'fine_amount', 'grouping_id', 'fines_count', 'total_amount'],
+        ['Nullable(String)', 'Nullable(String)', 'Date', 'Nullable(Float64)', 'UInt64', 'UInt64', 'Float64'],
+        [
+            ('Иванов', 'Опоздание', '2024-01-02', 500.0, FINES_DETAIL, 2, 1000.0),
+            ('Иванов', 'Брак', '2024-01-05', 300.0, FINES_DETAIL, 1, 300.0),
+            (None, 'Опоздание', '2024-01-03', 500.0, FINES_DETAIL, 1, 500.0),
+            ('Иванов', None, None, None, FINES_BY_EMPLOYEE, 3, 1300.0),
+            (None, None, None, None, FINES_BY_EMPLOYEE, 1, 500.0),
+            (None, 'Опоздание', None, None, FINES_BY_CATEGORY, 3, 1500.0),
+            (None, 'Брак', None, None, FINES_BY_CATEGORY, 1, 300.0),
+            (None, None, None, None, FINES_TOTAL, 4, 1800.0)
+        ]
+    )
+    cube = queries.get_fines_cube('2024-01-01', '2024-01-31')
+
+    assert cube['by_employee'] == {'Иванов': {'count': 3, 'total_amount': 1300.0}}
+    assert cube['by_category'] == {
+        'Опоздание': {'count': 3, 'total_amount': 1500.0},
+        'Брак': {'count': 1, 'total_amount': 300.0}
+    }
+    assert cube['total'] == {'count': 4, 'total_amount': 1800.0}
+    # Детализация: по строке на штраф, новые сначала, без штрафов без сотрудника
+    assert list(cube['details']) == ['Иванов']
+    assert [(fine['date'], fine['category']) for fine in cube['details']['Иванов']] == [
+        ('2024-01-05', 'Брак'), ('2024-01-02', 'Опоздание'), ('2024-01-02', 'Опоздание')
+    ]
+    assert queries.get_employee_fines_details('Иванов', '2024-01-01', '2024-01-31') == \
+        cube['details']['Иванов']
+
+
+def test_empty_fines_cube(server):
+    cube = queries.get_fines_cube('2024-01-01', '2024-01-31')
+    assert cube['total'] == {'count': 0, 'total_amount': 0.0}
+    assert cube['by_employee'] == {} and cube['details'] == {}
+
+
+def _timeliness_query(server, start_date, end_date):
+    server['queries'].clear()
+    queries.get_timeliness_aggregate(start_date, end_date)
+    return server['queries'][0][0]
+
+
+def test_timeliness_grouping_ids_match_query(server):
+    query = _timeliness_query(server, '2024-01-01', '2024-01-31')
+    assert 'force_grouping_standard_compatibility = 1' in query
+    assert grouping_ids(query) == [
+        TIMELINESS_BY_ROUTING, TIMELINESS_BY_STATUS, TIMELINESS_BY_GROUP, TIMELINESS_TOTAL
+    ]
+
+
+def test_timeliness_period_granularity(server):
+    assert 'toDate(date) as period' in _timeliness_query(server, '2024-01-01', '2024-01-07')
+    assert 'toStartOfWeek(date) as period' in _timeliness_query(server, '2024-01-01', '2024-01-30')
+    assert 'toStartOfMonth(date) as period' in _timeliness_query(server, '2024-01-01', '2024-03-31')
+
+
+def test_timeliness_aggregate(server):
+    server['result'] = QueryResult.from_rows(
+        ['status_group', 'ROUTING_CODE', 'period', 'timeliness_status', 'grouping_id', 'order_count'],
+        ['String', 'Nullable(String)', 'Date', 'Nullable(String)', 'UInt64', 'UInt64'],
+        [
+            ('timely', 'РЦ', '2024-01-01', None, TIMELINESS_BY_ROUTING, 5),
+            ('delayed', 'Доставка клиенту с РЦ', '2024-01-01', None, TIMELINESS_BY_ROUTING, 2),
+            ('other', 'РЦ', '2024-01-01', None, TIMELINESS_BY_ROUTING, 1),
+            ('timely', None, '2024-01-02', None, TIMELINESS_BY_ROUTING, 3),
+            ('', None, '1970-01-01', 'Вовремя', TIMELINESS_BY_STATUS, 5),
+            ('', None, '1970-01-01', 'Просрочено', TIMELINESS_BY_STATUS, 2),
+            ('timely', None, '1970-01-01', None, TIMELINESS_BY_GROUP, 5),
+            ('delayed', None, '1970-01-01', None, TIMELINESS_BY_GROUP, 2),
+            ('other', None, '1970-01-01', None, TIMELINESS_BY_GROUP, 1),
+            ('', None, '1970-01-01', None, TIMELINESS_TOTAL, 8)
+        ]
+    )
+    aggregate = queries.get_timeliness_aggregate('2024-01-01', '2024-01-31')
+
+    assert aggregate['charts'] == {
+        'timely': [('2024-01-01', 'РЦ', 5)],
+        'delayed': [('2024-01-01', 'Доставка клиенту с РЦ', 2)]
+    }
+    assert aggregate['by_status'] == {'Вовремя': 5, 'Просрочено': 2}
+    assert queries.get_orders_timely('2024-01-01', '2024-01-31') == (5, 2, 8, 62.5)
+    assert queries.get_order_timeliness('2024-01-01', '2024-01-31') == (5, 2)
+    assert queries.get_timeliness_chart_data('2024-01-01', '2024-01-31', 'delayed') == [
+        {'period': '2024-01-01', 'Доставка_клиенту_с_РЦ': 2, 'РЦ': 0}
+    ]
@@ -0,0 +1,108 @@
+import pytest
+
+import data.queries as queries
+import data.rollups as rollups
+from data.result import QueryResult
+
+PROFILE_NAMES = ['hour', 'day', 'is_total', 'total_rows', 'delayed_rows', 'total_orders',
+                 'error_orders', 'claim_orders', 'error_types']
+PROFILE_TYPES = ['UInt8', 'Date', 'UInt8'] + ['Nullable(UInt64)'] * 5 + ['Nullable(String)']
+
+# Итоги часа за период: (строки, просроченные, заказы, заказы с ошибками,
+# по претензии, типы ошибок)
+HOURS = {
+    8: (10, 5, 8, 2, 3, 'Брак'),
+    9: (4, 4, 4, 4, 1, 'Пересорт'),
+    10: (20, 2, 10, 0, 2, '')
+}
+
+# Разбивка часа 8 по дням: уникальные заказы по дням в сумме больше итога
+DAYS = {
+    '2024-01-01': (6, 3, 5, 1, 2, 'Брак'),
+    '2024-01-02': (4, 2, 4, 1, 1, 'Брак')
+}
+
+
+def _profile_result():
+    # Часы без заказов и ошибок в ответ не попадают
+    rows = [(hour, '1970-01-01', 1) + counters for hour, counters in HOURS.items()]
+    rows += [(8, day, 0) + counters for day, counters in DAYS.items()]
+    return QueryResult.from_rows(PROFILE_NAMES, PROFILE_TYPES, sorted(rows))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    requested = []
+
+    def execute_query_cached(query, params=None, **kwargs):
+        requested.append((query, params))
+        return _profile_result()
+
+    monkeypatch.setattr(queries, 'execute_query_cached', execute_query_cached)
+    return requested
+
+
+def test_profile_covers_all_hours(server):
+    profile = queries.get_hourly_order_profile('2024-01-01', '2024-01-31')
+    assert [hour['hour'] for hour in profile] == list(range(24))
+    assert profile[8]['total_rows'] == 10 and profile[8]['error_types'] == 'Брак'
+    assert profile[0]['total_rows'] == 0 and profile[0]['error_types'] == ''
+
+
+def test_hour_totals_and_days(server):
+    profile = queries.get_hourly_order_profile('2024-01-01', '2024-01-31')
+    # Итог часа берется из набора (hour), а не суммой по дням
+    assert profile[8]['total_orders'] == 8
+    assert profile[8]['delay_percentage'] == 50.0
+    assert profile[8]['by_day'] == {
+        '2024-01-01': {'total_rows': 6, 'delayed_rows': 3, 'total_orders': 5, 'error_orders': 1,
+                       'claim_orders': 2, 'delay_percentage': 50.0, 'error_percentage': 20.0},
+        '2024-01-02': {'total_rows': 4, 'delayed_rows': 2, 'total_orders': 4, 'error_orders': 1,
+                       'claim_orders': 1, 'delay_percentage': 50.0, 'error_percentage': 25.0}
+    }
+    assert profile[9]['by_day'] == {}
+    assert profile[0]['delay_percentage'] == 0 and profile[0]['error_percentage'] == 0
+
+    query = server[0][0]
+    assert 'grouping(day) as is_total' in query
+    assert 'GROUPING SETS ((hour, day), (hour))' in query
+
+
+def test_rank_hours():
+    profile = [
+        {'hour': 1, 'total_rows': 10, 'delay_percentage': 30.0},
+        {'hour': 2, 'total_rows': 3, 'delay_percentage': 90.0},
+        {'hour': 3, 'total_rows': 8, 'delay_percentage': 60.0},
+        {'hour': 4, 'total_rows': 9, 'delay_percentage': 10.0}
+    ]
+    assert [hour['hour'] for hour in queries.rank_hours(profile, 'delay_percentage', top_n=2)] == [2, 3]
+    ranked = queries.rank_hours(profile, 'delay_percentage', min_counts={'total_rows': 5})
+    assert [hour['hour'] for hour in ranked] == [3, 1, 4]
+
+
+def test_problematic_hours(server):
+    hours = queries.get_problematic_hours('2024-01-01', '2024-01-31')
+    # Час 9 отброшен: меньше 5 строк
+    assert [(hour['hour'], hour['delay_percentage']) for hour in hours] == [(8, 50.0), (10, 10.0)]
+    assert hours[0]['total_orders'] == 10 and hours[0]['delayed_orders'] == 5
+
+
+def test_error_hours(server):
+    top = queries.get_error_hours_top_data('2024-01-01', '2024-01-31')
+    assert [(hour['hour'], hour['error_percentage']) for hour in top] == [(9, 100.0), (8, 25.0)]
+    assert top[1]['error_types'] == 'Брак'
+
+    claims = queries.get_error_hours_data('2024-01-01', '2024-01-31')
+    # Часы хотя бы с двумя заказами по претензии, по убыванию их числа
+    assert [(hour['hour'], hour['error_orders_count'], hour['error_percentage']) for hour in claims] == \
+        [(8, 3, 37.5), (10, 2, 20.0)]
+
+
+def test_one_query_for_all_hour_views(server):
+    queries.get_problematic_hours('2024-01-01', '2024-01-31')
+    queries.get_error_hours_top_data('2024-01-01', '2024-01-31')
+    queries.get_error_hours_data('2024-01-01', '2024-01-31')
+    assert len(server) == 3
+    assert len({query for query, _ in server}) == 1
+    assert server[0][1] == {'start_date': '2024-01-01', 'end_date': '2024-01-31',
+                            'rollup_until': rollups.NO_ROLLUP}
@@ -0,0 +1,51 @@
+from datetime import date, datetime
+
+from data.clickhouse_client import _format_param, bind_params, clickhouse_type
+from data.queries import _fio_list
+
+
+def test_scalar_formatting():
+    assert _format_param(None) == '\\N'
+    assert _format_param(True) == 'true'
+    assert _format_param(15) == '15'
+    assert _format_param(1.5) == '1.5'
+    assert _format_param(date(2024, 1, 31)) == '2024-01-31'
+    assert _format_param(datetime(2024, 1, 31, 8, 5, 0)) == '2024-01-31 08:05:00'
+
+
+def test_string_escaping():
+    # Значение параметра разбирается сервером в формате Escaped
+    assert _format_param("a\\b\tc\nd'e") == "a\\\\b\\tc\\nd'e"
+
+
+def test_array_escaping():
+    assert _format_param([]) == '[]'
+    assert _format_param([1, 2]) == '[1,2]'
+    assert _format_param(["O'Brien", 'a\\b', 'x\ty', 'l1\nl2']) == \
+        "['O\\'Brien','a\\\\b','x\\ty','l1\\nl2']"
+    assert _format_param((date(2024, 1, 1), date(2024, 2, 1))) == "['2024-01-01','2024-02-01']"
+
+
+def test_types_by_value():
+    assert clickhouse_type(True) == 'Bool'
+    assert clickhouse_type(1) == 'Int64'
+    assert clickhouse_type(date(2024, 1, 1)) == 'Date'
+    assert clickhouse_type(datetime(2024, 1, 1)) == 'DateTime'
+    assert clickhouse_type(['a']) == 'Array(String)'
+    assert clickhouse_type([]) == 'Array(String)'
+    assert clickhouse_type(None) == 'Nullable(String)'
+
+
+def test_bind_params_rewrites_legacy_placeholders():
+    query, url_params = bind_params(
+        "SELECT * FROM t WHERE fio IN %(names)s AND day = {day:Date} AND x = %(other)s",
+        {'names': ['Иванов'], 'day': '2024-01-01'}
+    )
+    assert query == "SELECT * FROM t WHERE fio IN {names:Array(String)} AND day = {day:Date} AND x = %(other)s"
+    assert url_params == {'param_names': "['Иванов']", 'param_day': '2024-01-01'}
+    assert bind_params("SELECT 1", None) == ("SELECT 1", {})
+
+
+def test_fio_list_is_stable():
+    assert _fio_list(['Петров', '', None, 'Иванов', 'Петров']) == ['Иванов', 'Петров']
+    assert _fio_list({'Петров', 'Иванов'}) == _fio_list(['Иванов', 'Петров'])
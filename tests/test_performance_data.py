@@ -0,0 +1,53 @@
+import pytest
+
+import data.queries as queries
+from data.result import QueryResult
+
+REGULAR_NAMES = ['employee', 'total_regular_ops', 'total_duration_sec', 'regular_earnings',
+                 'first_op_time', 'last_op_time']
+REGULAR_TYPES = ['String', 'UInt64', 'Float64', 'Float64', 'DateTime', 'DateTime']
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    """Подмена пакета запросов: обычные операции и операции приемки"""
+    state = {'regular': QueryResult.empty(), 'reception': {}}
+    monkeypatch.setattr(queries, 'run_batch', lambda tasks: [state['regular'], state['reception']])
+    return state
+
+
+def test_performance_data(batch):
+    batch['regular'] = QueryResult.from_rows(REGULAR_NAMES, REGULAR_TYPES, [
+        ('Иванов', 10, 1200.0, 500.0, '2024-01-10 08:00:00', '2024-01-10 10:00:00'),
+        ('', 3, 60.0, 10.0, '2024-01-10 08:00:00', '2024-01-10 09:00:00'),
+    ])
+    batch['reception'] = {
+        'Иванов': {'reception_count': 2, 'earnings': 100.0,
+                   'first_reception_time': '2024-01-10 07:30:00',
+                   'last_reception_time': '2024-01-10 09:00:00'},
+        'Петров': {'reception_count': 4, 'earnings': 1000.0,
+                   'first_reception_time': '2024-01-10 09:00:00',
+                   'last_reception_time': '2024-01-10 10:00:00'},
+    }
+    rows = queries.get_performance_data('2024-01-10', '2024-01-10')
+    assert [row['Сотрудник'] for row in rows] == ['Петров', 'Иванов']
+    ivanov = rows[1]
+    assert (ivanov['Общее_кол_операций'], ivanov['Заработок'], ivanov['Время_работы'],
+            ivanov['Время_первой_операции'], ivanov['Ср_время_на_операцию']) == \
+        (12, 600.0, '2ч 30м', '07:30', 2.0)
+    assert rows[0]['Обычные_операции'] == 0 and rows[0]['Приемка'] == 4
+
+
+def test_empty_period(batch):
+    assert queries.get_performance_data('2024-01-10', '2024-01-10') == []
+
+
+def test_processing_error_is_raised(batch):
+    batch['reception'] = {
+        'Петров': {'reception_count': 'четыре', 'earnings': 1000.0,
+                   'first_reception_time': '2024-01-10 09:00:00',
+                   'last_reception_time': '2024-01-10 10:00:00'},
+    }
+    # Ошибка в данных не превращается в пустую таблицу
+    with pytest.raises(ValueError):
+        queries.get_performance_data('2024-01-10', '2024-01-10')
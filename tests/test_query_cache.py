@@ -0,0 +1,88 @@
+import types
+
+import pytest
+
+import data.cache
+from data.cache import QueryCache, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Управляемое время только для модуля кэша
+    now = [1000.0]
+    monkeypatch.setattr(data.cache, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_lru_eviction_by_byte_budget(clock):
+    cache = QueryCache(max_bytes=100)
+    cache.set('a', 'A', size=40)
+    cache.set('b', 'B', size=40)
+    # Чтение делает 'a' недавно использованной, вытесняется 'b'
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C', size=40)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 80
+
+
+def test_oversized_value_rejected(clock):
+    cache = QueryCache(max_bytes=100)
+    cache.set('a', 'A', size=40)
+    assert cache.set('big', 'X', size=101) is False
+    assert cache.get('a') == 'A'
+    assert cache.stats()['rejected'] == 1
+
+
+def test_ttl_expiration(clock):
+    cache = QueryCache(default_ttl=10)
+    cache.set('a', 'A')
+    cache.set('b', 'B', ttl=60)
+    clock[0] += 11
+    assert cache.get('a') is None
+    assert cache.get('b') == 'B'
+    assert cache.stats()['expirations'] == 1
+
+
+def test_soft_ttl_marks_stale(clock):
+    cache = QueryCache()
+    cache.set('a', 'A', ttl=60, soft_ttl=10)
+    assert cache.lookup('a') == ('A', False)
+    clock[0] += 20
+    assert cache.lookup('a') == ('A', True)
+    clock[0] += 50
+    assert cache.lookup('a') == (None, False)
+
+
+def test_peek_does_not_count(clock):
+    cache = QueryCache()
+    assert cache.lookup('a') == (None, False)
+    assert cache.peek('a') == (None, False)
+    cache.set('a', 'A', ttl=60)
+    assert cache.peek('a') == ('A', False)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 1)
+
+
+def test_invalidate_by_meta(clock):
+    cache = QueryCache()
+    cache.set('a', 'A', meta={'tables': ['dm.fact_fines']})
+    cache.set('b', 'B', meta={'tables': ['dwh.orders_enriched']})
+    assert cache.invalidate(lambda meta: 'dm.fact_fines' in meta['tables']) == 1
+    assert cache.get('a') is None
+    assert cache.get('b') == 'B'
+
+
+def test_cache_key_ignores_whitespace_and_param_order():
+    key = make_cache_key("SELECT *\n  FROM t WHERE a = {a:Int64}", {'a': 1, 'b': 'x'})
+    assert key == make_cache_key("SELECT * FROM t   WHERE a = {a:Int64}", {'b': 'x', 'a': 1})
+    assert key != make_cache_key("SELECT * FROM t WHERE a = {a:Int64}", {'a': 2, 'b': 'x'})
+
+
+def test_cache_key_ignores_set_order():
+    key = make_cache_key("SELECT * FROM t WHERE b IN {b:Array(String)}", {'b': {'y', 'x'}})
+    assert key == make_cache_key("SELECT * FROM t WHERE b IN {b:Array(String)}", {'b': {'x', 'y'}})
+    assert key != make_cache_key("SELECT * FROM t WHERE b IN {b:Array(String)}", {'b': {'x'}})
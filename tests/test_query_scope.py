@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import data.clickhouse_client as clickhouse
+from data.cache import QueryCache, SingleFlight
+from data.clickhouse_client import (
+    CANCEL_SETTINGS, ClickHouseHTTPClient, QueryCancelledError, QueryTimeoutError, current_scope, query_scope, raise_if_cancelled,
+    run_shared
+)
+
+
+@pytest.fixture
+def killed(monkeypatch):
+    killed = []
+    monkeypatch.setattr(clickhouse, 'kill_query_async', killed.append)
+    return killed
+
+
+def test_new_scope_supersedes_previous(killed):
+    with query_scope('callback:client') as old:
+        old.register('q1')
+        old.register('q2')
+        old.unregister('q2')
+        with query_scope('callback:client') as new:
+            assert current_scope() is new
+            assert old.cancelled and not new.cancelled
+            assert killed == ['q1']
+            with pytest.raises(QueryCancelledError):
+                old.register('q3')
+        assert current_scope() is old
+    assert current_scope() is None
+
+
+def test_other_keys_are_independent(killed):
+    with query_scope('callback:a') as first, query_scope('callback:b'), query_scope():
+        assert not first.cancelled
+    assert killed == []
+
+
+def test_raise_if_cancelled(killed):
+    raise_if_cancelled()
+    with query_scope('key') as scope:
+        raise_if_cancelled()
+        scope.cancel()
+        with pytest.raises(QueryCancelledError):
+            raise_if_cancelled()
+
+
+def test_timeout_capped_by_scope_deadline():
+    with query_scope(timeout=5):
+        _, query_id, timeout, settings = clickhouse.clickhouse_client._query_limits(30)
+    assert timeout <= 5
+    assert settings == {'query_id': query_id, 'max_execution_time': 5}
+
+
+def test_expired_deadline_and_cancelled_scope():
+    with query_scope(timeout=5) as scope:
+        scope.deadline = time.monotonic() - 1
+        with pytest.raises(QueryTimeoutError):
+            clickhouse.clickhouse_client._query_limits()
+    with query_scope() as scope:
+        scope.cancel()
+        with pytest.raises(QueryCancelledError):
+            clickhouse.clickhouse_client._query_limits()
+
+
+def test_run_shared_retries_after_foreign_cancel():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            # Общий вызов вела чужая вытесненная область
+            raise QueryCancelledError("Запрос вытеснен более новым")
+        return 'result'
+
+    with query_scope():
+        assert run_shared(SingleFlight(), 'key', fn) == 'result'
+    assert len(calls) == 2
+
+
+def test_run_shared_does_not_retry_own_cancel():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise QueryCancelledError("Запрос вытеснен более новым")
+
+    with query_scope() as scope:
+        scope.cancel()
+        with pytest.raises(QueryCancelledError):
+            run_shared(SingleFlight(), 'key', fn)
+    assert len(calls) == 1
+
+
+def test_cancelled_result_not_cached(monkeypatch, killed):
+    cache = QueryCache(max_bytes=1 << 20)
+    monkeypatch.setattr(clickhouse, 'query_cache', cache)
+
+    def execute(query, params=None, raise_errors=False, timeout=None):
+        current_scope().cancel()
+        raise QueryCancelledError("Запрос вытеснен более новым")
+
+    monkeypatch.setattr(clickhouse.clickhouse_client, 'execute', execute)
+    with query_scope('key'):
+        result = clickhouse.execute_query_cached("SELECT 1")
+    assert len(result) == 0
+    assert cache.stats()['entries'] == 0
+
+
+def test_cancel_on_client_close_only_for_get():
+    setting = next(iter(CANCEL_SETTINGS))
+    for transport, method in (('get', 'GET'), ('post', 'POST')):
+        client = ClickHouseHTTPClient({'host': '127.0.0.1', 'port': 9, 'transport': transport})
+        request_method, url_params, _, _ = client._build_request("SELECT 1", None)
+        assert request_method == method
+        assert (setting in url_params) == (method == 'GET')
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+import data.queries as queries
+from data.cache import QueryCache
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    monkeypatch.setattr(queries, 'range_snapshots', QueryCache(default_ttl=60))
+    state = {'calls': [], 'release': threading.Event()}
+    state['release'].set()
+
+    def compute(start_date, end_date):
+        state['calls'].append((start_date, end_date))
+        state['release'].wait(5)
+        return {'range': (start_date, end_date), 'call': len(state['calls'])}
+
+    monkeypatch.setattr(queries, '_compute_range_snapshot', compute)
+    return state
+
+
+def test_snapshot_computed_once_for_concurrent_callers(computed):
+    computed['release'].clear()
+    shared = queries._snapshot_flight.stats()['shared']
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            queries.get_range_snapshot('2024-01-01', '2024-01-31')))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    # Три вызова ждут первый
+    while queries._snapshot_flight.stats()['shared'] - shared < 3 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    computed['release'].set()
+    for thread in threads:
+        thread.join()
+
+    assert computed['calls'] == [('2024-01-01', '2024-01-31')]
+    assert all(result is results[0] for result in results)
+
+
+def test_snapshot_cached_per_range(computed):
+    first = queries.get_range_snapshot('2024-01-01', '2024-01-31')
+    assert queries.get_range_snapshot('2024-01-01', '2024-01-31') is first
+    other = queries.get_range_snapshot('2024-02-01', '2024-02-29')
+    assert other['range'] == ('2024-02-01', '2024-02-29')
+    assert len(computed['calls']) == 2
+
+
+def test_refresh_recomputes_snapshot(computed):
+    first = queries.get_range_snapshot('2024-01-01', '2024-01-31')
+    refreshed = queries.refresh_data('2024-01-01', '2024-01-31')
+    assert refreshed['call'] == first['call'] + 1
+    assert queries.get_range_snapshot('2024-01-01', '2024-01-31') is refreshed
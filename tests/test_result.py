@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from data.result import QueryResult, base_type, numpy_dtype
+
+
+def _result():
+    return QueryResult.from_rows(
+        ['fio', 'ops', 'amount', 'day'],
+        ['LowCardinality(String)', 'UInt32', 'Nullable(Float64)', 'Date'],
+        [('Иванов', 3, 1.5, '2024-01-01'), ('Петров', 5, None, '2024-01-02')]
+    )
+
+
+def test_behaves_like_row_list():
+    result = _result()
+    assert len(result) == 2
+    assert result
+    assert result[0] == ('Иванов', 3, 1.5, '2024-01-01')
+    assert result[-1][0] == 'Петров'
+    assert result[0:1] == [('Иванов', 3, 1.5, '2024-01-01')]
+    assert list(result) == [result[0], result[1]]
+    assert result.column('ops') == [3, 5]
+
+
+def test_empty_result():
+    assert not QueryResult.empty()
+    assert len(QueryResult.empty()) == 0
+    assert list(QueryResult.from_rows(['x'], ['Int32'], [])) == []
+
+
+def test_dtypes():
+    assert base_type('LowCardinality(String)') == 'String'
+    assert base_type('Nullable(Float64)') == 'Float64'
+    assert base_type('LowCardinality(Nullable(String))') == 'String'
+    assert numpy_dtype('LowCardinality(Nullable(UInt32))') is np.float64
+    assert numpy_dtype('UInt64') is np.uint64
+    assert numpy_dtype('Int32') is np.int64
+    # NULL в числовой колонке становится NaN
+    assert numpy_dtype('Nullable(Int32)') is np.float64
+    assert numpy_dtype('Date') == 'datetime64[D]'
+    assert numpy_dtype('String') is object
+
+
+def test_numpy_and_dataframe():
+    result = _result()
+    amount = result.to_numpy('amount')
+    assert amount[0] == 1.5 and np.isnan(amount[1])
+    # Массив колонки строится один раз
+    assert result.to_numpy('amount') is amount
+    assert result.to_numpy('day').dtype == np.dtype('datetime64[D]')
+
+    df = result.to_dataframe()
+    assert list(df.columns) == ['fio', 'ops', 'amount', 'day']
+    assert df['ops'].sum() == 8
+
+
+def test_cached_arrays_are_read_only():
+    result = _result()
+    amount = result.to_numpy('amount')
+    assert not amount.flags.writeable
+    with pytest.raises(ValueError):
+        amount[0] = 0
+    assert result.to_numpy('amount')[0] == 1.5
@@ -0,0 +1,163 @@
+import pytest
+
+import data.rollups as rollups
+from data.rollups import (
+    NO_ROLLUP, PARTS_QUERY, ROLLUPS, SOURCE_MONTHS_QUERY, STATE_QUERY, RollupManager, rollup_source
+)
+
+SOURCE = ROLLUPS['orders_hourly'].source
+
+
+class Server:
+    """
+    Заглушка ClickHouse: партиции исходной таблицы (partition_id, min_date,
+    max_date, rows, max_block_number), rollup.rollup_state и rollup.source_months
+    """
+
+    def __init__(self, parts, source=SOURCE, months=()):
+        self.parts = parts
+        self.source = source
+        # Месяцы таблицы без разбиения по дате (SELECT DISTINCT)
+        self.months = list(months)
+        self.state = {}
+        self.source_months = {}
+        self.queries = []
+        self.available = True
+
+    def execute(self, query, params=None, raise_errors=False, timeout=None, settings=None):
+        if not self.available:
+            raise ConnectionError("сервер недоступен")
+        if query == STATE_QUERY:
+            return [(name, month, mark) for (name, month), mark in self.state.items()]
+        if query == SOURCE_MONTHS_QUERY:
+            return [(source, mark, months) for source, (mark, months) in self.source_months.items()]
+        if query == PARTS_QUERY:
+            return [(self.source,) + part for part in self.parts]
+        if 'INSERT INTO rollup.rollup_state' in query:
+            self.state[(params['rollup_name'], params['month'])] = params['mark']
+        if 'INSERT INTO rollup.source_months' in query:
+            self.source_months[params['source']] = (params['mark'], params['months'])
+        self.queries.append((query, params))
+        if 'SELECT DISTINCT' in query:
+            return [(month,) for month in self.months]
+        return []
+
+    def replaced(self):
+        """Месяцы, подмененные REPLACE PARTITION"""
+        return [query.split('REPLACE PARTITION ')[1].split()[0]
+                for query, _ in self.queries if 'REPLACE PARTITION' in query]
+
+
+@pytest.fixture
+def server():
+    return Server([
+        ('202401', '2024-01-01', '2024-01-31', 1000, 3),
+        ('202402', '2024-02-01', '2024-02-29', 800, 7),
+        ('202403', '2024-03-01', '2024-03-10', 300, 9),
+    ])
+
+
+@pytest.fixture
+def manager(server, tmp_path):
+    return RollupManager(server, {'orders_hourly': ROLLUPS['orders_hourly']}, interval=0,
+                         months_per_run=2, status_ttl=3600, lock_path=str(tmp_path / 'lock'))
+
+
+def test_not_ready_before_build(manager):
+    assert manager.ready_until('orders_hourly') is None
+    manager.load_status()
+    assert manager.ready_until('orders_hourly') is None
+
+
+def test_builds_oldest_months_first(manager, server):
+    manager.refresh()
+    assert server.replaced() == ['202401', '202402']
+    assert manager.ready_until('orders_hourly') == '2024-02-29'
+    manager.refresh()
+    assert server.replaced() == ['202401', '202402', '202403']
+    assert manager.ready_until('orders_hourly') == '2024-03-31'
+    # Месяц собирается за все свои дни
+    insert = next(params for query, params in server.queries if query.startswith('INSERT INTO rollup.orders'))
+    assert (str(insert['start_date']), str(insert['end_date']), insert['rollup_until']) == \
+        ('2024-01-01', '2024-01-31', NO_ROLLUP)
+
+
+def test_changed_month_is_rebuilt(manager, server):
+    manager.refresh()
+    manager.refresh()
+    server.queries.clear()
+    # Вставка в феврале: новый кусок с большим номером блока
+    server.parts[1] = ('202402', '2024-02-01', '2024-02-29', 850, 10)
+    manager.load_status()
+    # Готовый ряд обрывается на измененном месяце
+    assert manager.ready_until('orders_hourly') == '2024-01-31'
+    manager.refresh()
+    assert server.replaced() == ['202402']
+    assert manager.ready_until('orders_hourly') == '2024-03-31'
+
+
+def test_merge_does_not_rebuild(manager, server):
+    manager.refresh()
+    manager.refresh()
+    server.queries.clear()
+    # После слияния кусков февраля строки и наибольший номер блока партиции те же
+    server.parts[1] = ('202402', '2024-02-01', '2024-02-29', 800, 7)
+    manager.load_status()
+    manager.refresh()
+    assert server.replaced() == []
+    assert manager.ready_until('orders_hourly') == '2024-03-31'
+
+
+def test_unpartitioned_source_months_persisted(tmp_path):
+    rollup = ROLLUPS['fines_daily']
+    server = Server([('all', '1970-01-01', '1970-01-01', 500, 4)], source=rollup.source,
+                    months=['2024-01-01', '2024-02-01'])
+
+    def manager():
+        return RollupManager(server, {'fines_daily': rollup}, interval=0, status_ttl=3600,
+                             lock_path=str(tmp_path / 'lock'))
+
+    def distinct_queries():
+        return sum('SELECT DISTINCT' in query for query, _ in server.queries)
+
+    first = manager()
+    first.refresh()
+    assert server.replaced() == ['202401', '202402']
+    assert first.ready_until('fines_daily') == '2024-02-29'
+    assert distinct_queries() == 1
+    # Другой процесс берет месяцы из rollup.source_months, пока таблица не менялась
+    second = manager()
+    second.load_status()
+    assert second.ready_until('fines_daily') == '2024-02-29'
+    assert distinct_queries() == 1
+    # Любое изменение таблицы пересобирает все ее месяцы
+    server.parts[0] = ('all', '1970-01-01', '1970-01-01', 510, 5)
+    second.refresh()
+    assert distinct_queries() == 2
+    assert server.replaced() == ['202401', '202402', '202401', '202402']
+
+
+def test_unavailable_rollups(manager, server):
+    server.available = False
+    assert manager.load_status() is None
+    assert manager.ready_until('orders_hourly') is None
+    assert manager.stats()['available'] is False
+
+
+def test_rollup_source_without_ready_months(monkeypatch):
+    monkeypatch.setattr(rollups.rollups, 'ready_until', lambda name: None)
+    source, params = rollup_source('orders_hourly')
+    assert source == ROLLUPS['orders_hourly'].select
+    assert params == {'rollup_until': NO_ROLLUP}
+
+
+def test_rollup_source_splits_at_rollup_until(monkeypatch):
+    monkeypatch.setattr(rollups.rollups, 'ready_until', lambda name: '2024-02-29')
+    source, params = rollup_source('orders_hourly')
+    assert params == {'rollup_until': '2024-02-29'}
+    rollup_part, source_part = source.split('UNION ALL')
+    # Дни до rollup_until - из витрины, после - из исходной таблицы
+    assert 'FROM rollup.orders_hourly' in rollup_part
+    assert 'least({end_date:Date}, {rollup_until:Date})' in rollup_part
+    assert f'FROM {SOURCE}' in source_part
+    assert 'greatest({start_date:Date}, {rollup_until:Date} + 1)' in source_part
@@ -0,0 +1,70 @@
+import contextvars
+import threading
+
+import pytest
+
+import data.clickhouse_client as clickhouse
+from data.clickhouse_client import run_batch
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def test_results_in_task_order():
+    assert run_batch([lambda value=value: value * 2 for value in range(10)],
+                     max_concurrency=3) == [value * 2 for value in range(10)]
+
+
+def test_error_raised_after_all_tasks_finish():
+    finished = []
+
+    def fail():
+        raise ValueError("ошибка")
+
+    def work(value):
+        finished.append(value)
+        return value
+
+    with pytest.raises(ValueError):
+        run_batch([lambda: work(1), fail, lambda: work(2)])
+    assert sorted(finished) == [1, 2]
+
+
+def test_nested_batch_runs_inline():
+    def outer():
+        thread = threading.current_thread()
+        # Вложенный пакет выполняется в потоке внешней задачи
+        return run_batch([lambda: threading.current_thread() is thread for _ in range(3)])
+
+    # Вложенных пакетов больше, чем потоков в пуле: без выполнения на
+    # месте они заняли бы весь пул и ждали друг друга
+    results = run_batch([outer for _ in range(clickhouse.batch_max_workers * 2)])
+    assert results == [[True, True, True]] * (clickhouse.batch_max_workers * 2)
+
+
+def test_context_is_copied_into_tasks():
+    token = request_id.set('abc')
+    try:
+        assert run_batch([request_id.get, request_id.get]) == ['abc', 'abc']
+    finally:
+        request_id.reset(token)
+
+
+def test_execute_query_batch_forwards_options(monkeypatch):
+    calls = []
+
+    def execute_query_cached(query, params=None, **options):
+        calls.append((query, options))
+        return query
+
+    monkeypatch.setattr(clickhouse, 'execute_query_cached', execute_query_cached)
+    results = clickhouse.execute_query_batch([
+        ("SELECT 1", None),
+        ("SELECT 2", {'a': 1}, {'profile': 'heavy', 'ttl': 0})
+    ], ttl=60, timeout=5, profile='background')
+
+    assert results == ["SELECT 1", "SELECT 2"]
+    options = dict(calls)
+    assert options["SELECT 1"] == {'ttl': 60, 'policy': None, 'timeout': 5,
+                                   'profile': 'background', 'external_tables': None}
+    assert options["SELECT 2"] == {'ttl': 0, 'policy': None, 'timeout': 5,
+                                   'profile': 'heavy', 'external_tables': None}
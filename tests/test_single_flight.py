@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from data.cache import SingleFlight
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("условие не выполнено за отведенное время")
+        time.sleep(0.005)
+
+
+def _run_concurrently(flight, fn, count):
+    results = [None] * count
+
+    def call(index):
+        try:
+            results[index] = flight.do('key', fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    threads, results = _run_concurrently(flight, fn, 5)
+    # Все потоки, кроме ведущего, ждут его результата
+    _wait_for(lambda: flight.stats()['shared'] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'calls': 1, 'shared': 4, 'in_flight': 0}
+
+
+def test_exception_is_shared_and_key_released():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("ошибка")
+
+    threads, results = _run_concurrently(flight, fail, 3)
+    _wait_for(lambda: flight.stats()['shared'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, ValueError) for result in results)
+    # После ошибки ключ свободен, следующий вызов выполняется заново
+    assert flight.do('key', lambda: 42) == 42
+    assert flight.stats()['calls'] == 2
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do('key', lambda: {}['missing'])
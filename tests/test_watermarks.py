@@ -0,0 +1,209 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from data.cache import QueryCache, SharedDiskCache
+from data.watermarks import WATERMARK_QUERY, WatermarkTracker, cache_meta
+
+TABLE = 'dm.fact_fines'
+OTHER = 'dwh.orders_enriched'
+QUERY = f"SELECT count() FROM {TABLE} WHERE date_key <= {{end_date:Date}}"
+
+
+class Server:
+    """
+    Заглушка ClickHouse: активные куски (таблица, partition_id, min_date,
+    строки, min_block, max_block), сгруппированные по партициям как в WATERMARK_QUERY
+    """
+
+    def __init__(self, parts=()):
+        self.parts = list(parts)
+        self.release = threading.Event()
+        self.release.set()
+        self.available = True
+
+    def execute(self, query, params=None, raise_errors=False, settings=None):
+        assert query == WATERMARK_QUERY
+        self.release.wait()
+        if not self.available:
+            raise ConnectionError("сервер недоступен")
+        partitions = {}
+        for table, partition, min_date, rows, _, max_block in self.parts:
+            if table not in params['tables']:
+                continue
+            previous = partitions.get((table, partition), (min_date, 0, 0))
+            partitions[(table, partition)] = (min(previous[0], min_date), previous[1] + rows,
+                                              max(previous[2], max_block))
+        return [(table, partition) + mark for (table, partition), mark in partitions.items()]
+
+    def insert(self, table, partition, min_date, rows):
+        block = max((part[5] for part in self.parts), default=0) + 1
+        self.parts.append((table, partition, min_date, rows, block, block))
+
+    def merge(self, table, partition):
+        """Слияние всех кусков партиции в один"""
+        merged = [part for part in self.parts if part[:2] == (table, partition)]
+        self.parts = [part for part in self.parts if part[:2] != (table, partition)]
+        self.parts.append((table, partition, min(part[2] for part in merged),
+                           sum(part[3] for part in merged), min(part[4] for part in merged),
+                           max(part[5] for part in merged)))
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    server.insert(TABLE, '202401', '2024-01-01', 100)
+    server.insert(TABLE, '202401', '2024-01-15', 50)
+    server.insert(TABLE, '202402', '2024-02-01', 80)
+    server.insert(OTHER, '202402', '2024-02-01', 10)
+    return server
+
+
+def _meta(tracker, end_date, query=QUERY):
+    return tracker.stamp(cache_meta(query, {'end_date': end_date}))
+
+
+@pytest.fixture
+def tracked(server):
+    cache = QueryCache()
+    tracker = WatermarkTracker(server, cache, [TABLE, OTHER], interval=3600)
+    tracker.probe()
+    for key, end_date in (('jan', '2024-01-31'), ('feb', '2024-02-29')):
+        cache.set(key, key, meta=_meta(tracker, end_date))
+    cache.set('other', 'other', meta=_meta(tracker, '2024-02-29', f"SELECT count() FROM {OTHER}"))
+    return cache, tracker
+
+
+def test_first_probe_does_not_invalidate(tracked):
+    cache, tracker = tracked
+    assert tracker.stats()['tables'] == {TABLE: 2, OTHER: 1}
+    assert tracker.stats()['changes'] == 0
+    assert cache.get('jan') == 'jan'
+
+
+def test_insert_invalidates_from_changed_partition(tracked, server):
+    cache, tracker = tracked
+    server.insert(TABLE, '202402', '2024-02-10', 5)
+    tracker.probe()
+    # Январь и другие таблицы не затронуты
+    assert (cache.get('jan'), cache.get('feb'), cache.get('other')) == ('jan', None, 'other')
+    assert tracker.stats()['changes'] == 1
+    assert tracker.stats()['invalidated'] == 1
+
+
+def test_merge_does_not_invalidate(tracked, server):
+    cache, tracker = tracked
+    meta = cache._entries['jan'].meta
+    server.merge(TABLE, '202401')
+    tracker.probe()
+    assert cache.get('jan') == 'jan' and cache.get('feb') == 'feb'
+    assert tracker.stats()['changes'] == 0
+    assert tracker.is_valid(meta) is True
+
+
+def test_dropped_partition_uses_previous_date(tracked, server):
+    cache, tracker = tracked
+    server.parts = [part for part in server.parts if part[:2] != (TABLE, '202401')]
+    tracker.probe()
+    assert cache.get('jan') is None and cache.get('feb') is None
+    assert cache.get('other') == 'other'
+
+
+def test_unpartitioned_table_invalidates_everything(server):
+    server.parts = [(TABLE, 'all', '1970-01-01', 100, 1, 1)]
+    cache = QueryCache()
+    tracker = WatermarkTracker(server, cache, [TABLE], interval=3600)
+    tracker.probe()
+    cache.set('jan', 'jan', meta=_meta(tracker, '2024-01-31'))
+    server.insert(TABLE, 'all', '1970-01-01', 1)
+    tracker.probe()
+    assert cache.get('jan') is None
+
+
+def test_is_valid_compares_dates_of_entry(tracked, server):
+    _, tracker = tracked
+    jan, feb = _meta(tracker, '2024-01-31'), _meta(tracker, '2024-02-29')
+    server.insert(TABLE, '202402', '2024-02-10', 5)
+    tracker.probe()
+    assert tracker.is_valid(jan) is True
+    assert tracker.is_valid(feb) is False
+    # Запись без водяных знаков проверить нечем
+    assert tracker.is_valid(cache_meta(QUERY, {'end_date': '2024-01-31'})) is None
+    assert tracker.is_valid(cache_meta("SELECT 1 FROM system.one")) is True
+
+
+def test_ttl_for(server):
+    tracker = WatermarkTracker(server, QueryCache(), [TABLE], interval=3600, history_ttl=86400)
+    past = cache_meta(QUERY, {'end_date': '2024-01-31'})
+    # До первой проверки изменения не отслеживаются
+    assert tracker.ttl_for(past, 300) == 300
+    tracker.ensure_started()
+    assert tracker._first_probe.wait(5)
+    assert tracker.ttl_for(past, 300) == 86400
+    today = cache_meta(QUERY, {'end_date': date.today() + timedelta(days=1)})
+    assert tracker.ttl_for(today, 300) == 300
+    untracked = cache_meta(f"SELECT count() FROM {OTHER}", {'end_date': '2024-01-31'})
+    assert tracker.ttl_for(untracked, 300) == 300
+
+
+@pytest.fixture
+def shared(tmp_path, server):
+    """Запись другого процесса в общем кэше"""
+    writer = QueryCache(backend=SharedDiskCache(str(tmp_path)))
+    tracker = WatermarkTracker(server, writer, [TABLE], interval=3600)
+    tracker.probe()
+    writer.set('key', 'value', meta=_meta(tracker, '2024-01-31'))
+    return writer.backend
+
+
+def _reader(server, shared, interval=3600):
+    cache = QueryCache(backend=shared)
+    tracker = WatermarkTracker(server, cache, [TABLE], interval=interval, first_probe_wait=0.05)
+    return cache, tracker
+
+
+def test_shared_entry_kept_until_first_probe(shared, server):
+    server.release.clear()
+    cache, tracker = _reader(server, shared)
+    tracker.ensure_started()
+    # Первая проверка еще идет: промах, но запись других процессов не удаляется
+    assert cache.get('key') is None
+    assert shared.get('key') is not None
+
+    server.release.set()
+    assert tracker._first_probe.wait(5)
+    assert cache.get('key') == 'value'
+
+
+def test_shared_entry_changed_after_creation(shared, server):
+    server.insert(TABLE, '202401', '2024-01-20', 1)
+    cache, tracker = _reader(server, shared)
+    tracker.ensure_started()
+    assert cache.get('key') is None
+    # Данные за даты записи изменились после ее создания
+    assert shared.get('key') is None
+
+
+def test_shared_entry_survives_merge_and_later_data(shared, server):
+    server.merge(TABLE, '202401')
+    server.insert(TABLE, '202403', '2024-03-01', 1)
+    cache, tracker = _reader(server, shared)
+    tracker.ensure_started()
+    assert cache.get('key') == 'value'
+
+
+def test_failed_first_probe_keeps_entry(shared, server):
+    server.available = False
+    cache, tracker = _reader(server, shared)
+    tracker.ensure_started()
+    assert tracker._first_probe.wait(5)
+    assert tracker.is_valid(shared.get('key')[3]) is None
+    assert cache.get('key') is None
+    assert shared.get('key') is not None
+
+
+def test_disabled_tracker_trusts_entries(shared, server):
+    cache, tracker = _reader(server, shared, interval=0)
+    tracker.ensure_started()
+    assert cache.get('key') == 'value'